@@ -88,7 +88,10 @@ def main():
         summary = orchestrator.run(pytest_args)
 
         # Exit with appropriate code
-        if summary['code_bugs'] > 0:
+        if summary['pytest_timed_out']:
+            print(f"\n Pytest timed out - the test suite could not be checked")
+            sys.exit(1)
+        elif summary['code_bugs'] > 0:
             print(f"\n {summary['code_bugs']} code bug(s) remain - these need manual fixes")
             sys.exit(1)
         elif summary['failed_fixes'] > 0:
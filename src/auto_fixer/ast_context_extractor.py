@@ -7,10 +7,37 @@ Extracts relevant source code context based on test imports.
 import ast
 import os
 import re
-from typing import Dict, List, Set, Optional
+from typing import Dict, List, Set, Optional, Tuple
 from pathlib import Path
 
 
+def _find_function_node(tree: ast.AST, name: str) -> Optional[ast.AST]:
+    """
+    Find a function definition by name.
+
+    Tests are top-level functions or methods of top-level classes, so those
+    are scanned directly; the full ast.walk is only a fallback.
+    """
+    function_types = (ast.FunctionDef, ast.AsyncFunctionDef)
+    body = getattr(tree, 'body', [])
+
+    for node in body:
+        if isinstance(node, function_types) and node.name == name:
+            return node
+
+    for node in body:
+        if isinstance(node, ast.ClassDef):
+            for sub in node.body:
+                if isinstance(sub, function_types) and sub.name == name:
+                    return sub
+
+    for node in ast.walk(tree):
+        if isinstance(node, function_types) and node.name == name:
+            return node
+
+    return None
+
+
 class ASTContextExtractor:
     """
     Extracts relevant source code based on test file imports.
@@ -37,6 +64,8 @@ class ASTContextExtractor:
         self.max_source_lines = 200
         # Cache for source maps (performance optimization)
         self._source_map_cache = {}
+        # Route decorator index per source file: (method, path) -> handler name
+        self._route_index_cache = {}
 
     def extract_context(
         self,
@@ -72,14 +101,14 @@ class ASTContextExtractor:
         imports = self._extract_imports(tree)
 
         # Extract the specific test function code
-        test_func_code = self._extract_test_function(tree, test_function_name)
+        test_func_code = self._extract_test_function(tree, test_function_name, test_content)
 
         # Analyze imports used in the test function
         test_imports = self._get_function_imports(test_func_code, imports)
 
         # NEW: Extract HTTP endpoints from test code (for e2e/integration tests)
         http_endpoints = self._extract_http_endpoints(test_func_code)
-        if http_endpoints and self.verbose:
+        if self.verbose and http_endpoints:
             print(f"HTTP endpoints detected: {http_endpoints[:3]}")
 
         # Resolve import paths to actual files
@@ -91,7 +120,7 @@ class ASTContextExtractor:
             if self.verbose:
                 print(f"No source files from imports, searching for HTTP endpoint handlers...")
             source_files = self._find_files_with_http_endpoints(http_endpoints)
-            if source_files and self.verbose:
+            if self.verbose and source_files:
                 print(f"Found {len(source_files)} file(s) with matching endpoints")
 
         # Extract relevant code from each source file
@@ -231,13 +260,21 @@ class ASTContextExtractor:
 
         return imports
 
-    def _extract_test_function(self, tree: ast.AST, func_name: str) -> str:
+    def _extract_test_function(
+        self,
+        tree: ast.AST,
+        func_name: str,
+        source: Optional[str] = None
+    ) -> str:
         """
         Extract the source code of a specific test function.
 
         Args:
             tree: AST tree
             func_name: Function name to extract (may include parameters like "test_foo[param]")
+            source: Source the tree was parsed from; if given, the function
+                    (with its decorators) is sliced from it by line range
+                    instead of being regenerated with ast.unparse
 
         Returns:
             Source code of the function
@@ -246,11 +283,15 @@ class ASTContextExtractor:
         # e.g., "test_foo[param]" → "test_foo"
         base_func_name = func_name.split('[')[0] if '[' in func_name else func_name
 
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == base_func_name:
-                return ast.unparse(node)
+        node = _find_function_node(tree, base_func_name)
+        if node is None:
+            return ""
+        if source is None:
+            return ast.unparse(node)
 
-        return ""
+        start = node.decorator_list[0].lineno if node.decorator_list else node.lineno
+        lines = source.splitlines(keepends=True)
+        return ''.join(lines[start - 1:node.end_lineno]).rstrip('\r\n')
 
     def _get_function_imports(
         self,
@@ -307,16 +348,29 @@ class ASTContextExtractor:
 
         return endpoints
 
+    def _get_route_index(self, source_file: str) -> Dict[tuple[str, str], str]:
+        """
+        Get the route decorator index for a source file.
+
+        Args:
+            source_file: Path to source file
+
+        Returns:
+            Dict mapping (method, endpoint) to handler function name
+        """
+        if source_file not in self._route_index_cache:
+            self._build_source_map(source_file)
+        return self._route_index_cache.get(source_file, {})
+
     def _map_endpoints_to_handlers(
         self,
         http_endpoints: List[tuple[str, str]],
-        source_file: str,
-        source_map: Dict[str, Dict]
+        source_file: str
     ) -> Set[str]:
         """
         Map HTTP endpoints to their FastAPI handler functions.
 
-        Looks for decorators like:
+        Looks up decorators like:
         - @app.get("/health")
         - @app.post("/predict")
         - @router.get("/model/info")
@@ -324,41 +378,51 @@ class ASTContextExtractor:
         Args:
             http_endpoints: List of (method, endpoint) tuples
             source_file: Path to source file
-            source_map: Source map with function definitions
 
         Returns:
             Set of handler function names
         """
-        handlers = set()
+        route_index = self._get_route_index(source_file)
+        handlers = {route_index[endpoint] for endpoint in http_endpoints if endpoint in route_index}
 
-        try:
-            with open(source_file, 'r') as f:
-                content = f.read()
-            tree = ast.parse(content)
-        except:
-            return handlers
+        if self.verbose:
+            for endpoint in http_endpoints:
+                if endpoint in route_index:
+                    print(f"{endpoint[0]} {endpoint[1]} - {route_index[endpoint]}()")
 
-        # Build endpoint -> function mapping
-        for node in ast.walk(tree):
-            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                continue
+        return handlers
 
-            # Check decorators for route definitions
-            for decorator in node.decorator_list:
-                route_info = self._parse_route_decorator(decorator)
-                if not route_info:
-                    continue
+    def _collect_handlers_and_decorator_deps(
+        self,
+        http_endpoints: List[tuple[str, str]],
+        source_file: str,
+        source_map: Dict[str, Dict]
+    ) -> Tuple[Set[str], Set[str]]:
+        """
+        Map HTTP endpoints to handlers and collect their decorator dependencies.
 
-                method, endpoint = route_info
+        Handlers come from the route index built with the source map, so
+        only the matched handlers' decorators are inspected for
+        `dependencies=[Depends(...)]`.
 
-                # Match against HTTP endpoints from test
-                for test_method, test_endpoint in http_endpoints:
-                    if method == test_method and endpoint == test_endpoint:
-                        handlers.add(node.name)
-                        if self.verbose:
-                            print(f"{method} {endpoint} - {node.name}()")
+        Args:
+            http_endpoints: List of (method, endpoint) tuples
+            source_file: Path to source file
+            source_map: Source map with function definitions
 
-        return handlers
+        Returns:
+            (handler function names, dependency function names)
+        """
+        handlers = self._map_endpoints_to_handlers(http_endpoints, source_file)
+        decorator_dependencies = set()
+
+        for handler_name in handlers:
+            if handler_name in source_map:
+                decorator_dependencies.update(
+                    self._extract_decorator_dependencies(source_map[handler_name]['node'], source_map)
+                )
+
+        return handlers, decorator_dependencies
 
     def _parse_route_decorator(self, decorator: ast.expr) -> Optional[tuple[str, str]]:
         """
@@ -880,6 +944,9 @@ class ASTContextExtractor:
         """
         Build an index of all definitions in the source file.
 
+        Route decorators on top-level functions are indexed in the same pass
+        (see _get_route_index).
+
         Args:
             source_file: Path to source file
 
@@ -890,7 +957,8 @@ class ASTContextExtractor:
                     'node': ast.FunctionDef,
                     'line_start': int,
                     'line_end': int,
-                    'code': str
+                    'code': str,
+                    'deps': frozenset  # direct dependencies in this file
                 }
             }
         """
@@ -910,6 +978,7 @@ class ASTContextExtractor:
             return {}
 
         source_map = {}
+        route_index = {}
 
         # Walk through all top-level definitions
         for node in tree.body:
@@ -919,6 +988,12 @@ class ASTContextExtractor:
                 # Function definitions
                 name = node.name
 
+                # Index route decorators: @app.get("/health") -> ('GET', '/health')
+                for decorator in node.decorator_list:
+                    route_info = self._parse_route_decorator(decorator)
+                    if route_info:
+                        route_index.setdefault(route_info, name)
+
             elif isinstance(node, ast.ClassDef):
                 # Class definitions
                 name = node.name
@@ -945,8 +1020,19 @@ class ASTContextExtractor:
                     'code': code
                 }
 
+        # Index direct dependencies once per definition (one walk per node),
+        # so dependency closures never re-walk the same subtree
+        for name, info in source_map.items():
+            deps = {
+                child.id for child in ast.walk(info['node'])
+                if isinstance(child, ast.Name) and child.id in source_map
+            }
+            deps.discard(name)
+            info['deps'] = frozenset(deps)
+
         # Cache the result
         self._source_map_cache[source_file] = source_map
+        self._route_index_cache[source_file] = route_index
 
         if self.verbose and source_map:
             print(f"Built source map: {len(source_map)} definitions found")
@@ -988,7 +1074,6 @@ class ASTContextExtractor:
 
         for match in re.finditer(pattern, error_message):
             file_path = match.group(1)
-            line_number = int(match.group(2))
             function_name = match.group(3)
 
             # Check if this traceback entry is from our source file
@@ -1002,7 +1087,7 @@ class ASTContextExtractor:
                     functions.add(function_name)
 
                     if self.verbose:
-                        print(f"Found in traceback: {function_name} (line {line_number})")
+                        print(f"Found in traceback: {function_name} (line {match.group(2)})")
             except:
                 # If path normalization fails, try basic string matching
                 if source_file_name in file_path:
@@ -1012,88 +1097,39 @@ class ASTContextExtractor:
 
     def _find_dependencies(
         self,
-        node: ast.AST,
+        target_names: Set[str],
         source_map: Dict[str, Dict],
-        max_depth: int = 3,
-        visited: Optional[Set[str]] = None
+        max_depth: int = 3
     ) -> Set[str]:
         """
-        Find all functions/variables that a node depends on (recursive).
+        Find all functions/variables that the targets depend on.
+
+        Breadth-first walk over the direct dependencies precomputed in
+        the source map, so each definition is expanded at most once no
+        matter how many targets reach it.
 
         Args:
-            node: AST node to analyze
+            target_names: Names to compute the dependency closure for
             source_map: Map of all available definitions
-            max_depth: Maximum recursion depth (prevent infinite loops)
-            visited: Set of already visited names (for cycle detection)
+            max_depth: Maximum number of dependency hops to follow
 
         Returns:
             Set of dependency names
         """
-        if visited is None:
-            visited = set()
+        dependencies = set()
+        frontier = {name for name in target_names if name in source_map}
 
-        if max_depth <= 0:
-            return set()
+        for _ in range(max_depth):
+            next_frontier = set()
+            for name in frontier:
+                next_frontier.update(source_map[name].get('deps', ()))
 
-        dependencies = set()
+            next_frontier -= dependencies
+            if not next_frontier:
+                break
 
-        # Walk through the function/class body
-        for child in ast.walk(node):
-            # Find Name nodes (variable/function references)
-            if isinstance(child, ast.Name):
-                name = child.id
-
-                # Check if this name is defined in our source map
-                if name in source_map and name not in visited:
-                    dependencies.add(name)
-                    visited.add(name)
-
-                    # Recursively find dependencies of this dependency
-                    dep_node = source_map[name]['node']
-                    try:
-                        sub_deps = self._find_dependencies(
-                            dep_node,
-                            source_map,
-                            max_depth - 1,
-                            visited
-                        )
-                        dependencies.update(sub_deps)
-                    except RecursionError:
-                        # Safety net for deep recursion
-                        pass
-
-            # Find function calls
-            elif isinstance(child, ast.Call):
-                # Direct function call: predict(text)
-                if isinstance(child.func, ast.Name):
-                    name = child.func.id
-
-                    if name in source_map and name not in visited:
-                        dependencies.add(name)
-                        visited.add(name)
-
-                        # Recursively find dependencies
-                        dep_node = source_map[name]['node']
-                        try:
-                            sub_deps = self._find_dependencies(
-                                dep_node,
-                                source_map,
-                                max_depth - 1,
-                                visited
-                            )
-                            dependencies.update(sub_deps)
-                        except RecursionError:
-                            pass
-
-                # Attribute call: obj.method()
-                elif isinstance(child.func, ast.Attribute):
-                    # MODEL.predict() - the object is 'MODEL'
-                    if isinstance(child.func.value, ast.Name):
-                        obj_name = child.func.value.id
-
-                        if obj_name in source_map and obj_name not in visited:
-                            dependencies.add(obj_name)
-                            visited.add(obj_name)
+            dependencies |= next_frontier
+            frontier = next_frontier
 
         return dependencies
 
@@ -1113,7 +1149,7 @@ class ASTContextExtractor:
         2. Build source map to index all definitions
         3. Parse error traceback for additional context
         4. Map HTTP endpoints to handler functions (NEW for e2e tests!)
-        5. Find dependencies recursively
+        5. Find the dependency closure of the targets
         6. Extract targeted code with priority ordering
 
         Args:
@@ -1145,12 +1181,15 @@ class ASTContextExtractor:
 
         # Get imported names from this source file
         imported_names = set()
-        source_file_name = Path(source_file).stem  # 'main' from 'app/main.py'
+        # 'main' from 'app/main.py', 'app' from 'app/__init__.py'
+        source_rel = source_file.replace(os.sep, '/').removesuffix('.py').removesuffix('/__init__')
+        source_file_name = source_rel.rsplit('/', 1)[-1]
 
         for module_path, names in test_imports.items():
-            # Check if this module corresponds to our source file
-            # E.g., 'app.main' matches 'app/main.py'
-            if source_file_name in module_path.replace('.', '/'):
+            # Check if this module corresponds to our source file by whole
+            # components: 'app.main' matches 'app/main.py' (and a root-level
+            # 'main.py'), but 'app.main_v2' does not
+            if source_file_name in module_path.split('.'):
                 imported_names.update(names)
 
         # Step 2: Build source map
@@ -1169,17 +1208,14 @@ class ASTContextExtractor:
         endpoint_handlers = set()
         decorator_dependencies = set()
         if http_endpoints:
-            endpoint_handlers = self._map_endpoints_to_handlers(http_endpoints, source_file, source_map)
-            if endpoint_handlers and self.verbose:
+            # Handlers and their decorator dependencies (API keys, auth, etc.) in one pass
+            endpoint_handlers, decorator_dependencies = self._collect_handlers_and_decorator_deps(
+                http_endpoints, source_file, source_map
+            )
+            if self.verbose and endpoint_handlers:
                 print(f"Mapped endpoints to handlers: {', '.join(list(endpoint_handlers)[:3])}")
 
-            # Extract dependencies from decorators (NEW: for API keys, auth, etc.)
-            for handler_name in endpoint_handlers:
-                if handler_name in source_map:
-                    deps = self._extract_decorator_dependencies(source_map[handler_name]['node'], source_map)
-                    decorator_dependencies.update(deps)
-
-            if decorator_dependencies and self.verbose:
+            if self.verbose and decorator_dependencies:
                 print(f"Found decorator dependencies: {', '.join(list(decorator_dependencies)[:3])}")
 
         # Step 4: Combine all target names
@@ -1190,13 +1226,15 @@ class ASTContextExtractor:
         has_wildcard = '*' in target_names
         target_names.discard('*')
 
-        if self.verbose and target_names:
-            targets_str = ', '.join(list(target_names)[:5])
-            if len(target_names) > 5:
-                targets_str += f', ... ({len(target_names)} total)'
-            print(f"Target functions: {targets_str}")
-        elif self.verbose and has_wildcard:
-            print(f"Target functions: * (will extract from error traceback)")
+        # Only materialize the preview list/string when it will be printed
+        if self.verbose:
+            if target_names:
+                targets_str = ', '.join(list(target_names)[:5])
+                if len(target_names) > 5:
+                    targets_str += f', ... ({len(target_names)} total)'
+                print(f"Target functions: {targets_str}")
+            elif has_wildcard:
+                print(f"Target functions: * (will extract from error traceback)")
 
         if not target_names:
             # No specific targets found, skip AST and rely on embeddings
@@ -1222,17 +1260,7 @@ class ASTContextExtractor:
                     current_lines += lines
 
         # Priority 2: Constants used by target functions
-        all_dependencies = set()
-        for target in target_names:
-            if target in source_map:
-                try:
-                    deps = self._find_dependencies(
-                        source_map[target]['node'],
-                        source_map
-                    )
-                    all_dependencies.update(deps)
-                except:
-                    pass  # Skip if dependency finding fails
+        all_dependencies = self._find_dependencies(target_names, source_map)
 
         for name in all_dependencies:
             if name not in extracted_names and name in source_map:
@@ -5,13 +5,388 @@ Replaces failing test functions in test files using AST manipulation.
 """
 
 import ast
+import bisect
+import contextlib
+import functools
+import hashlib
+import importlib.machinery
+import importlib.util
+import io
+import linecache
+import multiprocessing
+import os
+import re
 import subprocess
+import sys
+import sysconfig
 import tempfile
 import shutil
-from typing import Optional
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
 from pathlib import Path
 
 
+@functools.lru_cache(maxsize=256)
+def _parse_source(source: str) -> ast.Module:
+    """
+    Parse source code, memoized by content.
+
+    The same test file is re-parsed many times across a fixer loop
+    (original, patched, validate_patch), so identical content is parsed once.
+    The returned tree is shared: callers must not mutate it.
+
+    Calls compile() directly with PyCF_ONLY_AST (no type comments, no
+    __future__ flags inherited from this module) rather than going through
+    the ast.parse wrapper.
+
+    Args:
+        source: Python source code
+
+    Returns:
+        Parsed module AST (raises SyntaxError like ast.parse)
+    """
+    return compile(source, '<unknown>', 'exec', ast.PyCF_ONLY_AST, dont_inherit=True)
+
+
+@functools.lru_cache(maxsize=256)
+def _line_offsets(source: str) -> tuple[int, ...]:
+    """
+    Compute the character offset at which each line of source starts.
+
+    Args:
+        source: Python source code
+
+    Returns:
+        Tuple where index i is the offset of (0-indexed) line i
+    """
+    offsets = [0]
+    find = source.find
+    pos = find('\n')
+    while pos != -1:
+        offsets.append(pos + 1)
+        pos = find('\n', pos + 1)
+    return tuple(offsets)
+
+
+# Whitespace-only lines, and the leading whitespace of non-blank lines
+_BLANK_LINE_RE = re.compile(r'(?m)^[^\S\n]+$')
+_LEADING_INDENT_RE = re.compile(r'(?m)^[^\S\n]*(?=\S)')
+
+
+@functools.lru_cache(maxsize=256)
+def _reindent(code: str, indent: int) -> str:
+    """
+    Re-indent a code snippet so its least-indented line sits at indent.
+
+    Regex passes instead of per-line Python loops; memoized since the same
+    LLM output is re-indented again on retries and in validate/patch paths.
+
+    Args:
+        code: Code snippet
+        indent: Number of spaces to indent
+
+    Returns:
+        Re-indented code, with whitespace-only lines emptied and leading and
+        trailing blank lines removed
+    """
+    code = _BLANK_LINE_RE.sub('', code).strip('\n')
+    min_indent = min(map(len, _LEADING_INDENT_RE.findall(code)), default=0)
+    # '.' excludes empty lines, which stay empty
+    return re.sub(f'(?m)^[^\\S\\n]{{{min_indent}}}(?=.)', ' ' * indent, code)
+
+
+# String-argument parametrize decorators, and def lines
+_PARAMETRIZE_RE = re.compile(r'''\.mark\s*\.\s*parametrize\s*\(\s*[rRuUbB]*(["'])([^"'\n]*)\1''')
+_DEF_RE = re.compile(r'(?m)^[^\S\n]*(?:async\s+)?def\s+(\w+)')
+
+
+def _may_have_duplicate_parametrize(source: str) -> bool:
+    """
+    Text pre-scan for a function with a repeated parametrize name.
+
+    Decorators precede their def, so each parametrize call is grouped with
+    the next def in the source. Matches in strings or comments can only add
+    false positives, which callers confirm on the AST.
+
+    Args:
+        source: Python source code
+
+    Returns:
+        False if no function can have a duplicate parametrize name
+    """
+    def_starts = [match.start() for match in _DEF_RE.finditer(source)]
+    seen = set()
+    for match in _PARAMETRIZE_RE.finditer(source):
+        key = (bisect.bisect_right(def_starts, match.start()), match.group(2))
+        if key in seen:
+            return True
+        seen.add(key)
+    return False
+
+
+# Validation runs the `pytest` on PATH in a subprocess, like FailureParser.
+# With AUTOFIXER_FORK_VALIDATION it instead runs pytest.main() in a forked
+# child of this (already warm) interpreter: no interpreter startup or pytest
+# import per candidate, and candidates are imported from memory. The child
+# inherits this process's sys.modules and sys.path (where run_auto_fixer.py
+# put the tool's src/ and the cwd first), so _pytest_worker strips both back
+# to the installed packages; the tests still run on this interpreter and its
+# site-packages, which may not be the environment of the pytest on PATH.
+# Only available where fork is safe (Linux).
+_FORK_CONTEXT = (
+    multiprocessing.get_context('fork')
+    if os.getenv("AUTOFIXER_FORK_VALIDATION", "").lower() in ("1", "true", "yes")
+    and sys.platform.startswith('linux') and 'fork' in multiprocessing.get_all_start_methods()
+    else None
+)
+
+# Directories of the interpreter's standard library and installed packages:
+# modules loaded from anywhere else (the tool itself, the project) must be
+# re-imported by a validation worker, not inherited
+_INSTALLED_PATHS = tuple(sorted({
+    os.path.join(os.path.realpath(path), '')
+    for name, path in sysconfig.get_paths().items()
+    if name in ('stdlib', 'platstdlib', 'purelib', 'platlib')
+}))
+
+# sys.path entries added for the tool's own imports (run_auto_fixer.py puts
+# the tool's src/ and the cwd first), which a plain pytest run doesn't have
+_TOOL_PATHS = {
+    os.path.realpath(path)
+    for path in (Path(__file__).resolve().parents[1], os.getcwd(), os.path.join(os.getcwd(), 'src'))
+}
+
+
+def _isolate_worker_imports() -> None:
+    """
+    Reset a forked validation worker's imports to those of a fresh pytest run.
+
+    Drops the tool's sys.path entries and every module not loaded from the
+    standard library or site-packages, so e.g. a project module named
+    `analyzer` or `gen` isn't resolved to the tool's copy. Installed
+    packages (pytest itself) stay imported.
+    """
+    sys.path[:] = [
+        entry for entry in sys.path
+        if entry and os.path.realpath(entry) not in _TOOL_PATHS
+    ]
+    for name, module in list(sys.modules.items()):
+        origin = getattr(module, '__file__', None)
+        if name == '__main__' or not origin:
+            continue  # Builtin, frozen or namespace module
+        if not os.path.realpath(origin).startswith(_INSTALLED_PATHS):
+            del sys.modules[name]
+    importlib.invalidate_caches()
+
+
+class _InMemorySources:
+    """
+    pytest plugin and import finder serving test modules from memory.
+
+    Used only inside the forked validation worker, so a candidate fix is
+    imported straight from the patched string and nothing is written to disk.
+    The finder is installed at session start, after pytest's assertion
+    rewriting hook, so it takes precedence; asserts are rewritten here with
+    pytest's own rewriter to keep failure introspection.
+    """
+
+    def __init__(self, sources: Dict[str, str]):
+        self.sources = {os.path.abspath(path): source for path, source in sources.items()}
+        self.stems = {Path(path).stem for path in self.sources}
+        self.loaded = set()
+        self.config = None
+
+    def all_loaded(self) -> bool:
+        """Whether pytest imported every overridden module through this finder."""
+        return self.loaded >= self.sources.keys()
+
+    def pytest_configure(self, config):
+        self.config = config
+
+    def pytest_sessionstart(self, session):
+        for path, source in self.sources.items():
+            # Tracebacks show the patched lines, not the ones on disk
+            linecache.cache[path] = (len(source), None, source.splitlines(True), path)
+        sys.meta_path.insert(0, self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        # Cheap name check first: this sees every import made during the run
+        if fullname.rpartition('.')[2] not in self.stems:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        if spec is None or not spec.origin or os.path.abspath(spec.origin) not in self.sources:
+            return None
+        return importlib.util.spec_from_file_location(fullname, spec.origin, loader=self)
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        path = os.path.abspath(module.__spec__.origin)
+        source = self.sources[path]
+        tree = ast.parse(source, filename=path)
+        if self.config is not None and self.config.getoption('assertmode') == 'rewrite':
+            try:
+                from _pytest.assertion.rewrite import rewrite_asserts
+                rewrite_asserts(tree, source.encode(), path, self.config)
+            except Exception:
+                pass  # Plain asserts still pass/fail correctly
+        self.loaded.add(path)
+        exec(compile(tree, path, 'exec', dont_inherit=True), module.__dict__)
+
+
+def _pytest_worker(pytest_args: list[str], conn, sources: Optional[Dict[str, str]] = None) -> None:
+    """
+    Run pytest.main() in a forked child and send back the outcome.
+
+    Args:
+        pytest_args: Arguments for pytest.main()
+        conn: Write end of the pipe to the parent
+        sources: Optional mapping of test file path to content to import
+                 in place of the file on disk
+
+    Sends:
+        Tuple of (exit_code, output, sources_used) where sources_used is False
+        if pytest imported an overridden file without going through the finder
+    """
+    _isolate_worker_imports()
+    in_memory = _InMemorySources(sources) if sources else None
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            import pytest
+            exit_code = int(pytest.main(pytest_args, plugins=[in_memory] if in_memory else None))
+        except BaseException as e:
+            print(f"Error running pytest: {e}")
+            exit_code = 3  # pytest's "internal error" exit code
+    conn.send((exit_code, output.getvalue(), in_memory is None or in_memory.all_loaded()))
+    conn.close()
+
+
+# try statements (try/except* is a separate node type from Python 3.11)
+_TRY_NODES = (ast.Try, ast.TryStar) if hasattr(ast, 'TryStar') else (ast.Try,)
+
+
+# Bound on remembered validation outcomes (LRU)
+_VALIDATION_CACHE_SIZE = 1024
+
+
+# pytest options shared by every validation run: pass/fail plus a short
+# traceback (fed back to the LLM) is all that is needed, without verbose
+# per-test lines, the session header, or .pytest_cache writes
+_VALIDATION_PYTEST_ARGS = ['--tb=short', '-q', '--no-header', '-p', 'no:cacheprovider']
+
+
+class _DuplicateParametrizeFinder(ast.NodeVisitor):
+    """
+    Finds the first function with a repeated @pytest.mark.parametrize name.
+
+    Only module and class bodies are visited: decorators sit at the definition
+    site, so function bodies (the bulk of a test file's nodes) are never entered.
+    """
+
+    def __init__(self, patcher: 'ASTPatcher'):
+        self.patcher = patcher
+        self.duplicate: Optional[tuple[str, str]] = None  # (param_name, function_name)
+
+    def _check_function(self, node):
+        """Check one function's decorators; do not descend into its body."""
+        if self.duplicate:
+            return
+
+        param_names = set()
+        for decorator in node.decorator_list:
+            param_name = self.patcher._get_parametrize_param_name(decorator)
+            if param_name:
+                if param_name in param_names:
+                    self.duplicate = (param_name, node.name)
+                    return
+                param_names.add(param_name)
+
+    def visit_FunctionDef(self, node):
+        self._check_function(node)
+
+    def visit_AsyncFunctionDef(self, node):
+        self._check_function(node)
+
+    def visit_ClassDef(self, node):
+        # Descend into methods
+        if not self.duplicate:
+            self.generic_visit(node)
+
+
+class _DuplicateRemover(ast.NodeVisitor):
+    """
+    Collects repeated @pytest.mark.parametrize decorators across a file.
+
+    A single module-level instance (_REMOVER) is reused; call reset() before
+    each visit.
+    """
+
+    def __init__(self):
+        self.duplicates: list[ast.expr] = []
+
+    def reset(self) -> None:
+        """Forget duplicates collected by the previous visit."""
+        self.duplicates = []
+
+    @staticmethod
+    def parametrize_name_extractor(decorator: ast.expr) -> str:
+        """
+        Extract parameter name from @pytest.mark.parametrize decorator.
+
+        Args:
+            decorator: Decorator AST node
+
+        Returns:
+            Parameter name if this is a parametrize decorator, empty string otherwise
+        """
+        # Memoized on the node: parsed trees are shared via _parse_source, and the
+        # same decorators are checked by validation, cleanup and re-validation
+        param_name = getattr(decorator, '_parametrize_name', None)
+        if param_name is not None:
+            return param_name
+
+        param_name = ""
+
+        # Pattern: @pytest.mark.parametrize("param_name", ...)
+        if isinstance(decorator, ast.Call):
+            if isinstance(decorator.func, ast.Attribute):
+                # Check if it's pytest.mark.parametrize
+                if (isinstance(decorator.func.value, ast.Attribute) and
+                    decorator.func.value.attr == "mark" and
+                    decorator.func.attr == "parametrize"):
+                    # Get the first argument (parameter name)
+                    if decorator.args and isinstance(decorator.args[0], ast.Constant):
+                        param_name = decorator.args[0].value
+
+        decorator._parametrize_name = param_name
+        return param_name
+
+    def _process_function(self, node):
+        """Process both regular and async functions."""
+        seen_params = set()
+
+        for decorator in node.decorator_list:
+            param_name = self.parametrize_name_extractor(decorator)
+
+            if param_name:
+                if param_name in seen_params:
+                    self.duplicates.append(decorator)
+                    continue
+                seen_params.add(param_name)
+
+    def visit_FunctionDef(self, node):
+        self._process_function(node)
+
+    def visit_AsyncFunctionDef(self, node):
+        self._process_function(node)
+
+
+_REMOVER = _DuplicateRemover()
+
+
 class ASTPatcher:
     """
     Patches test files by replacing specific test functions.
@@ -23,15 +398,54 @@ class ASTPatcher:
     new failures (regression prevention).
     """
 
-    def __init__(self, enable_test_validation: bool = True):
+    def __init__(self, enable_test_validation: bool = True, skip_safety_checks: bool = False):
         """
         Initialize ASTPatcher.
 
         Args:
             enable_test_validation: If True, run pytest on fixes before applying.
                                    Prevents auto-fixer from making things worse.
+            skip_safety_checks: If True (and test validation is disabled),
+                                patch_test_function only splices and writes,
+                                without re-parsing the patched file or checking
+                                its decorators.
         """
         self.enable_test_validation = enable_test_validation
+        self.skip_safety_checks = skip_safety_checks
+        # path -> (mtime_ns, size, content) for unchanged files
+        self._source_cache: Dict[str, tuple[int, int, str]] = {}
+        # (path, test name, blake2b(patched content)) -> (success, failure_output)
+        self._validation_cache: OrderedDict[tuple[str, str, bytes], tuple[bool, str]] = OrderedDict()
+
+    def _read_source(self, path: str) -> str:
+        """
+        Read a file, reusing the cached content while its mtime/size are unchanged.
+
+        Args:
+            path: Path to the file
+
+        Returns:
+            File content (raises FileNotFoundError like open)
+        """
+        stat = os.stat(path)
+        cached = self._source_cache.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        content = Path(path).read_text()
+        self._source_cache[path] = (stat.st_mtime_ns, stat.st_size, content)
+        return content
+
+    def _remember_source(self, path: str, content: str) -> None:
+        """
+        Record content just written to path so the next read needs no I/O.
+
+        Args:
+            path: Path that was written
+            content: Content now on disk
+        """
+        stat = os.stat(path)
+        self._source_cache[path] = (stat.st_mtime_ns, stat.st_size, content)
 
     def patch_test_function_with_feedback(
         self,
@@ -54,21 +468,20 @@ class ASTPatcher:
         """
         # Read original file
         try:
-            with open(test_file_path, 'r') as f:
-                original_content = f.read()
+            original_content = self._read_source(test_file_path)
         except FileNotFoundError:
             print(f"Error: Test file not found: {test_file_path}")
             return False, ""
 
         # Parse original file
         try:
-            tree = ast.parse(original_content)
+            tree = _parse_source(original_content)
         except SyntaxError as e:
             print(f"Error: Cannot parse test file: {e}")
             return False, ""
 
-        # Find and replace the function
-        patched_content = self._replace_function(
+        # Find and replace the function, then validate the result
+        patched_content = self._build_patched_content(
             original_content,
             tree,
             test_function_name,
@@ -78,55 +491,22 @@ class ASTPatcher:
         if not patched_content:
             return False, ""
 
-        # Validate patched content before writing
-        try:
-            patched_tree = ast.parse(patched_content)
-        except SyntaxError as e:
-            print(f"Error: Patched code has syntax error at line {e.lineno}: {e.msg}")
-            if e.text:
-                print(f"  Problem line: {e.text.strip()}")
-            print(f"  Keeping original file unchanged")
-            return False, ""
-
-        # Validate for pytest-specific issues (duplicate parametrize decorators)
-        if not self._validate_pytest_decorators(patched_tree):
-            print(f"  Found duplicate decorators in patched file, attempting auto-cleanup...")
-            cleaned_content = self._remove_duplicate_decorators_from_file(patched_content)
-            if cleaned_content != patched_content:
-                try:
-                    cleaned_tree = ast.parse(cleaned_content)
-                    if self._validate_pytest_decorators(cleaned_tree):
-                        print(f"  Auto-cleanup successful - using cleaned version")
-                        patched_content = cleaned_content
-                    else:
-                        print(f"Error: Patched code still has duplicate @pytest.mark.parametrize decorators after cleanup")
-                        print(f"  Keeping original file unchanged")
-                        return False, ""
-                except SyntaxError:
-                    print(f"Error: Cleaned code has syntax errors")
-                    print(f"  Keeping original file unchanged")
-                    return False, ""
-            else:
-                print(f"Error: Auto-cleanup didn't remove duplicates")
-                print(f"  Keeping original file unchanged")
-                return False, ""
-
         # CRITICAL: Test the fix before applying it (regression prevention)
+        # A validated fix is moved into place by the validation itself
         if self.enable_test_validation:
             success, failure_output = self._test_fix_with_output(
                 test_file_path,
                 test_function_name,
-                patched_content,
-                original_content
+                patched_content
             )
             if not success:
                 print(f"  Rejecting fix - it still fails or creates new errors")
                 return False, failure_output
+            return True, ""
 
         # Write patched content
         try:
-            with open(test_file_path, 'w') as f:
-                f.write(patched_content)
+            self._write_atomic(test_file_path, patched_content)
             return True, ""
         except IOError as e:
             print(f"Error writing patched file: {e}")
@@ -151,21 +531,37 @@ class ASTPatcher:
         """
         # Read original file
         try:
-            with open(test_file_path, 'r') as f:
-                original_content = f.read()
+            original_content = self._read_source(test_file_path)
         except FileNotFoundError:
             print(f"Error: Test file not found: {test_file_path}")
             return False
 
         # Parse original file
         try:
-            tree = ast.parse(original_content)
+            tree = _parse_source(original_content)
         except SyntaxError as e:
             print(f"Error: Cannot parse test file: {e}")
             return False
 
-        # Find and replace the function
-        patched_content = self._replace_function(
+        # Lean path for callers that opted out of all checks: splice and write
+        if not self.enable_test_validation and self.skip_safety_checks:
+            replaced = self._replace_function(
+                original_content,
+                tree,
+                test_function_name,
+                fixed_function_code
+            )
+            if not replaced:
+                return False
+            try:
+                self._write_atomic(test_file_path, replaced[0])
+                return True
+            except IOError as e:
+                print(f"Error writing patched file: {e}")
+                return False
+
+        # Find and replace the function, then validate the result
+        patched_content = self._build_patched_content(
             original_content,
             tree,
             test_function_name,
@@ -175,57 +571,334 @@ class ASTPatcher:
         if not patched_content:
             return False
 
-        # Validate patched content before writing
+        # CRITICAL: Test the fix before applying it (regression prevention)
+        # A validated fix is moved into place by the validation itself
+        if self.enable_test_validation:
+            if not self._test_fix_before_commit(test_file_path, test_function_name,
+                                                patched_content):
+                print(f"  Rejecting fix - it still fails or creates new errors")
+                return False
+            return True
+
+        # Write patched content
+        try:
+            self._write_atomic(test_file_path, patched_content)
+            return True
+        except IOError as e:
+            print(f"Error writing patched file: {e}")
+            return False
+
+    def patch_many(
+        self,
+        jobs: List[tuple[str, str, str]]
+    ) -> Dict[tuple[str, str], tuple[bool, str]]:
+        """
+        Apply several function fixes, validating all of them in one pytest run.
+
+        Each file is patched with all of its candidates at once and a single
+        pytest invocation covers every candidate, so pytest startup is paid
+        once per batch instead of once per fix. Outcomes are attributed per
+        test from the JUnit XML report; each file is then left with only the
+        candidates that passed.
+
+        Args:
+            jobs: List of (test_file_path, test_function_name, fixed_function_code)
+
+        Returns:
+            Dict mapping (test_file_path, test_function_name) to
+            (success, failure_output), as for patch_test_function_with_feedback
+        """
+        results = {}
+        candidates: Dict[str, Dict[str, str]] = {}
+        for test_file_path, test_function_name, fixed_function_code in jobs:
+            candidates.setdefault(test_file_path, {})[test_function_name] = fixed_function_code
+
+        # Build one union-patched version of each file
+        originals = {}
+        patched = {}
+        applied: Dict[str, List[str]] = {}
+        for test_file_path, fixes in candidates.items():
+            try:
+                original_content = self._read_source(test_file_path)
+            except FileNotFoundError:
+                print(f"Error: Test file not found: {test_file_path}")
+                results.update({(test_file_path, name): (False, "") for name in fixes})
+                continue
+
+            content = self._apply_fixes(original_content, fixes, results, test_file_path)
+            if content is None:
+                continue
+
+            originals[test_file_path] = original_content
+            patched[test_file_path] = content
+            applied[test_file_path] = [name for name in fixes if (test_file_path, name) not in results]
+
+        if not patched:
+            return results
+
+        if self.enable_test_validation:
+            outcomes = self._validate_batch(patched, applied)
+        else:
+            outcomes = {(path, name): None for path, names in applied.items() for name in names}
+
+        # Write each file with only the candidates that passed
+        for test_file_path, names in applied.items():
+            accepted = [name for name in names if outcomes.get((test_file_path, name), "") is None]
+            for name in names:
+                failure_output = outcomes.get((test_file_path, name), "")
+                results[(test_file_path, name)] = (failure_output is None, failure_output or "")
+
+            if not accepted:
+                continue
+            if len(accepted) == len(names):
+                content = patched[test_file_path]
+            else:
+                accepted_fixes = {name: candidates[test_file_path][name] for name in accepted}
+                content = self._apply_fixes(originals[test_file_path], accepted_fixes, {}, test_file_path)
+
+            try:
+                self._write_atomic(test_file_path, content)
+            except IOError as e:
+                print(f"Error writing patched file: {e}")
+                for name in accepted:
+                    results[(test_file_path, name)] = (False, "")
+
+        return results
+
+    def _apply_fixes(
+        self,
+        original_content: str,
+        fixes: Dict[str, str],
+        results: Dict[tuple[str, str], tuple[bool, str]],
+        test_file_path: str
+    ) -> Optional[str]:
+        """
+        Apply several function fixes to one file's content in sequence.
+
+        Fixes that cannot be applied are recorded as failed in results and skipped.
+
+        Args:
+            original_content: Original file content
+            fixes: Mapping of function name to fixed code
+            results: Result dict to record failed fixes in
+            test_file_path: Path of the file (for result keys)
+
+        Returns:
+            Patched content, or None if the original file cannot be parsed
+        """
+        content = original_content
+        for name, fixed_code in fixes.items():
+            try:
+                tree = _parse_source(content)
+            except SyntaxError as e:
+                print(f"Error: Cannot parse test file: {e}")
+                results.update({(test_file_path, name): (False, "") for name in fixes})
+                return None
+
+            patched_content = self._build_patched_content(content, tree, name, fixed_code)
+            if patched_content:
+                content = patched_content
+            else:
+                results[(test_file_path, name)] = (False, "")
+
+        return content
+
+    def _validate_batch(
+        self,
+        patched: Dict[str, str],
+        applied: Dict[str, List[str]]
+    ) -> Dict[tuple[str, str], Optional[str]]:
+        """
+        Run pytest once over every patched file and attribute results per test.
+
+        Patched contents are swapped in from memory (or, where that is
+        unavailable, validated from sibling candidate files that are removed
+        afterwards); the test files themselves are not touched.
+
+        Args:
+            patched: Mapping of file path to union-patched content
+            applied: Mapping of file path to the function names patched in it
+
+        Returns:
+            Mapping of (file path, function name) to None if the test passed,
+            or its failure output otherwise
+        """
+        print(f"Testing {sum(map(len, applied.values()))} fix(es) before applying (regression prevention)...")
+
+        candidates = {path: self._candidate_path(path) for path in patched}
+        num_tests = sum(map(len, applied.values()))
+        fd, report_path = tempfile.mkstemp(suffix='.xml')
+        os.close(fd)
+        report_args = [*_VALIDATION_PYTEST_ARGS, f'--junitxml={report_path}', '-o', 'junit_family=xunit1']
+
+        # Path each file's tests are reported under
+        validated_paths = {path: path for path in patched}
+        try:
+            nodeids = [f"{path}::{name}" for path, names in applied.items() for name in names]
+            result = self._run_pytest_in_memory([*nodeids, *report_args], 30 * num_tests, patched)
+            if result is None:
+                validated_paths = candidates
+                for test_file_path, content in patched.items():
+                    with open(candidates[test_file_path], 'w') as f:
+                        f.write(content)
+
+                nodeids = [f"{candidates[path]}::{name}" for path, names in applied.items() for name in names]
+                result = self._run_pytest([*nodeids, *report_args], timeout=30 * num_tests)
+
+            _, full_output = result
+            reported = self._parse_junit_report(report_path)
+
+        except subprocess.TimeoutExpired:
+            print(f"Fix validation timed out - test hung")
+            full_output = f"Test execution timed out after {30 * num_tests} seconds"
+            reported = {}
+
+        except Exception as e:
+            print(f"Error during fix validation: {e}")
+            full_output = f"Error during test execution: {str(e)}"
+            reported = {}
+
+        finally:
+            for candidate_path in candidates.values():
+                if os.path.exists(candidate_path):
+                    os.unlink(candidate_path)
+            os.unlink(report_path)
+
+        outcomes = {}
+        for test_file_path, names in applied.items():
+            normalized_path = os.path.abspath(validated_paths[test_file_path]).replace(os.sep, '/')
+            candidate_name = os.path.basename(validated_paths[test_file_path])
+            for name in names:
+                failures = [
+                    failure_text
+                    for (report_file, report_name), failure_text in reported.items()
+                    if report_name == name
+                    and (normalized_path == report_file or normalized_path.endswith('/' + report_file))
+                ]
+                if not failures:
+                    # Not reported at all (collection error, timeout...): reject
+                    failure_output = full_output
+                elif any(failures):
+                    failure_output = "\n".join(text for text in failures if text)
+                else:
+                    outcomes[(test_file_path, name)] = None
+                    continue
+
+                # Report failures against the real test file name
+                outcomes[(test_file_path, name)] = failure_output.replace(
+                    candidate_name, os.path.basename(test_file_path)
+                )
+
+        passed = sum(1 for outcome in outcomes.values() if outcome is None)
+        print(f"Batch validation: {passed}/{len(outcomes)} fix(es) pass")
+        return outcomes
+
+    def _parse_junit_report(self, report_path: str) -> Dict[tuple[str, str], str]:
+        """
+        Parse a JUnit XML report (xunit1 family) into per-test outcomes.
+
+        Parameterized cases are folded into their function: any failing case
+        fails the function.
+
+        Args:
+            report_path: Path to the JUnit XML report
+
+        Returns:
+            Mapping of (file, function name) to failure text ('' if passed)
+        """
+        reported = {}
         try:
-            patched_tree = ast.parse(patched_content)
+            root = ET.parse(report_path).getroot()
+        except (ET.ParseError, FileNotFoundError):
+            return reported
+
+        for testcase in root.iter('testcase'):
+            key = (
+                (testcase.get('file') or '').replace(os.sep, '/'),
+                (testcase.get('name') or '').split('[')[0]
+            )
+            failure_text = reported.get(key, "")
+            for problem in list(testcase.findall('failure')) + list(testcase.findall('error')):
+                detail = problem.text or problem.get('message') or problem.tag
+                failure_text = f"{failure_text}\n{detail}" if failure_text else detail
+            reported[key] = failure_text
+
+        return reported
+
+    def _build_patched_content(
+        self,
+        original_content: str,
+        tree: ast.AST,
+        function_name: str,
+        fixed_code: str
+    ) -> Optional[str]:
+        """
+        Replace a function and validate the patched file (syntax + decorators).
+
+        Duplicate @pytest.mark.parametrize decorators in the result are
+        cleaned up automatically when possible.
+
+        Args:
+            original_content: Original file content
+            tree: Parsed AST of the original content
+            function_name: Function to replace
+            fixed_code: Replacement code
+
+        Returns:
+            Patched content, or None if the patch is invalid
+        """
+        # Find and replace the function
+        replaced = self._replace_function(
+            original_content,
+            tree,
+            function_name,
+            fixed_code
+        )
+
+        if not replaced:
+            return None
+
+        patched_content, splice_is_valid = replaced
+
+        # Validate patched content before writing. A known-valid splice cannot
+        # introduce a syntax error, so the whole file is only re-parsed when the
+        # splice check failed or there are parametrize decorators to inspect.
+        if splice_is_valid and 'parametrize' not in patched_content:
+            return patched_content
+
+        try:
+            patched_tree = _parse_source(patched_content)
         except SyntaxError as e:
             print(f"Error: Patched code has syntax error at line {e.lineno}: {e.msg}")
             if e.text:
                 print(f"  Problem line: {e.text.strip()}")
             print(f"  Keeping original file unchanged")
-            return False
+            return None
 
         # Validate for pytest-specific issues (duplicate parametrize decorators)
-        # If we find duplicates, try to clean them automatically
-        if not self._validate_pytest_decorators(patched_tree):
+        if not self._validate_pytest_decorators(patched_tree, patched_content):
             print(f"  Found duplicate decorators in patched file, attempting auto-cleanup...")
-            # Try to clean the ENTIRE patched file
             cleaned_content = self._remove_duplicate_decorators_from_file(patched_content)
             if cleaned_content != patched_content:
-                # Re-validate the cleaned version
                 try:
-                    cleaned_tree = ast.parse(cleaned_content)
-                    if self._validate_pytest_decorators(cleaned_tree):
-                        print(f"Auto-cleanup successful - using cleaned version")
+                    cleaned_tree = _parse_source(cleaned_content)
+                    if self._validate_pytest_decorators(cleaned_tree, cleaned_content):
+                        print(f"  Auto-cleanup successful - using cleaned version")
                         patched_content = cleaned_content
                     else:
                         print(f"Error: Patched code still has duplicate @pytest.mark.parametrize decorators after cleanup")
                         print(f"  Keeping original file unchanged")
-                        return False
+                        return None
                 except SyntaxError:
                     print(f"Error: Cleaned code has syntax errors")
                     print(f"  Keeping original file unchanged")
-                    return False
+                    return None
             else:
                 print(f"Error: Auto-cleanup didn't remove duplicates")
                 print(f"  Keeping original file unchanged")
-                return False
-
-        # CRITICAL: Test the fix before applying it (regression prevention)
-        if self.enable_test_validation:
-            if not self._test_fix_before_commit(test_file_path, test_function_name,
-                                                patched_content, original_content):
-                print(f"  Rejecting fix - it still fails or creates new errors")
-                return False
+                return None
 
-        # Write patched content
-        try:
-            with open(test_file_path, 'w') as f:
-                f.write(patched_content)
-            return True
-        except IOError as e:
-            print(f"Error writing patched file: {e}")
-            return False
+        return patched_content
 
     def _replace_function(
         self,
@@ -233,7 +906,7 @@ class ASTPatcher:
         tree: ast.AST,
         function_name: str,
         fixed_code: str
-    ) -> Optional[str]:
+    ) -> Optional[tuple[str, bool]]:
         """
         Replace a function in the content.
 
@@ -244,22 +917,38 @@ class ASTPatcher:
             fixed_code: Replacement code
 
         Returns:
-            Patched content or None
+            Tuple of (patched content, splice_is_valid) or None. splice_is_valid
+            is True when the replacement parses on its own and was indented to
+            the def's own space indentation, so the patched file needs no re-parse.
         """
-        # Find the function node (including async functions!)
+        # Find the function node (including async functions!) in one pass over
+        # module and class bodies, and the blocks of if/try/with statements in
+        # them (e.g. version-gated tests) - test functions never live inside
+        # function bodies, so there is no need to descend into them
         function_node = None
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == function_name:
-                function_node = node
-                break
-
-        if not function_node:
-            # Function not found - show what functions DO exist to help debug
-            available_functions = []
-            for node in ast.walk(tree):
+        available_functions = []
+        pending = deque([tree.body])
+        while pending and not function_node:
+            for node in pending.popleft():
                 if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    if node.name == function_name:
+                        function_node = node
+                        break
                     available_functions.append(node.name)
+                elif isinstance(node, ast.ClassDef):
+                    pending.append(node.body)
+                elif isinstance(node, (ast.If, ast.With, ast.AsyncWith)):
+                    pending.append(node.body)
+                    if isinstance(node, ast.If):
+                        pending.append(node.orelse)
+                elif isinstance(node, _TRY_NODES):
+                    pending.append(node.body)
+                    pending.extend(handler.body for handler in node.handlers)
+                    pending.append(node.orelse)
+                    pending.append(node.finalbody)
 
+        if not function_node:
+            # Function not found - show what functions DO exist to help debug
             print(f"Error: Function '{function_name}' not found in file")
             if available_functions:
                 print(f"  Available functions in file: {', '.join(available_functions[:10])}")
@@ -273,27 +962,49 @@ class ASTPatcher:
         start_line = function_node.lineno - 1  # 0-indexed
         end_line = function_node.end_lineno  # Inclusive, 1-indexed
 
-        # Split content into lines
-        lines = original_content.split('\n')
+        # Character offset of each line start (no split/join of the whole file)
+        line_offsets = _line_offsets(original_content)
+        start_offset = line_offsets[start_line]
 
-        # Get indentation of the original function
-        if start_line < len(lines):
-            original_line = lines[start_line]
-            indent = len(original_line) - len(original_line.lstrip())
-        else:
-            indent = 0
+        # Get indentation of the original function (col_offset of the def)
+        indent = function_node.col_offset
 
         # Clean and indent the fixed code
         fixed_lines = self._prepare_fixed_code(fixed_code, indent)
-
-        # Replace the function
-        patched_lines = (
-            lines[:start_line] +
-            fixed_lines +
-            lines[end_line:]
+        fixed_text = '\n'.join(fixed_lines)
+
+        # Uniformly re-indenting a snippet that parses at column 0 keeps it valid
+        # at a def site indented with the same number of spaces (no tabs)
+        splice_is_valid = (
+            bool(fixed_lines)
+            and original_content.startswith(' ' * indent, start_offset)
+            and self._parses_standalone(fixed_code)
         )
 
-        return '\n'.join(patched_lines)
+        # Replace the function by splicing around its line range
+        if end_line < len(line_offsets):
+            patched_content = original_content[:start_offset] + fixed_text + '\n' + original_content[line_offsets[end_line]:]
+        else:
+            patched_content = original_content[:start_offset] + fixed_text
+        return patched_content, splice_is_valid
+
+    def _parses_standalone(self, fixed_code: str) -> bool:
+        """
+        Check whether the cleaned fixed code parses on its own.
+
+        Served from the parse cache: _prepare_fixed_code already parsed it.
+
+        Args:
+            fixed_code: Fixed function code (before cleaning)
+
+        Returns:
+            True if the cleaned code is valid Python
+        """
+        try:
+            _parse_source(self._clean_code(fixed_code))
+            return True
+        except SyntaxError:
+            return False
 
     def _prepare_fixed_code(self, fixed_code: str, indent: int) -> list[str]:
         """
@@ -309,47 +1020,20 @@ class ASTPatcher:
         # Clean up markdown and formatting first
         fixed_code = self._clean_code(fixed_code)
 
-        # Automatically remove duplicate decorators from LLM-generated code
-        fixed_code = self._remove_duplicate_decorators(fixed_code)
-
-        # Parse the fixed code to validate it
+        # Parse once; the tree is reused for duplicate-decorator removal
         try:
-            ast.parse(fixed_code)
+            tree = _parse_source(fixed_code)
         except SyntaxError:
-            # If parsing still fails after cleaning, return as-is
-            pass
-
-        # Split into lines
-        lines = fixed_code.split('\n')
-
-        # Remove empty lines at start and end
-        while lines and not lines[0].strip():
-            lines.pop(0)
-        while lines and not lines[-1].strip():
-            lines.pop()
-
-        # Find minimum indentation in the fixed code
-        min_indent = float('inf')
-        for line in lines:
-            if line.strip():  # Ignore empty lines
-                leading_spaces = len(line) - len(line.lstrip())
-                min_indent = min(min_indent, leading_spaces)
-
-        if min_indent == float('inf'):
-            min_indent = 0
-
-        # Adjust indentation
-        adjusted_lines = []
-        for line in lines:
-            if line.strip():
-                # Remove original indentation and add target indentation
-                dedented = line[min_indent:] if len(line) > min_indent else line.lstrip()
-                adjusted_lines.append(' ' * indent + dedented)
-            else:
-                # Preserve empty lines
-                adjusted_lines.append('')
+            # If parsing still fails after cleaning, use the code as-is
+            tree = None
 
-        return adjusted_lines
+        # Automatically remove duplicate decorators from LLM-generated code
+        if tree is not None:
+            fixed_code = self._remove_duplicate_decorators(fixed_code, tree)
+
+        # Dedent to the least-indented line, then indent to the target
+        adjusted_code = _reindent(fixed_code, indent)
+        return adjusted_code.split('\n') if adjusted_code else []
 
     def _clean_code(self, code: str) -> str:
         """
@@ -388,11 +1072,10 @@ class ASTPatcher:
         """
         try:
             # Validate the new content can be parsed
-            ast.parse(new_content)
+            _parse_source(new_content)
 
             # Write new content
-            with open(test_file_path, 'w') as f:
-                f.write(new_content)
+            self._write_atomic(test_file_path, new_content)
 
             return True
 
@@ -417,13 +1100,11 @@ class ASTPatcher:
             True if valid Python
         """
         try:
-            with open(test_file_path, 'r') as f:
-                content = f.read()
-
-            tree = ast.parse(content)
+            content = self._read_source(test_file_path)
+            tree = _parse_source(content)
 
             # Also validate pytest-specific issues
-            if not self._validate_pytest_decorators(tree):
+            if not self._validate_pytest_decorators(tree, content):
                 print(f"Validation failed: Duplicate @pytest.mark.parametrize decorators found")
                 return False
 
@@ -436,29 +1117,30 @@ class ASTPatcher:
             print(f"File not found: {test_file_path}")
             return False
 
-    def _validate_pytest_decorators(self, tree: ast.AST) -> bool:
+    def _validate_pytest_decorators(self, tree: ast.AST, source_hint: Optional[str] = None) -> bool:
         """
         Validate that there are no duplicate @pytest.mark.parametrize decorators.
 
         Args:
             tree: AST tree to validate
+            source_hint: Source the tree was parsed from; the tree is only walked
+                         if a text scan of it finds a possible duplicate
 
         Returns:
             True if no duplicates found, False otherwise
         """
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                # Track parametrize parameter names for this function
-                param_names = []
+        if source_hint is not None and (
+            'parametrize' not in source_hint or not _may_have_duplicate_parametrize(source_hint)
+        ):
+            return True
 
-                for decorator in node.decorator_list:
-                    param_name = self._get_parametrize_param_name(decorator)
-                    if param_name:
-                        if param_name in param_names:
-                            # Duplicate found
-                            print(f"  Found duplicate parametrize '{param_name}' in function '{node.name}'")
-                            return False
-                        param_names.append(param_name)
+        finder = _DuplicateParametrizeFinder(self)
+        finder.visit(tree)
+
+        if finder.duplicate:
+            param_name, function_name = finder.duplicate
+            print(f"  Found duplicate parametrize '{param_name}' in function '{function_name}'")
+            return False
 
         return True
 
@@ -472,116 +1154,272 @@ class ASTPatcher:
         Returns:
             Parameter name if this is a parametrize decorator, empty string otherwise
         """
-        # Pattern: @pytest.mark.parametrize("param_name", ...)
-        if isinstance(decorator, ast.Call):
-            if isinstance(decorator.func, ast.Attribute):
-                # Check if it's pytest.mark.parametrize
-                if (isinstance(decorator.func.value, ast.Attribute) and
-                    decorator.func.value.attr == "mark" and
-                    decorator.func.attr == "parametrize"):
-                    # Get the first argument (parameter name)
-                    if decorator.args and isinstance(decorator.args[0], ast.Constant):
-                        return decorator.args[0].value
+        return _DuplicateRemover.parametrize_name_extractor(decorator)
+
+    def _run_pytest(self, pytest_args: list[str], timeout: int) -> tuple[int, str]:
+        """
+        Run pytest and capture its exit code and combined output.
+
+        Args:
+            pytest_args: pytest command-line arguments (without the executable)
+            timeout: Seconds before the run is killed
+
+        Returns:
+            Tuple of (exit_code, output)
+
+        Raises:
+            subprocess.TimeoutExpired: If the run exceeds the timeout
+        """
+        if _FORK_CONTEXT is None:
+            result = subprocess.run(
+                ['pytest', *pytest_args],
+                capture_output=True,
+                text=True,
+                timeout=timeout
+            )
+            return result.returncode, result.stdout + "\n" + result.stderr
+
+        exit_code, output, _ = self._run_forked(pytest_args, timeout)
+        return exit_code, output
+
+    def _run_pytest_in_memory(
+        self,
+        pytest_args: list[str],
+        timeout: int,
+        sources: Dict[str, str]
+    ) -> Optional[tuple[int, str]]:
+        """
+        Run pytest with test files' contents swapped in from memory.
+
+        Nothing is written to disk: the forked worker imports the given
+        contents in place of the files, so a rejected fix leaves no trace.
+
+        Args:
+            pytest_args: pytest command-line arguments (node ids on the real files)
+            timeout: Seconds before the run is killed
+            sources: Mapping of test file path to the content to test
+
+        Returns:
+            Tuple of (exit_code, output), or None if the swap is unavailable
+            (no fork) or pytest bypassed it (e.g. --import-mode=importlib on
+            older pytest); callers then validate from files instead
+
+        Raises:
+            subprocess.TimeoutExpired: If the run exceeds the timeout
+        """
+        if _FORK_CONTEXT is None:
+            return None
+
+        exit_code, output, sources_used = self._run_forked(pytest_args, timeout, sources)
+        if not sources_used:
+            return None
+        return exit_code, output
+
+    def _run_forked(
+        self,
+        pytest_args: list[str],
+        timeout: int,
+        sources: Optional[Dict[str, str]] = None
+    ) -> tuple[int, str, bool]:
+        """
+        Run pytest.main() in a forked worker (see _pytest_worker).
+
+        Raises:
+            subprocess.TimeoutExpired: If the run exceeds the timeout
+        """
+        reader, writer = _FORK_CONTEXT.Pipe(duplex=False)
+        worker = _FORK_CONTEXT.Process(
+            target=_pytest_worker, args=(pytest_args, writer, sources), daemon=True
+        )
+        worker.start()
+        writer.close()
+
+        try:
+            if not reader.poll(timeout):
+                raise subprocess.TimeoutExpired(['pytest', *pytest_args], timeout)
+            try:
+                return reader.recv()
+            except EOFError:
+                worker.join()
+                return 3, f"pytest worker exited unexpectedly (exit code {worker.exitcode})", True
+        finally:
+            if worker.is_alive():
+                worker.kill()
+            worker.join()
+            reader.close()
+
+    def _candidate_path(self, test_file_path: str) -> str:
+        """
+        Path of the sibling file a candidate fix is validated from.
+
+        Same directory (so conftest.py and package imports apply unchanged,
+        and the final rename is atomic) and a .py suffix (so pytest collects it).
 
-        return ""
+        Args:
+            test_file_path: Path to the test file
+
+        Returns:
+            Candidate file path
+        """
+        path = Path(test_file_path)
+        return str(path.with_name(f"{path.stem}_autofix_candidate{path.suffix}"))
+
+    def _write_atomic(self, path: str, content: str) -> None:
+        """
+        Write a file via a sibling temp file and os.replace.
+
+        A crash mid-write can never leave a truncated test file behind.
+
+        Args:
+            path: Destination path
+            content: File content
+        """
+        tmp_path = f"{path}.autofix.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+        self._remember_source(path, content)
 
     def _test_fix_with_output(
         self,
         test_file_path: str,
         test_function_name: str,
-        patched_content: str,
-        original_content: str
+        patched_content: str
     ) -> tuple[bool, str]:
         """
         Test a fix and return detailed output for learning.
 
-        Writes the patched content temporarily, runs pytest on the specific test,
-        then restores the original. Returns both success status and failure output.
+        Runs pytest on the specific test with the patched content swapped in
+        from memory, so a rejected fix never touches disk; the test file is
+        only (atomically) written once the test passes. Where the in-memory
+        swap is unavailable, the content is validated from a sibling candidate
+        file that is renamed over the test file on success, deleted otherwise.
+        Outcomes are remembered per content digest, so resubmitting an
+        identical fix does not run pytest again.
 
         Args:
             test_file_path: Path to the test file
             test_function_name: Name of the test function
             patched_content: The proposed fix
-            original_content: The original content (for rollback)
 
         Returns:
             Tuple of (success, failure_output):
-            - success: True if the test passes with the fix
+            - success: True if the test passes with the fix (fix is now applied)
             - failure_output: Pytest output if test failed, empty string if passed
         """
         print(f"Testing fix before applying (regression prevention)...")
 
         # Strip parameter suffix for parameterized tests
         base_test_name = test_function_name.split('[')[0] if '[' in test_function_name else test_function_name
+        candidate_path = self._candidate_path(test_file_path)
+
+        # Identical candidates (common once LLM output is cleaned) are not re-run
+        cache_key = (test_file_path, base_test_name, hashlib.blake2b(patched_content.encode()).digest())
+        cached = self._validation_cache.get(cache_key)
 
         try:
-            # Write the patched content temporarily
-            with open(test_file_path, 'w') as f:
-                f.write(patched_content)
+            if cached is not None:
+                self._validation_cache.move_to_end(cache_key)
+                success, full_output = cached
+                if success:
+                    if self._read_source(test_file_path) != patched_content:
+                        self._write_atomic(test_file_path, patched_content)
+                    print(f"Fix validated - test passes! (same fix validated before)")
+                else:
+                    print(f"Fix validation failed - same fix already failed before")
+                return cached
 
             # Run pytest on this specific test
-            test_nodeid = f"{test_file_path}::{base_test_name}"
-            result = subprocess.run(
-                ['pytest', test_nodeid, '-v', '--tb=short', '-x'],
-                capture_output=True,
-                text=True,
-                timeout=30  # 30 second timeout
+            result = self._run_pytest_in_memory(
+                [f"{test_file_path}::{base_test_name}", '-x', *_VALIDATION_PYTEST_ARGS],
+                timeout=30,  # 30 second timeout
+                sources={test_file_path: patched_content}
             )
-
-            # Restore original content IMMEDIATELY
-            with open(test_file_path, 'w') as f:
-                f.write(original_content)
+            if result is not None:
+                returncode, full_output = result
+                if returncode == 0:
+                    self._write_atomic(test_file_path, patched_content)
+            else:
+                with open(candidate_path, 'w') as f:
+                    f.write(patched_content)
+
+                returncode, full_output = self._run_pytest(
+                    [f"{candidate_path}::{base_test_name}", '-x', *_VALIDATION_PYTEST_ARGS],
+                    timeout=30
+                )
+                if returncode == 0:
+                    if os.path.exists(test_file_path):
+                        shutil.copymode(test_file_path, candidate_path)
+                    os.replace(candidate_path, test_file_path)
+                    self._remember_source(test_file_path, patched_content)
+                else:
+                    # Report failures against the real test file name
+                    full_output = full_output.replace(
+                        os.path.basename(candidate_path), os.path.basename(test_file_path)
+                    )
+
+            self._remember_validation(cache_key, (returncode == 0, "" if returncode == 0 else full_output))
 
             # Check if test passed
-            if result.returncode == 0:
+            if returncode == 0:
                 print(f"Fix validated - test passes!")
                 return True, ""
             else:
                 # Test failed - capture full output for learning
                 print(f"Fix validation failed - test still fails:")
                 # Show last few lines to user
-                output_lines = result.stdout.split('\n')
+                output_lines = full_output.rstrip().split('\n')
                 for line in output_lines[-5:]:
                     if line.strip():
                         print(f"{line}")
 
                 # Return full output for LLM learning
-                full_output = result.stdout + "\n" + result.stderr
                 return False, full_output
 
         except subprocess.TimeoutExpired:
             # Test hung - definitely reject this fix
             print(f"Fix validation timed out - test hung")
-            # Restore original
-            try:
-                with open(test_file_path, 'w') as f:
-                    f.write(original_content)
-            except:
-                pass
             return False, "Test execution timed out after 30 seconds"
 
         except Exception as e:
-            # Any error during testing - restore original and reject
+            # Any error during testing - reject
             print(f"Error during fix validation: {e}")
-            try:
-                with open(test_file_path, 'w') as f:
-                    f.write(original_content)
-            except:
-                pass
             return False, f"Error during test execution: {str(e)}"
 
+        finally:
+            # Rejected (or failed to move): drop the candidate
+            if os.path.exists(candidate_path):
+                try:
+                    os.unlink(candidate_path)
+                except OSError:
+                    pass
+
+    def _remember_validation(self, cache_key: tuple[str, str, bytes], result: tuple[bool, str]) -> None:
+        """
+        Record a validation outcome, evicting the least recently used beyond the bound.
+
+        Args:
+            cache_key: (test file path, test name, content digest)
+            result: (success, failure_output) as returned by _test_fix_with_output
+        """
+        self._validation_cache[cache_key] = result
+        self._validation_cache.move_to_end(cache_key)
+        if len(self._validation_cache) > _VALIDATION_CACHE_SIZE:
+            self._validation_cache.popitem(last=False)
+
     def _test_fix_before_commit(
         self,
         test_file_path: str,
         test_function_name: str,
-        patched_content: str,
-        original_content: str
+        patched_content: str
     ) -> bool:
         """
         Test a fix before committing it to prevent regressions.
 
-        Writes the patched content temporarily, runs pytest on the specific test,
-        then restores the original. Only returns True if the test passes.
+        Validates the patched content from a candidate file and only moves it
+        over the test file if the test passes. Only returns True if the test passes.
 
         This is CRITICAL to prevent the auto-fixer from making things worse!
 
@@ -589,20 +1427,18 @@ class ASTPatcher:
             test_file_path: Path to the test file
             test_function_name: Name of the test function
             patched_content: The proposed fix
-            original_content: The original content (for rollback)
 
         Returns:
-            True if the test passes with the fix, False otherwise
+            True if the test passes with the fix (fix is now applied), False otherwise
         """
         success, _ = self._test_fix_with_output(
             test_file_path,
             test_function_name,
-            patched_content,
-            original_content
+            patched_content
         )
         return success
 
-    def _remove_duplicate_decorators(self, code: str) -> str:
+    def _remove_duplicate_decorators(self, code: str, tree: Optional[ast.AST] = None) -> str:
         """
         Automatically remove duplicate @pytest.mark.parametrize decorators from code.
 
@@ -611,54 +1447,45 @@ class ASTPatcher:
 
         Args:
             code: Python code (typically a function)
+            tree: AST already parsed from code (parsed here if omitted)
 
         Returns:
             Code with duplicate decorators removed
         """
-        try:
-            tree = ast.parse(code)
-        except SyntaxError:
-            # Can't parse, return as-is
+        if 'parametrize' not in code:
             return code
 
-        # Track if we made any changes
-        modified = False
+        if tree is None:
+            try:
+                tree = _parse_source(code)
+            except SyntaxError:
+                # Can't parse, return as-is
+                return code
+
+        duplicates = []
 
         # Process all function definitions (including async)
         for node in ast.walk(tree):
             if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
                 # Track seen parametrize parameter names
                 seen_params = set()
-                new_decorators = []
 
                 for decorator in node.decorator_list:
                     param_name = self._get_parametrize_param_name(decorator)
 
                     if param_name:
                         if param_name in seen_params:
-                            # Skip duplicate
                             print(f"  Auto-removing duplicate @pytest.mark.parametrize('{param_name}') from LLM fix")
-                            modified = True
+                            duplicates.append(decorator)
                             continue
                         seen_params.add(param_name)
 
-                    new_decorators.append(decorator)
-
-                if modified:
-                    node.decorator_list = new_decorators
-
-        if not modified:
+        if not duplicates:
             # No changes needed
             return code
 
-        # Convert back to code
-        try:
-            cleaned_code = ast.unparse(tree)
-            print(f"Automatically cleaned duplicate decorators from LLM-generated fix")
-            return cleaned_code
-        except Exception:
-            # If unparsing fails, return original
-            return code
+        print(f"Automatically cleaned duplicate decorators from LLM-generated fix")
+        return self._splice_out_decorators(code, duplicates)
 
     def _remove_duplicate_decorators_from_file(self, file_content: str) -> str:
         """
@@ -673,52 +1500,44 @@ class ASTPatcher:
         Returns:
             Cleaned file content
         """
+        if 'parametrize' not in file_content:
+            return file_content
+
         try:
-            tree = ast.parse(file_content)
+            tree = _parse_source(file_content)
         except SyntaxError:
             return file_content
 
-        modified = False
+        # Collect duplicate decorators (the tree is shared, so it is not modified)
+        _REMOVER.reset()
+        _REMOVER.visit(tree)
 
-        # Use ast.NodeTransformer for proper modification
-        class DuplicateRemover(ast.NodeTransformer):
-            def __init__(self, patcher):
-                self.patcher = patcher
-                self.modified = False
+        if _REMOVER.duplicates:
+            return self._splice_out_decorators(file_content, _REMOVER.duplicates)
 
-            def _process_function(self, node):
-                """Process both regular and async functions."""
-                seen_params = set()
-                new_decorators = []
-
-                for decorator in node.decorator_list:
-                    param_name = self.patcher._get_parametrize_param_name(decorator)
+        return file_content
 
-                    if param_name:
-                        if param_name in seen_params:
-                            # Skip duplicate
-                            self.modified = True
-                            continue
-                        seen_params.add(param_name)
-
-                    new_decorators.append(decorator)
-
-                node.decorator_list = new_decorators
-                return node
+    def _splice_out_decorators(self, source: str, decorators: list[ast.expr]) -> str:
+        """
+        Delete decorators from source by their line spans.
 
-            def visit_FunctionDef(self, node):
-                return self._process_function(node)
+        Everything else (comments, quoting, blank lines) is kept verbatim,
+        unlike an ast.unparse round-trip.
 
-            def visit_AsyncFunctionDef(self, node):
-                return self._process_function(node)
+        Args:
+            source: Source the decorator nodes were parsed from
+            decorators: Decorator expression nodes to remove
 
-        remover = DuplicateRemover(self)
-        cleaned_tree = remover.visit(tree)
+        Returns:
+            Source without those decorator lines
+        """
+        line_offsets = _line_offsets(source)
 
-        if remover.modified:
-            try:
-                return ast.unparse(cleaned_tree)
-            except Exception:
-                return file_content
+        # Back to front so earlier offsets stay valid
+        for decorator in sorted(decorators, key=lambda node: node.lineno, reverse=True):
+            # The decorator's lines, from its '@' line through its last line
+            start = line_offsets[decorator.lineno - 1]
+            end = line_offsets[decorator.end_lineno] if decorator.end_lineno < len(line_offsets) else len(source)
+            source = source[:start] + source[end:]
 
-        return file_content
\ No newline at end of file
+        return source
@@ -12,24 +12,83 @@ This solves the following problems from AST-based extraction:
 - ✓ Finds dynamically assigned routes
 - ✓ Works with nested/hidden functions
 - ✓ No token limit issues during indexing
+
+Requires Python 3.10+ (ast.unparse, dataclass slots).
 """
 
 import ast
 import os
+from functools import cached_property
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import sys
 import json
 from typing import Dict, List, Set, Optional, Tuple
 from pathlib import Path
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field, fields
 import hashlib
-import pickle
 import re
+import sqlite3
+import tempfile
+import numpy as np
+
+from .gen_clients import gen_module
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
 
 # Add parent directory to path to import gen modules
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
+# Bound once: signature building calls it for every function and class
+_unparse = ast.unparse
+
+# Bump whenever extract_code_elements output changes, so cached elements
+# from an older extractor are not reused
+AST_CACHE_SCHEMA_VERSION = 4
+
+
+def _json_dumps(obj) -> bytes:
+    """Serialize to JSON bytes, with orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def _json_loads(data: bytes):
+    """Parse JSON bytes, with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
-@dataclass
+# Directories never indexed (virtualenvs, dependencies, caches, build output)
+EXCLUDE_DIRS = frozenset({
+    'venv', 'env', '.venv', 'myvenv',
+    'node_modules', '.git', '__pycache__',
+    '.pytest_cache', '.mypy_cache',
+    'build', 'dist', '.eggs'
+})
+
+# Route decorator attributes that mark HTTP endpoints (@app.get(...), ...)
+HTTP_METHODS = frozenset({'get', 'post', 'put', 'delete', 'patch', 'head', 'options'})
+
+# Test files (we index source code only)
+_TEST_FILE_RE = re.compile(r'^test|test_')
+
+# Storage precision of the embedding matrix: SQ8 codes (default) or float32
+EMBEDDING_PRECISIONS = {'int8': np.int8, 'float32': np.float32}
+
+# Below this many files, extraction runs serially (pool startup would dominate)
+MIN_FILES_FOR_PARALLEL_EXTRACTION = 8
+
+
+@dataclass(slots=True, frozen=True)
 class CodeElement:
     """Represents a single code element (function, class, variable, etc.)"""
     element_type: str  # 'function', 'class', 'variable', 'http_endpoint'
@@ -42,6 +101,8 @@ class CodeElement:
     docstring: Optional[str] = None
     http_method: Optional[str] = None  # For HTTP endpoints: GET, POST, etc.
     http_path: Optional[str] = None  # For HTTP endpoints: /api/users
+    # Memoized to_embedding_text() result (not stored)
+    _embedding_text: Optional[str] = field(default=None, init=False, repr=False, compare=False)
 
     def to_embedding_text(self) -> str:
         """
@@ -53,34 +114,300 @@ class CodeElement:
         - Docstring context
         - HTTP endpoint info (if applicable)
         - Partial source code
+
+        Built once per element; later calls (cache keys, retries) reuse it.
         """
-        parts = []
+        if self._embedding_text is not None:
+            return self._embedding_text
 
         # Basic info
-        parts.append(f"{self.element_type}: {self.name}")
+        text = f"{self.element_type}: {self.name}"
 
         # Signature
         if self.signature:
-            parts.append(f"signature: {self.signature}")
+            text += f"\nsignature: {self.signature}"
 
         # Docstring
         if self.docstring:
-            parts.append(f"description: {self.docstring}")
+            text += f"\ndescription: {self.docstring}"
 
         # HTTP endpoint info
         if self.http_method and self.http_path:
-            parts.append(f"HTTP {self.http_method} {self.http_path}")
+            text += f"\nHTTP {self.http_method} {self.http_path}"
 
         # Source code (truncated to first 500 chars for embedding)
         if self.source_code:
-            code_sample = self.source_code[:500]
-            parts.append(f"code: {code_sample}")
+            text += f"\ncode: {self.source_code[:500]}"
 
-        return "\n".join(parts)
+        # Frozen dataclass: set the memo field directly
+        object.__setattr__(self, '_embedding_text', text)
+        return text
 
     def to_dict(self) -> dict:
         """Convert to dictionary for storage."""
-        return asdict(self)
+        return {name: getattr(self, name) for name in CODE_ELEMENT_FIELDS}
+
+
+# Stored CodeElement fields, in constructor order
+CODE_ELEMENT_FIELDS = tuple(f.name for f in fields(CodeElement) if f.init)
+
+
+def quantize_sq8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-vector int8 (SQ8) quantization.
+
+    Each row is scaled so its largest magnitude maps to 127:
+    vectors[i] ~= codes[i] * scales[i].
+
+    Args:
+        vectors: float32 matrix [N, D]
+
+    Returns:
+        Tuple of (codes int8 [N, D], scales float32 [N])
+    """
+    scales = (np.abs(vectors).max(axis=1) / 127).astype(np.float32)
+    codes = np.round(vectors / np.where(scales > 0, scales, 1)[:, None]).astype(np.int8)
+    return codes, scales
+
+
+def dot_quant(
+    query: np.ndarray,
+    codes: np.ndarray,
+    scales: np.ndarray,
+    block_rows: int = 4096
+) -> np.ndarray:
+    """
+    Dot products of float queries with SQ8-quantized vectors.
+
+    The per-row scale is applied to each row's dot product instead of the
+    rows, so the matrix is never dequantized; codes are only widened one
+    block of rows at a time for the BLAS product.
+
+    Args:
+        query: float32 query vector [D], or queries [Q, D] (one GEMM)
+        codes: int8 codes [N, D] (float32 vectors work too, with unit scales)
+        scales: float32 scales [N]
+        block_rows: Rows widened per block
+
+    Returns:
+        float32 array [N] (or [N, Q]) of dot products
+    """
+    query = np.asarray(query, dtype=np.float32)
+    result = np.empty((len(codes),) + query.shape[:-1], dtype=np.float32)
+    for start in range(0, len(codes), block_rows):
+        block = codes[start:start + block_rows]
+        result[start:start + len(block)] = block.astype(np.float32, copy=False) @ query.T
+    return result * (scales if query.ndim == 1 else scales[:, None])
+
+
+def pack_sign_bits(vectors: np.ndarray) -> np.ndarray:
+    """
+    Binary-quantize vectors to one sign bit per dimension.
+
+    Args:
+        vectors: Matrix [N, D] or vector [D] (float or int8 codes)
+
+    Returns:
+        uint8 array [N, ceil(D / 8)] (or [ceil(D / 8)]) of packed bits
+    """
+    return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+
+# Set bits per byte value, for NumPy without np.bitwise_count (< 2.0)
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+if numba is not None:
+    _M1 = np.uint64(0x5555555555555555)
+    _M2 = np.uint64(0x3333333333333333)
+    _M4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+    _H01 = np.uint64(0x0101010101010101)
+
+    @numba.njit(parallel=True, cache=True)
+    def _hamming_kernel(words, query_words, out):
+        """
+        Compiled Hamming scan over 64-bit words: xor, popcount (SWAR, which
+        LLVM lowers to popcnt) and sum fused per row, rows in parallel.
+        """
+        for row in numba.prange(words.shape[0]):
+            total = 0
+            for word in range(words.shape[1]):
+                x = words[row, word] ^ query_words[word]
+                x = x - ((x >> np.uint64(1)) & _M1)
+                x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+                x = (x + (x >> np.uint64(4))) & _M4
+                total += (x * _H01) >> np.uint64(56)
+            out[row] = total
+else:
+    _hamming_kernel = None
+
+
+def hamming_distances(
+    bits: np.ndarray,
+    query_bits: np.ndarray,
+    block_rows: int = 4096
+) -> np.ndarray:
+    """
+    Hamming distances between packed sign bits and a packed query.
+
+    Args:
+        bits: uint8 packed bits [N, B]
+        query_bits: uint8 packed query bits [B]
+        block_rows: Rows compared per block
+
+    Returns:
+        int32 array [N] of distances
+    """
+    result = np.empty(len(bits), dtype=np.int32)
+    if _hamming_kernel is not None and bits.shape[-1] % 8 == 0:
+        # No [block, B] temporaries; compiled once, then cached on disk
+        _hamming_kernel(
+            np.ascontiguousarray(bits).view(np.uint64),
+            np.ascontiguousarray(query_bits).view(np.uint64),
+            result
+        )
+        return result
+
+    for start in range(0, len(bits), block_rows):
+        diff = np.bitwise_xor(bits[start:start + block_rows], query_bits)
+        counts = np.bitwise_count(diff) if hasattr(np, 'bitwise_count') else _POPCOUNT8[diff]
+        result[start:start + len(diff)] = counts.sum(axis=1, dtype=np.int32)
+    return result
+
+
+class _CodeElementVisitor(ast.NodeVisitor):
+    """
+    Collects a module's code elements in a single pass.
+
+    Functions and classes are found at any depth: methods are named
+    Class.method, nested definitions outer.inner. Variables are collected
+    outside of functions and classes only (module-level constants). Only
+    statements are visited, never expressions, since definitions can only
+    appear as statements.
+    """
+
+    def __init__(self, indexer: 'CodebaseIndexer', file_path: Path, lines: List[str]):
+        self.indexer = indexer
+        self.file_path = file_path
+        self.lines = lines
+        self.elements: List[CodeElement] = []
+        # Names of the enclosing classes/functions
+        self._scope_stack: List[str] = []
+
+    def generic_visit(self, node):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.stmt, ast.excepthandler, ast.match_case)):
+                self.visit(child)
+
+    def _visit_scope(self, node):
+        self._scope_stack.append(node.name)
+        self.generic_visit(node)
+        self._scope_stack.pop()
+
+    def _visit_function(self, node):
+        element = self.indexer._extract_function(
+            node, self.file_path, self.lines,
+            class_name='.'.join(self._scope_stack) or None
+        )
+        if element:
+            self.elements.append(element)
+
+            # Extract HTTP endpoints from decorators
+            http_element = self.indexer._extract_http_endpoint(node, self.file_path, self.lines)
+            if http_element:
+                self.elements.append(http_element)
+
+        self._visit_scope(node)
+
+    visit_FunctionDef = _visit_function
+    visit_AsyncFunctionDef = _visit_function
+
+    def visit_ClassDef(self, node):
+        element = self.indexer._extract_class(node, self.file_path, self.lines)
+        if element:
+            self.elements.append(element)
+
+        # Extract methods (and nested classes) from class
+        self._visit_scope(node)
+
+    def visit_Assign(self, node):
+        # Variables (module-level constants)
+        if self._scope_stack:
+            return
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                element = self.indexer._extract_variable(
+                    target.id, node, self.file_path, self.lines
+                )
+                if element:
+                    self.elements.append(element)
+
+
+def _node_source(node: ast.AST, lines: List[str]) -> str:
+    """
+    Get a node's source text (including decorators) from the file's lines.
+
+    Args:
+        node: Statement node
+        lines: File content split with keepends=True
+
+    Returns:
+        Source lines spanned by the node, without the final newline
+    """
+    decorators = getattr(node, 'decorator_list', None)
+    start = decorators[0].lineno if decorators else node.lineno
+    return "".join(lines[start - 1:node.end_lineno or node.lineno]).rstrip('\r\n')
+
+
+# Mode of a file created with open(): mkstemp's files are owner-only.
+# os.umask can only be read by setting it, so this is done once, at import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+_NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+class _AtomicFile:
+    """Binary file written via a sibling temp file, moved into place on success."""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def __enter__(self):
+        fd, self.tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb):
+        replaced = False
+        try:
+            self.file.close()
+            if exc_type is None:
+                os.chmod(self.tmp_path, _NEW_FILE_MODE)
+                os.replace(self.tmp_path, self.path)
+                replaced = True
+        finally:
+            if not replaced:
+                os.unlink(self.tmp_path)
+        return False
+
+
+# Per-process indexer used by extraction workers (see build_index)
+_worker_indexer: Optional['CodebaseIndexer'] = None
+
+
+def _init_extract_worker(project_root: str, cache_dir: str, verbose: bool) -> None:
+    """Set up the indexer an extraction worker process extracts with."""
+    global _worker_indexer
+    _worker_indexer = CodebaseIndexer(
+        project_root=project_root,
+        cache_dir=cache_dir,
+        embedding_model="",  # Not used for extraction; skips model detection
+        verbose=verbose
+    )
+
+
+def _extract_worker(file_path: Path) -> List[dict]:
+    """Extract a file's code elements in a worker process, as picklable dicts."""
+    return [elem.to_dict() for elem in _worker_indexer.extract_code_elements(file_path)]
 
 
 class CodebaseIndexer:
@@ -96,10 +423,17 @@ class CodebaseIndexer:
         project_root: str = ".",
         cache_dir: str = ".codebase_index",
         embedding_model: str = None,
-        verbose: bool = False
+        verbose: bool = False,
+        precision: str = "int8"
     ):
+        if precision not in EMBEDDING_PRECISIONS:
+            raise ValueError(
+                f"Unsupported precision {precision!r}; expected one of {sorted(EMBEDDING_PRECISIONS)}"
+            )
+
         self.project_root = Path(project_root)
         self.cache_dir = Path(cache_dir)
+        self.precision = precision
 
         # Auto-detect embedding model from environment
         if embedding_model is None:
@@ -117,83 +451,58 @@ class CodebaseIndexer:
 
         self.verbose = verbose
 
+        # Starting embedding batch size; adapted while embedding (see _embed_texts)
+        self.embed_batch_size = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
         # Create cache directory
         self.cache_dir.mkdir(exist_ok=True)
 
         # Storage
         self.code_elements: List[CodeElement] = []
-        self.embeddings: List[List[float]] = []
-
-        # Lazy-load embedding client
-        self._embedding_client = None
-
-    @property
+        # L2-normalized embeddings as codes [N, D] (memory-mapped once loaded)
+        # and one float32 scale per row: SQ8 int8 codes with precision="int8"
+        # (4x smaller than float32), raw vectors with unit scales otherwise
+        self.embedding_codes: np.ndarray = np.zeros((0, 0), dtype=EMBEDDING_PRECISIONS[precision])
+        self.embedding_scales: np.ndarray = np.zeros(0, dtype=np.float32)
+        # Packed sign bits of the embeddings, for the Hamming prefilter in search()
+        self.embedding_bits: np.ndarray = np.zeros((0, 0), dtype=np.uint8)
+        # element_type column of code_elements, for vectorized filtering
+        self._element_types: np.ndarray = np.zeros(0, dtype=object)
+
+    @cached_property
     def embedding_client(self):
-        """Lazy-load embedding client (Ollama or OpenAI)."""
-        if self._embedding_client is None:
-            # Import using spec_from_file_location to completely bypass gen package __init__.py
-            import importlib.util
-            from pathlib import Path
-
-            # Get absolute path to client files (works from any directory)
-            current_file = Path(__file__).resolve()
-            ollama_client_path = current_file.parent.parent / 'gen' / 'ollama_client.py'
-            openai_client_path = current_file.parent.parent / 'gen' / 'openai_client.py'
-
-            # Check if using Ollama (preferred)
-            if os.getenv("OLLAMA_HOST") or os.getenv("OLLAMA_EMBED_MODEL"):
-                try:
-                    # Load ollama_client.py directly without triggering package __init__
-                    spec = importlib.util.spec_from_file_location(
-                        "ollama_client_indexer",
-                        str(ollama_client_path)
-                    )
-                    ollama_module = importlib.util.module_from_spec(spec)
-                    sys.modules['ollama_client_indexer'] = ollama_module
-                    spec.loader.exec_module(ollama_module)
-
-                    self._embedding_client = ollama_module.get_ollama_client()
-                    if self.verbose:
-                        print("  Using Ollama for embeddings")
-                except Exception as e:
-                    if self.verbose:
-                        print(f"Failed to load Ollama client: {e}")
-                    # Fall back to OpenAI
-                    try:
-                        spec = importlib.util.spec_from_file_location(
-                            "openai_client_indexer_fallback",
-                            str(openai_client_path)
-                        )
-                        openai_module = importlib.util.module_from_spec(spec)
-                        sys.modules['openai_client_indexer_fallback'] = openai_module
-                        spec.loader.exec_module(openai_module)
-
-                        self._embedding_client = openai_module.create_client()
-                        if self.verbose:
-                            print("  Using OpenAI for embeddings (fallback)")
-                    except Exception as e2:
-                        if self.verbose:
-                            print(f"Both Ollama and OpenAI failed: {e2}")
-                        self._embedding_client = None
-            else:
-                # Use OpenAI
-                try:
-                    spec = importlib.util.spec_from_file_location(
-                        "openai_client_indexer_main",
-                        str(openai_client_path)
-                    )
-                    openai_module = importlib.util.module_from_spec(spec)
-                    sys.modules['openai_client_indexer_main'] = openai_module
-                    spec.loader.exec_module(openai_module)
-
-                    self._embedding_client = openai_module.create_client()
-                    if self.verbose:
-                        print("  Using OpenAI for embeddings")
-                except Exception as e:
-                    if self.verbose:
-                        print(f"Failed to load OpenAI client: {e}")
-                    self._embedding_client = None
-        return self._embedding_client
+        """Lazy-load embedding client (Ollama or OpenAI), once per indexer."""
+        # Check if using Ollama (preferred)
+        if os.getenv("OLLAMA_HOST") or os.getenv("OLLAMA_EMBED_MODEL"):
+            try:
+                client = gen_module('ollama_client').get_ollama_client()
+                if self.verbose:
+                    print("  Using Ollama for embeddings")
+                return client
+            except Exception as e:
+                if self.verbose:
+                    print(f"Failed to load Ollama client: {e}")
+            # Fall back to OpenAI
+            try:
+                client = gen_module('openai_client').create_client()
+                if self.verbose:
+                    print("  Using OpenAI for embeddings (fallback)")
+                return client
+            except Exception as e2:
+                if self.verbose:
+                    print(f"Both Ollama and OpenAI failed: {e2}")
+                return None
+
+        # Use OpenAI
+        try:
+            client = gen_module('openai_client').create_client()
+            if self.verbose:
+                print("  Using OpenAI for embeddings")
+            return client
+        except Exception as e:
+            if self.verbose:
+                print(f"Failed to load OpenAI client: {e}")
+            return None
 
     def should_index_file(self, file_path: Path) -> bool:
         """
@@ -205,33 +514,52 @@ class CodebaseIndexer:
         Returns:
             True if should be indexed
         """
-        # Skip directories to exclude
-        exclude_dirs = {
-            'venv', 'env', '.venv', 'myvenv',
-            'node_modules', '.git', '__pycache__',
-            '.pytest_cache', '.mypy_cache',
-            'build', 'dist', '.eggs'
-        }
-
-        # Check if any parent directory is excluded
-        for part in file_path.parts:
-            if part in exclude_dirs:
-                return False
-
         # Only Python files
         if file_path.suffix != '.py':
             return False
 
         # Skip test files (we index source code only)
-        if 'test_' in file_path.name or file_path.name.startswith('test'):
+        if _TEST_FILE_RE.search(file_path.name):
             return False
 
-        return True
+        # Check if any parent directory is excluded
+        return EXCLUDE_DIRS.isdisjoint(file_path.parts)
+
+    def _walk_python_files(self, root: Path):
+        """
+        Find .py files under root, never descending into EXCLUDE_DIRS.
+
+        Excluded trees (node_modules, virtualenvs...) are pruned before they
+        are listed, instead of every file in them being rejected afterwards.
+        Symlinked directories are not followed (like Path.rglob).
+
+        Args:
+            root: Directory to search
+
+        Yields:
+            Path of each .py file
+        """
+        stack = [str(root)]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in EXCLUDE_DIRS:
+                            stack.append(entry.path)
+                    elif entry.name.endswith('.py') and entry.is_file():
+                        yield Path(entry.path)
 
     def extract_code_elements(self, file_path: Path) -> List[CodeElement]:
         """
         Extract all code elements from a Python file.
 
+        Results are cached on disk keyed by the file's content, so unchanged
+        files are not re-parsed on the next build_index.
+
         Args:
             file_path: Path to Python file
 
@@ -239,68 +567,78 @@ class CodebaseIndexer:
             List of CodeElement objects
         """
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except (IOError, UnicodeDecodeError) as e:
+            content_bytes = file_path.read_bytes()
+        except IOError as e:
             if self.verbose:
                 print(f"Could not read {file_path}: {e}")
             return []
 
+        cache_path = self._ast_cache_path(content_bytes)
+        cached = self._load_cached_elements(cache_path, file_path)
+        if cached is not None:
+            return cached
+
+        # Parse the raw bytes: the tokenizer honours BOMs and coding cookies
         try:
-            tree = ast.parse(content)
-        except SyntaxError as e:
+            tree = ast.parse(content_bytes, filename=str(file_path))
+        except (SyntaxError, ValueError) as e:
             if self.verbose:
                 print(f"Syntax error in {file_path}: {e}")
             return []
 
-        elements = []
+        # Element source is sliced from the file's lines, not regenerated
+        content = content_bytes.decode('utf-8-sig', errors='replace')
+        lines = content.splitlines(keepends=True)
 
-        # Extract all top-level definitions
-        for node in tree.body:
-            # Functions
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                element = self._extract_function(node, file_path, content)
-                if element:
-                    elements.append(element)
+        # Extract all definitions in one pass
+        visitor = _CodeElementVisitor(self, file_path, lines)
+        visitor.visit(tree)
+        elements = visitor.elements
 
-                    # Extract HTTP endpoints from decorators
-                    http_element = self._extract_http_endpoint(node, file_path, content)
-                    if http_element:
-                        elements.append(http_element)
+        self._store_cached_elements(cache_path, elements)
+        return elements
 
-            # Classes
-            elif isinstance(node, ast.ClassDef):
-                element = self._extract_class(node, file_path, content)
-                if element:
-                    elements.append(element)
-
-                # Extract methods from class
-                for item in node.body:
-                    if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                        method_element = self._extract_function(
-                            item, file_path, content,
-                            class_name=node.name
-                        )
-                        if method_element:
-                            elements.append(method_element)
-
-            # Variables (module-level constants)
-            elif isinstance(node, ast.Assign):
-                for target in node.targets:
-                    if isinstance(target, ast.Name):
-                        element = self._extract_variable(
-                            target.id, node, file_path, content
-                        )
-                        if element:
-                            elements.append(element)
+    def _ast_cache_path(self, content_bytes: bytes) -> Path:
+        """
+        Get the cache file for a file's extracted elements.
 
-        return elements
+        Keyed by SHA-256 of the file content plus the Python version (ast
+        output differs across versions) and AST_CACHE_SCHEMA_VERSION.
+        """
+        digest = hashlib.sha256(content_bytes)
+        digest.update(f"\0{sys.version_info[0]}.{sys.version_info[1]}\0{AST_CACHE_SCHEMA_VERSION}".encode())
+        key = digest.hexdigest()
+        return self.cache_dir / "ast-cache" / key[:2] / f"{key}.json"
+
+    def _load_cached_elements(self, cache_path: Path, file_path: Path) -> Optional[List[CodeElement]]:
+        """Load cached elements for a file, or None on a cache miss."""
+        try:
+            element_dicts = _json_loads(cache_path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            if self.verbose:
+                print(f"Ignoring unreadable AST cache entry {cache_path}: {e}")
+            return None
+
+        # Content-addressed: identical files at other paths share an entry
+        return [CodeElement(**{**elem, 'file_path': str(file_path)}) for elem in element_dicts]
+
+    def _store_cached_elements(self, cache_path: Path, elements: List[CodeElement]) -> None:
+        """Atomically write a file's extracted elements to the AST cache."""
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with _AtomicFile(cache_path) as f:
+                f.write(_json_dumps([elem.to_dict() for elem in elements]))
+        except OSError as e:
+            if self.verbose:
+                print(f"Could not write AST cache entry {cache_path}: {e}")
 
     def _extract_function(
         self,
         node: ast.FunctionDef,
         file_path: Path,
-        content: str,
+        lines: List[str],
         class_name: Optional[str] = None
     ) -> Optional[CodeElement]:
         """Extract function/method as CodeElement."""
@@ -311,14 +649,14 @@ class CodebaseIndexer:
                 func_name = f"{class_name}.{func_name}"
 
             # Get signature
-            signature = ast.unparse(node.args) if hasattr(ast, 'unparse') else str(node.args)
+            signature = _unparse(node.args)
             signature = f"def {node.name}({signature}):"
 
             # Get docstring
             docstring = ast.get_docstring(node)
 
             # Get source code
-            source_code = ast.unparse(node) if hasattr(ast, 'unparse') else ""
+            source_code = _node_source(node, lines)
 
             return CodeElement(
                 element_type='function',
@@ -339,14 +677,14 @@ class CodebaseIndexer:
         self,
         node: ast.ClassDef,
         file_path: Path,
-        content: str
+        lines: List[str]
     ) -> Optional[CodeElement]:
         """Extract class as CodeElement."""
         try:
             # Get class signature
             signature = f"class {node.name}"
             if node.bases:
-                bases = ', '.join(ast.unparse(base) for base in node.bases)
+                bases = ', '.join(_unparse(base) for base in node.bases)
                 signature += f"({bases})"
             signature += ":"
 
@@ -354,7 +692,7 @@ class CodebaseIndexer:
             docstring = ast.get_docstring(node)
 
             # Get source code
-            source_code = ast.unparse(node) if hasattr(ast, 'unparse') else ""
+            source_code = _node_source(node, lines)
 
             return CodeElement(
                 element_type='class',
@@ -376,12 +714,12 @@ class CodebaseIndexer:
         var_name: str,
         node: ast.Assign,
         file_path: Path,
-        content: str
+        lines: List[str]
     ) -> Optional[CodeElement]:
         """Extract module-level variable as CodeElement."""
         try:
             # Get source code
-            source_code = ast.unparse(node) if hasattr(ast, 'unparse') else ""
+            source_code = _node_source(node, lines)
 
             return CodeElement(
                 element_type='variable',
@@ -401,7 +739,7 @@ class CodebaseIndexer:
         self,
         node: ast.FunctionDef,
         file_path: Path,
-        content: str
+        lines: List[str]
     ) -> Optional[CodeElement]:
         """
         Extract HTTP endpoint from FastAPI/Flask decorators.
@@ -419,7 +757,7 @@ class CodebaseIndexer:
 
             # Create HTTP endpoint element
             try:
-                source_code = ast.unparse(node) if hasattr(ast, 'unparse') else ""
+                source_code = _node_source(node, lines)
 
                 return CodeElement(
                     element_type='http_endpoint',
@@ -449,27 +787,20 @@ class CodebaseIndexer:
         if not isinstance(decorator, ast.Call):
             return None
 
-        if not isinstance(decorator.func, ast.Attribute):
-            return None
-
         # Get method (get, post, put, delete, etc.)
-        method_name = decorator.func.attr
-        http_methods = ['get', 'post', 'put', 'delete', 'patch', 'head', 'options']
-
-        if method_name not in http_methods:
+        func = decorator.func
+        if not isinstance(func, ast.Attribute) or func.attr not in HTTP_METHODS:
             return None
+        method_name = func.attr
 
         # Get path (first argument)
         if not decorator.args:
             return None
 
         first_arg = decorator.args[0]
-        if isinstance(first_arg, ast.Constant):
-            path = first_arg.value
-        elif isinstance(first_arg, ast.Str):
-            path = first_arg.s
-        else:
+        if not isinstance(first_arg, ast.Constant) or not isinstance(first_arg.value, str):
             return None
+        path = first_arg.value
 
         return (method_name.upper(), path)
 
@@ -480,34 +811,37 @@ class CodebaseIndexer:
         Args:
             force_rebuild: If True, rebuild even if cache exists
         """
-        cache_file = self.cache_dir / "index.pkl"
+        cache_file = self.cache_dir / "index.json"
 
         # Check cache
         if not force_rebuild and cache_file.exists():
             if self.verbose:
                 print("Loading index from cache...")
             self.load_index()
-            return
+            if self.embedding_codes.dtype == EMBEDDING_PRECISIONS[self.precision]:
+                return
+            # Embeddings come back from the embedding cache, so this is cheap
+            if self.verbose:
+                print(f"Cached index is not stored as {self.precision}, rebuilding...")
 
         if self.verbose:
             print("Building codebase index...")
 
         # Find all Python files
-        python_files = []
-        for file_path in self.project_root.rglob("*.py"):
-            if self.should_index_file(file_path):
-                python_files.append(file_path)
+        python_files = [
+            file_path for file_path in self._walk_python_files(self.project_root)
+            if self.should_index_file(file_path)
+        ]
 
         if self.verbose:
             print(f"  Found {len(python_files)} Python files to index")
 
-        # Extract code elements
+        # Extract code elements (parsing is CPU-bound: use a process pool)
         self.code_elements = []
-        for file_path in python_files:
+        for file_path, elements in zip(python_files, self._extract_all(python_files)):
             if self.verbose:
                 print(f"Indexing {file_path.relative_to(self.project_root)}...")
 
-            elements = self.extract_code_elements(file_path)
             self.code_elements.extend(elements)
 
             if self.verbose and elements:
@@ -524,7 +858,7 @@ class CodebaseIndexer:
         if self.verbose:
             print("\n Generating embeddings...")
 
-        self.embeddings = self._generate_embeddings_batch(self.code_elements)
+        self._set_embeddings(self._generate_embeddings_batch(self.code_elements))
 
         # Save cache
         if self.verbose:
@@ -534,94 +868,497 @@ class CodebaseIndexer:
         if self.verbose:
             print(" Index built successfully!")
 
+    def _extract_all(self, python_files: List[Path]):
+        """
+        Extract code elements from each file, in order.
+
+        Args:
+            python_files: Files to extract from
+
+        Yields:
+            List of CodeElement objects per file
+        """
+        if len(python_files) < MIN_FILES_FOR_PARALLEL_EXTRACTION:
+            for file_path in python_files:
+                yield self.extract_code_elements(file_path)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            initializer=_init_extract_worker,
+            initargs=(str(self.project_root), str(self.cache_dir), self.verbose)
+        ) as executor:
+            for element_dicts in executor.map(_extract_worker, python_files, chunksize=16):
+                yield [CodeElement(**elem) for elem in element_dicts]
+
+    def _set_embeddings(self, embeddings: List[List[float]]) -> None:
+        """
+        Store embeddings L2-normalized, SQ8-quantized unless precision is float32.
+
+        Args:
+            embeddings: One embedding vector per code element
+        """
+        if not embeddings:
+            self.embedding_codes = np.zeros((0, 0), dtype=EMBEDDING_PRECISIONS[self.precision])
+            self.embedding_scales = np.zeros(0, dtype=np.float32)
+            self.embedding_bits = np.zeros((0, 0), dtype=np.uint8)
+            return
+
+        # Zero-vector placeholders for failed batches may have a guessed
+        # dimension; such rows are left as zeros at the real dimension
+        dim = max((len(e) for e in embeddings if any(e)), default=len(embeddings[0]))
+        matrix = np.zeros((len(embeddings), dim), dtype=np.float32)
+        for i, embedding in enumerate(embeddings):
+            if len(embedding) == dim:
+                matrix[i] = embedding
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # Zero vectors (failed embeddings) stay zero
+        matrix /= np.where(norms > 0, norms, 1)
+        if self.precision == 'int8':
+            self.embedding_codes, self.embedding_scales = quantize_sq8(matrix)
+        else:
+            self.embedding_codes = matrix
+            self.embedding_scales = np.ones(len(matrix), dtype=np.float32)
+        self.embedding_bits = pack_sign_bits(matrix)
+
+    def cosine_similarities(self, query_embedding: List[float]) -> np.ndarray:
+        """
+        Cosine similarity of a query embedding with every indexed element.
+
+        Args:
+            query_embedding: Query embedding vector
+
+        Returns:
+            Array of similarity scores, one per code element
+        """
+        return dot_quant(self._normalize_query(query_embedding), self.embedding_codes, self.embedding_scales)
+
+    @staticmethod
+    def _normalize_query(query_embedding: List[float]) -> np.ndarray:
+        """Query embedding as an L2-normalized float32 vector."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        return query
+
+    @property
+    def element_types(self) -> np.ndarray:
+        """element_type of every code element, as an array."""
+        if len(self._element_types) != len(self.code_elements):
+            self._element_types = np.array([elem.element_type for elem in self.code_elements], dtype=object)
+        return self._element_types
+
+    def search(
+        self,
+        query_embedding: List[float],
+        k: int,
+        element_type: Optional[str] = None,
+        min_similarity: Optional[float] = None,
+        prefilter_k: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k elements most similar to a query embedding.
+
+        Scoring is one blocked matrix-vector product over the (normalized)
+        index, filtering is boolean masks, and only the top k are sorted
+        (argpartition), so nothing loops over elements in Python.
+
+        With prefilter_k, search is two-stage: the prefilter_k candidates
+        whose sign bits are closest in Hamming distance to the query's are
+        selected first, and only those are scored exactly. This scans 1 bit
+        per dimension instead of 8, at a small recall cost.
+
+        Args:
+            query_embedding: Query embedding vector
+            k: Number of results
+            element_type: Only consider elements of this type
+            min_similarity: Only consider elements at least this similar
+            prefilter_k: Number of Hamming-prefiltered candidates to rescore
+                         (None: score every element)
+
+        Returns:
+            Tuple of (indices, similarities), most similar first
+        """
+        query = self._normalize_query(query_embedding)
+
+        if element_type:
+            candidates = np.flatnonzero(self.element_types == element_type)
+        else:
+            candidates = np.arange(len(self.embedding_scales))
+
+        if prefilter_k is not None and max(prefilter_k, k) < len(candidates):
+            prefilter_k = max(prefilter_k, k)
+            distances = hamming_distances(self.embedding_bits, pack_sign_bits(query))[candidates]
+            candidates = np.sort(candidates[np.argpartition(distances, prefilter_k)[:prefilter_k]])
+            candidate_similarities = dot_quant(
+                query, self.embedding_codes[candidates], self.embedding_scales[candidates]
+            )
+        elif element_type:
+            candidate_similarities = dot_quant(query, self.embedding_codes, self.embedding_scales)[candidates]
+        else:
+            candidate_similarities = dot_quant(query, self.embedding_codes, self.embedding_scales)
+
+        if min_similarity is not None:
+            keep = candidate_similarities >= min_similarity
+            candidates = candidates[keep]
+            candidate_similarities = candidate_similarities[keep]
+
+        if k < len(candidates):
+            top = np.argpartition(-candidate_similarities, k)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-candidate_similarities[top], kind='stable')]
+
+        return candidates[top], candidate_similarities[top]
+
+    def search_batch(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        prefilter_k: Optional[int] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Find the k elements most similar to each of several queries.
+
+        Without prefilter_k all queries are scored in one [N, D] x [D, Q]
+        product. The Hamming prefilter selects different candidates per
+        query, so with prefilter_k each query is searched on its own.
+
+        Args:
+            query_embeddings: Query embedding vectors
+            k: Number of results per query
+            prefilter_k: See search()
+
+        Returns:
+            One (indices, similarities) tuple per query, most similar first
+        """
+        if not query_embeddings:
+            return []
+        if prefilter_k is not None:
+            return [self.search(query, k, prefilter_k=prefilter_k) for query in query_embeddings]
+
+        queries = np.array([self._normalize_query(query) for query in query_embeddings])
+        similarities = dot_quant(queries, self.embedding_codes, self.embedding_scales)
+
+        results = []
+        for column in similarities.T:
+            if k < len(column):
+                top = np.argpartition(-column, k)[:k]
+            else:
+                top = np.arange(len(column))
+            top = top[np.argsort(-column[top], kind='stable')]
+            results.append((top, column[top]))
+        return results
+
     def _generate_embeddings_batch(
         self,
         elements: List[CodeElement],
-        batch_size: int = 100
+        batch_size: Optional[int] = None
     ) -> List[List[float]]:
         """
         Generate embeddings for code elements in batches.
 
+        Embeddings are cached on disk per (model, embedding text), so only
+        new or modified elements are sent to the embedding API, and each
+        distinct embedding text is sent only once.
+
         Args:
             elements: List of code elements
-            batch_size: Number of elements per batch
+            batch_size: Starting number of elements per batch
+                        (defaults to self.embed_batch_size)
 
         Returns:
             List of embedding vectors
         """
-        embeddings = []
+        texts = [elem.to_embedding_text() for elem in elements]
+        keys = [self._embedding_cache_key(text) for text in texts]
 
-        for i in range(0, len(elements), batch_size):
-            batch = elements[i:i + batch_size]
+        # Identical texts (boilerplate, generated code) share one embedding
+        text_to_idx: Dict[str, int] = {}
+        for i, key in enumerate(keys):
+            text_to_idx.setdefault(key, i)
 
+        cache = self._open_embedding_cache()
+        cached = self._load_cached_embeddings(cache, keys)
+        missing = [i for key, i in text_to_idx.items() if key not in cached]
+
+        if self.verbose:
+            if len(text_to_idx) < len(keys):
+                print(f"  {len(keys) - len(text_to_idx)} elements share an embedding text with another element")
+            if cached:
+                print(f"  Reusing {len(text_to_idx) - len(missing)}/{len(text_to_idx)} cached embeddings")
+
+        new_embeddings = self._embed_texts([texts[i] for i in missing], batch_size or self.embed_batch_size)
+        for i, embedding in zip(missing, new_embeddings):
+            cached[keys[i]] = embedding
+
+        # Zero vectors are failure placeholders: do not cache them
+        self._store_cached_embeddings(cache, [
+            (keys[i], embedding) for i, embedding in zip(missing, new_embeddings) if any(embedding)
+        ])
+
+        return [cached[key] for key in keys]
+
+    def _embed_texts(
+        self,
+        texts: List[str],
+        batch_size: int
+    ) -> List[List[float]]:
+        """
+        Call the embedding API for texts in batches.
+
+        Texts are split into up to EMBED_CONCURRENCY (default 4) contiguous
+        slices embedded on parallel threads, so one batch's HTTP round-trip
+        and tokenization overlap with the others' inference. The batch size
+        in use at the end (smallest across slices) is kept in
+        self.embed_batch_size and saved with the index.
+
+        Args:
+            texts: Embedding texts
+            batch_size: Starting number of texts per batch
+
+        Returns:
+            List of embedding vectors (zero vectors for texts that failed)
+        """
+        if not texts:
+            return []
+
+        if self.embedding_client is None:
             if self.verbose:
-                print(f"  Processing batch {i // batch_size + 1}/{(len(elements) + batch_size - 1) // batch_size}...")
+                print("Error generating embeddings: No embedding client available")
+            return [[0.0] * self._fallback_embedding_dim() for _ in texts]
+
+        # No more slices than there are batches' worth of texts
+        concurrency = max(1, min(int(os.getenv("EMBED_CONCURRENCY", "4")), -(-len(texts) // batch_size)))
+        slice_size = -(-len(texts) // concurrency)
+        slices = [texts[i:i + slice_size] for i in range(0, len(texts), slice_size)]
+
+        if len(slices) <= 1:
+            embeddings, self.embed_batch_size = self._embed_slice(texts, batch_size)
+            return embeddings
+
+        with ThreadPoolExecutor(max_workers=len(slices)) as executor:
+            results = list(executor.map(lambda texts_slice: self._embed_slice(texts_slice, batch_size), slices))
+
+        self.embed_batch_size = min(final_batch_size for _, final_batch_size in results)
+        return [embedding for slice_embeddings, _ in results for embedding in slice_embeddings]
+
+    def _embed_slice(
+        self,
+        texts: List[str],
+        batch_size: int
+    ) -> Tuple[List[List[float]], int]:
+        """
+        Embed texts batch by batch, adapting the batch size to the server.
+
+        A failed batch is retried at half the size, and after a run of
+        successes the size grows back, though never to a size that already
+        failed.
+
+        Args:
+            texts: Embedding texts
+            batch_size: Starting number of texts per batch
+
+        Returns:
+            Tuple of (embedding vectors, batch size in use at the end)
+        """
+        embeddings = []
+        # Largest size not yet seen failing
+        max_batch_size = batch_size
+        successes = 0
+        start = 0
+
+        while start < len(texts):
+            batch = texts[start:start + batch_size]
 
-            # Convert to embedding text
-            texts = [elem.to_embedding_text() for elem in batch]
+            if self.verbose:
+                print(f"  Embedding {start + 1}-{start + len(batch)}/{len(texts)} (batch size {batch_size})...")
 
             # Generate embeddings using OpenAI/Ollama API
             try:
-                if self.embedding_client is None:
-                    raise RuntimeError("No embedding client available")
-
                 response = self.embedding_client.embeddings.create(
                     model=self.embedding_model,
-                    input=texts
+                    input=batch
                 )
-
-                batch_embeddings = [data.embedding for data in response.data]
-                embeddings.extend(batch_embeddings)
+                embeddings.extend(data.embedding for data in response.data)
 
             except Exception as e:
                 if self.verbose:
                     print(f"Error generating embeddings: {e}")
-                # Fallback: add zero vectors
-                # Determine embedding dimension from environment (VECTOR_DIM)
-                # or infer from model name for OpenAI models
-                if os.getenv("VECTOR_DIM"):
-                    # User-specified dimension (e.g., 1024 for deepseek-r1)
-                    embedding_dim = int(os.getenv("VECTOR_DIM"))
-                elif 'small' in self.embedding_model:
-                    # OpenAI text-embedding-3-small
-                    embedding_dim = 1536
-                elif 'large' in self.embedding_model:
-                    # OpenAI text-embedding-3-large
-                    embedding_dim = 3072
-                else:
-                    # Generic fallback
-                    embedding_dim = 1024
-                embeddings.extend([[0.0] * embedding_dim for _ in batch])
-
-        return embeddings
+                if len(batch) > 1:
+                    # Too large for the server (timeout, OOM, 5xx): retry smaller
+                    max_batch_size = len(batch) - 1
+                    batch_size = len(batch) // 2
+                    successes = 0
+                    continue
+
+                # Even a single text fails: the server is down, so do not keep
+                # trying text by text. Fallback: add zero vectors
+                embedding_dim = self._fallback_embedding_dim()
+                embeddings.extend([[0.0] * embedding_dim for _ in texts[start:]])
+                break
+
+            successes += 1
+            if successes >= 8 and batch_size < max_batch_size:
+                batch_size = min(max_batch_size, batch_size * 2)
+                successes = 0
+            start += len(batch)
+
+        return embeddings, batch_size
+
+    def _fallback_embedding_dim(self) -> int:
+        """Dimension of the zero vectors used in place of failed embeddings."""
+        # Determine embedding dimension from environment (VECTOR_DIM)
+        # or infer from model name for OpenAI models
+        if os.getenv("VECTOR_DIM"):
+            # User-specified dimension (e.g., 1024 for deepseek-r1)
+            return int(os.getenv("VECTOR_DIM"))
+        elif 'small' in self.embedding_model:
+            # OpenAI text-embedding-3-small
+            return 1536
+        elif 'large' in self.embedding_model:
+            # OpenAI text-embedding-3-large
+            return 3072
+        else:
+            # Generic fallback
+            return 1024
+
+    def _embedding_cache_key(self, text: str) -> str:
+        """Content-address an embedding by model and embedding text."""
+        return hashlib.sha256(f"{self.embedding_model}\0{text}".encode()).hexdigest()
+
+    def _open_embedding_cache(self) -> Optional[sqlite3.Connection]:
+        """
+        Open the on-disk embedding cache.
+
+        The cache is cleared when the embedding model or VECTOR_DIM changed
+        since it was written.
+
+        Returns:
+            SQLite connection, or None if the cache cannot be used
+        """
+        settings = {
+            'embedding_model': self.embedding_model,
+            'vector_dim': os.getenv("VECTOR_DIM", "")
+        }
+        try:
+            conn = sqlite3.connect(self.cache_dir / "emb-cache.sqlite")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            if dict(conn.execute("SELECT key, value FROM meta")) != settings:
+                conn.execute("DROP TABLE IF EXISTS embeddings")
+                conn.execute("DELETE FROM meta")
+                conn.executemany("INSERT INTO meta VALUES (?, ?)", settings.items())
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB)")
+            conn.commit()
+            return conn
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Embedding cache unavailable: {e}")
+            return None
+
+    def _load_cached_embeddings(
+        self,
+        cache: Optional[sqlite3.Connection],
+        keys: List[str]
+    ) -> Dict[str, List[float]]:
+        """Look up cached embeddings for keys."""
+        if cache is None:
+            return {}
+
+        cached = {}
+        unique_keys = list(dict.fromkeys(keys))
+        try:
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i:i + 500]
+                rows = cache.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+                for key, vec in rows:
+                    cached[key] = np.frombuffer(vec, dtype=np.float32).tolist()
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Could not read embedding cache: {e}")
+        return cached
+
+    def _store_cached_embeddings(
+        self,
+        cache: Optional[sqlite3.Connection],
+        entries: List[Tuple[str, List[float]]]
+    ) -> None:
+        """Upsert embeddings into the cache and close it."""
+        if cache is None:
+            return
+
+        try:
+            with cache:
+                cache.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+                    [(key, np.asarray(embedding, dtype=np.float32).tobytes()) for key, embedding in entries]
+                )
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Could not write embedding cache: {e}")
+        finally:
+            cache.close()
 
     def save_index(self) -> None:
-        """Save index to cache."""
-        cache_file = self.cache_dir / "index.pkl"
+        """
+        Save index to cache.
 
+        Quantized embeddings go to .npy files (codes and sign bits are loaded
+        memory-mapped),
+        and code elements plus metadata to an index.json sidecar, stored
+        column-wise (one list per field). Each file is written atomically;
+        index.json is written last, since its presence marks a complete index.
+        """
         data = {
-            'code_elements': [elem.to_dict() for elem in self.code_elements],
-            'embeddings': self.embeddings,
+            'code_elements': {
+                name: [getattr(elem, name) for elem in self.code_elements]
+                for name in CODE_ELEMENT_FIELDS
+            },
             'metadata': {
                 'embedding_model': self.embedding_model,
-                'num_elements': len(self.code_elements)
+                'precision': self.precision,
+                'num_elements': len(self.code_elements),
+                'embed_batch_size': self.embed_batch_size
             }
         }
 
-        with open(cache_file, 'wb') as f:
-            pickle.dump(data, f)
+        with _AtomicFile(self.cache_dir / "embedding_codes.npy") as f:
+            np.save(f, self.embedding_codes)
+        with _AtomicFile(self.cache_dir / "embedding_scales.npy") as f:
+            np.save(f, self.embedding_scales)
+        with _AtomicFile(self.cache_dir / "embedding_bits.npy") as f:
+            np.save(f, self.embedding_bits)
+        with _AtomicFile(self.cache_dir / "index.json") as f:
+            f.write(_json_dumps(data))
 
     def load_index(self) -> None:
         """Load index from cache."""
-        cache_file = self.cache_dir / "index.pkl"
-
-        with open(cache_file, 'rb') as f:
-            data = pickle.load(f)
-
-        self.code_elements = [CodeElement(**elem) for elem in data['code_elements']]
-        self.embeddings = data['embeddings']
+        data = _json_loads((self.cache_dir / "index.json").read_bytes())
+
+        columns = data['code_elements']
+        self.code_elements = [
+            CodeElement(*row) for row in zip(*(columns[name] for name in CODE_ELEMENT_FIELDS))
+        ]
+        self._element_types = np.array(columns['element_type'], dtype=object)
+
+        # Resume with the batch size the last build settled on
+        metadata = data.get('metadata', {})
+        if not os.getenv("EMBED_BATCH_SIZE"):
+            self.embed_batch_size = metadata.get('embed_batch_size', self.embed_batch_size)
+        self.embedding_codes = np.load(self.cache_dir / "embedding_codes.npy", mmap_mode='r')
+        self.embedding_scales = np.load(self.cache_dir / "embedding_scales.npy")
+        try:
+            self.embedding_bits = np.load(self.cache_dir / "embedding_bits.npy", mmap_mode='r')
+        except FileNotFoundError:
+            # Index saved before sign bits were stored
+            self.embedding_bits = pack_sign_bits(self.embedding_codes)
 
         if self.verbose:
-            metadata = data.get('metadata', {})
             print(f"Loaded {metadata.get('num_elements', 0)} elements")
             print(f"Model: {metadata.get('embedding_model', 'unknown')}")
\ No newline at end of file
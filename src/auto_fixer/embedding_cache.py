@@ -0,0 +1,113 @@
+"""
+Embedding Context Cache - Persistent Cache for Embedding Search Results
+
+During an auto-fix loop the same tests fail again and again, and every
+retry would otherwise re-embed the test code and error message and re-run
+the semantic search. This module stores the formatted context produced for
+a failure in SQLite, keyed by a content hash plus the embedding provider
+and model, so repeated lookups skip the embedding API entirely.
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+class EmbeddingContextCache:
+    """
+    SQLite-backed cache of extracted contexts.
+
+    Entries are keyed by (hash, provider, model): the hash covers whatever
+    determines the context (test code, error message, index version), and
+    provider/model keep contexts from different embedding spaces apart.
+    The cache is best-effort: any SQLite error degrades to a cache miss.
+    """
+
+    def __init__(self, db_path: Path, verbose: bool = False):
+        self.db_path = Path(db_path)
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        try:
+            self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS contexts ("
+                "hash TEXT, provider TEXT, model TEXT, context_json TEXT, created_at INT, "
+                "PRIMARY KEY (hash, provider, model))"
+            )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Context cache unavailable: {e}")
+            self._conn = None
+
+    def get(self, key: str, provider: str, model: str) -> Optional[str]:
+        """
+        Look up a cached context.
+
+        Returns:
+            The stored context JSON, or None on a miss
+        """
+        if self._conn is None:
+            return None
+
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT context_json FROM contexts WHERE hash = ? AND provider = ? AND model = ?",
+                    (key, provider, model)
+                ).fetchone()
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Could not read context cache: {e}")
+            return None
+
+        return row[0] if row else None
+
+    def put(self, key: str, provider: str, model: str, context_json: str) -> None:
+        """Store (or replace) a context."""
+        if self._conn is None:
+            return
+
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO contexts VALUES (?, ?, ?, ?, ?)",
+                    (key, provider, model, context_json, int(time.time()))
+                )
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Could not write context cache: {e}")
+
+    def prune(self, ttl_seconds: int) -> int:
+        """
+        Evict entries older than ttl_seconds.
+
+        Returns:
+            Number of entries removed
+        """
+        if self._conn is None:
+            return 0
+
+        try:
+            with self._lock, self._conn:
+                cursor = self._conn.execute(
+                    "DELETE FROM contexts WHERE created_at < ?",
+                    (int(time.time()) - ttl_seconds,)
+                )
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Could not prune context cache: {e}")
+            return 0
+
+        return cursor.rowcount
+
+    def close(self) -> None:
+        """Close the underlying connection."""
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+            self._conn = None
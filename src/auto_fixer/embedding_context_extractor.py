@@ -20,13 +20,164 @@ What this solves:
 ✓ Missing source files → comprehensive indexing finds them
 """
 
+import hashlib
+import json
 import os
-from typing import Dict, List, Optional
+import re
+import threading
+import time
+import tokenize
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
 from .ast_context_extractor import ASTContextExtractor
 from .codebase_indexer import CodebaseIndexer
-from .semantic_code_retriever import SemanticCodeRetriever
+from .embedding_cache import EmbeddingContextCache
+from .semantic_code_retriever import SemanticCodeRetriever, SearchResult
+
+# Failures whose AST/embedding contexts are kept for reuse
+_CONTEXT_MEMO_SIZE = 16
+
+# Element marker line in formatted contexts: "# function: my_func (line 123)"
+_MARKER_RE = re.compile(r'^# (?:function|class|http_endpoint):[ \t]*([^\s(]+)', re.MULTILINE)
+
+# Marker line of any element type, where get_context_chunks splits a context
+_ELEMENT_MARKER_RE = re.compile(r'^# \w+: ([^\s(]+) \(line \d+\)$', re.MULTILINE)
+
+
+@dataclass
+class _SearchLRU:
+    """Thread-safe LRU with TTL for semantic search results."""
+    max_size: int = 128
+    ttl_seconds: float = 600.0
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    _entries: OrderedDict = field(default_factory=OrderedDict, repr=False)
+    _lock: threading.RLock = field(default_factory=threading.RLock, repr=False)
+
+    def get(self, key: str) -> Optional[List[SearchResult]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value: List[SearchResult]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def contains(self, key: str) -> bool:
+        """Whether key has a live entry (does not count as a hit or miss)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+def _find_function_source(source: str, name: str) -> str:
+    """
+    Locate a function definition in source without parsing the module.
+
+    The def line is found with a regex and extended upward over its
+    decorators; the body is read with tokenize from the def line to the
+    dedent that ends it, so lines of multi-line strings (e.g. a docstring
+    example at column 0) don't end it early.
+
+    Args:
+        source: Module source code
+        name: Function name
+
+    Returns:
+        Function source with its decorators, or "" if no such def exists
+    """
+    match = re.search(
+        rf'^([ \t]*)(?:async[ \t]+)?def[ \t]+{re.escape(name)}[ \t]*\(',
+        source,
+        re.MULTILINE
+    )
+    if not match:
+        return ""
+
+    indent = len(match.group(1).expandtabs())
+
+    # Decorators: "@" lines at the def's indentation, and the continuation
+    # lines of multi-line ones (deeper, or closing a bracket)
+    above = source[:match.start()].splitlines(keepends=True)
+    start = len(above)
+    for i in range(len(above) - 1, -1, -1):
+        stripped = above[i].lstrip()
+        line_indent = len(above[i].expandtabs()) - len(stripped.expandtabs())
+        if stripped.startswith('@') and line_indent == indent:
+            start = i
+        elif not stripped.strip() or not (line_indent > indent or stripped[0] in ')]}'):
+            break
+    decorators = ''.join(above[start:])
+
+    lines = source[match.start():].splitlines(keepends=True)
+    # An indented def line opens one INDENT level of its own
+    base = 1 if indent else 0
+    depth = 0
+    header_end = None  # line where the def statement ended, if the body isn't indented
+    end = len(lines)
+    try:
+        for token in tokenize.generate_tokens(iter(lines).__next__):
+            if token.type == tokenize.INDENT:
+                depth += 1
+            elif token.type == tokenize.DEDENT:
+                depth -= 1
+                if depth <= base:
+                    end = token.start[0] - 1
+                    break
+            elif token.type in (tokenize.NL, tokenize.COMMENT):
+                continue
+            elif header_end is not None and depth == base:
+                # One-line def ("def f(): return 1")
+                end = header_end
+                break
+            elif token.type == tokenize.NEWLINE and depth == base:
+                header_end = token.end[0]
+    except (tokenize.TokenError, SyntaxError) as e:
+        # A dedent to a level the region never opened (the def is nested
+        # deeper than what follows) ends the body; so does broken source
+        row = e.lineno if isinstance(e, SyntaxError) else e.args[1][0]
+        end = max(1, (row or len(lines) + 1) - 1)
+
+    # Comments between the body and the next statement belong to the latter
+    while end > 1:
+        stripped = lines[end - 1].lstrip()
+        if stripped.strip() and not (
+            stripped.startswith('#')
+            and len(lines[end - 1].expandtabs()) - len(stripped.expandtabs()) <= indent
+        ):
+            break
+        end -= 1
+
+    return (decorators + ''.join(lines[:end])).rstrip()
 
 
 class EmbeddingContextExtractor:
@@ -40,17 +191,25 @@ class EmbeddingContextExtractor:
     4. Combine results intelligently
     """
 
+    # Built indexers shared across instances, keyed by (project root,
+    # embedding model, precision, cache dir), with their index.json mtime
+    _INDEXER_POOL: Dict[Tuple[str, str, str, str], Tuple[CodebaseIndexer, Optional[int]]] = {}
+    _POOL_LOCK = threading.Lock()
+
     def __init__(
         self,
         project_root: str = ".",
         max_source_lines: int = 300,
         use_embeddings: bool = True,
-        verbose: bool = False
+        verbose: bool = False,
+        precision: str = "int8"
     ):
         self.project_root = Path(project_root)
         self.max_source_lines = max_source_lines
         self.use_embeddings = use_embeddings
         self.verbose = verbose
+        # Embedding storage precision, forwarded to CodebaseIndexer
+        self.precision = precision
 
         # Initialize AST extractor (always available)
         self.ast_extractor = ASTContextExtractor(
@@ -62,12 +221,28 @@ class EmbeddingContextExtractor:
         self._indexer = None
         self._retriever = None
 
+        # Search results within this process (extract_context and
+        # verify_extraction_quality search for the same failure)
+        self._search_cache = _SearchLRU()
+
+        # (ast_context, embedding_context) of recent failures, shared by
+        # extract_context and verify_extraction_quality
+        self._contexts_memo: OrderedDict = OrderedDict()
+
         # Control flag from environment
         if os.getenv("DISABLE_EMBEDDINGS", "").lower() in ("true", "1", "yes"):
             self.use_embeddings = False
             if self.verbose:
                 print("Embeddings disabled via DISABLE_EMBEDDINGS env var")
 
+        # Persistent cache of embedding contexts (same failures recur across fix iterations)
+        self._ctx_cache = None
+        if self.use_embeddings:
+            self._ctx_cache = EmbeddingContextCache(
+                self.project_root / ".auto_fixer_cache.db",
+                verbose=verbose
+            )
+
     @property
     def indexer(self) -> Optional[CodebaseIndexer]:
         """Lazy-load codebase indexer."""
@@ -76,12 +251,9 @@ class EmbeddingContextExtractor:
 
         if self._indexer is None:
             try:
-                self._indexer = CodebaseIndexer(
-                    project_root=str(self.project_root),
-                    verbose=self.verbose
-                )
-                # Build or load index
-                self._indexer.build_index()
+                self._indexer = self._pooled_indexer()
+                # Results from a previous index are stale
+                self._search_cache.clear()
             except Exception as e:
                 if self.verbose:
                     print(f"Could not initialize indexer: {e}")
@@ -89,6 +261,46 @@ class EmbeddingContextExtractor:
 
         return self._indexer
 
+    def _pooled_indexer(self) -> CodebaseIndexer:
+        """
+        Get a built indexer for this project, shared across instances.
+
+        A pooled indexer is reused while its index.json is unchanged on
+        disk; after a rebuild elsewhere, a fresh indexer loads the new index.
+        """
+        indexer_dir = Path(".codebase_index").resolve()
+        key = (
+            str(self.project_root.resolve()),
+            os.getenv("OLLAMA_EMBED_MODEL") or os.getenv("OPENAI_EMBEDDING_MODEL") or "",
+            self.precision,
+            str(indexer_dir)
+        )
+
+        with EmbeddingContextExtractor._POOL_LOCK:
+            try:
+                index_mtime = (indexer_dir / "index.json").stat().st_mtime_ns
+            except OSError:
+                index_mtime = None
+
+            pooled = self._INDEXER_POOL.get(key)
+            if pooled is not None and pooled[1] == index_mtime:
+                return pooled[0]
+
+            indexer = CodebaseIndexer(
+                project_root=str(self.project_root),
+                verbose=self.verbose,
+                precision=self.precision
+            )
+            # Build or load index
+            indexer.build_index()
+
+            try:
+                index_mtime = (indexer_dir / "index.json").stat().st_mtime_ns
+            except OSError:
+                index_mtime = None
+            self._INDEXER_POOL[key] = (indexer, index_mtime)
+            return indexer
+
     @property
     def retriever(self) -> Optional[SemanticCodeRetriever]:
         """Lazy-load semantic retriever."""
@@ -128,8 +340,8 @@ class EmbeddingContextExtractor:
         if self.verbose:
             print(f"\n Extracting context for {test_function_name}")
 
-        # Step 1: Try AST extraction
-        ast_context = self.ast_extractor.extract_context(
+        # Step 1 and 2: AST extraction, plus embedding search if enabled
+        ast_context, embedding_context = self._extract_both(
             test_file_path,
             test_function_name,
             error_message
@@ -139,15 +351,7 @@ class EmbeddingContextExtractor:
         if ast_context and not self.use_embeddings:
             return ast_context
 
-        # Step 2: Use embeddings if needed
         if self.use_embeddings and self.retriever:
-            # Get embedding-based context
-            embedding_context = self._extract_with_embeddings(
-                test_file_path,
-                test_function_name,
-                error_message
-            )
-
             # Combine AST and embedding results
             combined_context = self._combine_contexts(
                 ast_context,
@@ -157,10 +361,7 @@ class EmbeddingContextExtractor:
             if self.verbose:
                 # Count functions/classes, not just files
                 def count_elements(context_dict):
-                    total = 0
-                    for code in context_dict.values():
-                        total += code.count('# function:') + code.count('# class:') + code.count('# http_endpoint:')
-                    return total
+                    return sum(len(_MARKER_RE.findall(code)) for code in context_dict.values())
 
                 ast_files = len(ast_context)
                 ast_elements = count_elements(ast_context)
@@ -179,6 +380,115 @@ class EmbeddingContextExtractor:
         # Fallback: return AST results (might be empty)
         return ast_context
 
+    def extract_context_batch(
+        self,
+        failures: List[Tuple[str, str, str]]
+    ) -> List[Dict[str, str]]:
+        """
+        Extract context for several failing tests.
+
+        The semantic searches of all failures not already cached run as one
+        batch (one embedding request, one scoring pass); each failure's
+        context is then extracted as in extract_context, reusing them.
+
+        Args:
+            failures: (test_file_path, test_function_name, error_message)
+                      per failing test
+
+        Returns:
+            One context dict per failure, as returned by extract_context
+        """
+        if self.use_embeddings and self.retriever:
+            self._prefetch_searches(failures)
+
+        return [self.extract_context(*failure) for failure in failures]
+
+    def _prefetch_searches(self, failures: List[Tuple[str, str, str]]) -> None:
+        """Run the not yet cached semantic searches of failures as one batch."""
+        pending = {}
+        provider = self._embedding_provider()
+        for test_file_path, test_function_name, error_message in failures:
+            test_code = self._read_test_code(test_file_path, test_function_name)
+            failure_bytes = self._failure_bytes(test_code, error_message)
+            search_key = self._search_key(failure_bytes)
+            if search_key in pending or self._search_cache.contains(search_key):
+                continue
+
+            # Failures with a persisted context need no search at all
+            cache_key = self._context_cache_key(failure_bytes)
+            if cache_key and self._ctx_cache and self._ctx_cache.get(
+                cache_key, provider, self.indexer.embedding_model
+            ) is not None:
+                continue
+
+            # Traceback is part of error message
+            pending[search_key] = (test_code, error_message, error_message)
+
+        if not pending:
+            return
+
+        batch_results = self.retriever.batch_search_by_test_failure(
+            list(pending.values()),
+            top_k=10,
+            top_k_prefilter=100
+        )
+        for search_key, results in zip(pending, batch_results):
+            # Empty results may stem from a transient embedding failure
+            if results:
+                self._search_cache.put(search_key, results)
+
+    def _extract_both(
+        self,
+        test_file_path: str,
+        test_function_name: str,
+        error_message: str
+    ) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """
+        AST and embedding contexts for a failure, memoized.
+
+        The memo key includes the test file's mtime, so an edited test file
+        is extracted again.
+
+        Args:
+            test_file_path: Path to test file
+            test_function_name: Test function name
+            error_message: Error message
+
+        Returns:
+            Tuple of (ast_context, embedding_context); embedding_context is
+            empty when embeddings are disabled or unavailable
+        """
+        try:
+            mtime = os.stat(test_file_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        key = (test_file_path, test_function_name, error_message, mtime)
+
+        contexts = self._contexts_memo.get(key)
+        if contexts is not None:
+            self._contexts_memo.move_to_end(key)
+            return contexts
+
+        ast_context = self.ast_extractor.extract_context(
+            test_file_path,
+            test_function_name,
+            error_message
+        )
+
+        embedding_context = {}
+        if self.use_embeddings and self.retriever:
+            embedding_context = self._extract_with_embeddings(
+                test_file_path,
+                test_function_name,
+                error_message
+            )
+
+        contexts = (ast_context, embedding_context)
+        self._contexts_memo[key] = contexts
+        if len(self._contexts_memo) > _CONTEXT_MEMO_SIZE:
+            self._contexts_memo.popitem(last=False)
+        return contexts
+
     def _extract_with_embeddings(
         self,
         test_file_path: str,
@@ -199,38 +509,33 @@ class EmbeddingContextExtractor:
         if not self.retriever:
             return {}
 
-        # Read test code
-        try:
-            with open(test_file_path, 'r') as f:
-                test_content = f.read()
-
-            # Extract the specific test function
-            import ast
-            tree = ast.parse(test_content)
-            base_test_name = test_function_name.split('[')[0]
-            test_code = ""
-
-            for node in ast.walk(tree):
-                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                    if node.name == base_test_name:
-                        test_code = ast.unparse(node)
-                        break
-
-            if not test_code:
-                test_code = test_content  # Fallback
+        test_code = self._read_test_code(test_file_path, test_function_name)
 
-        except Exception as e:
-            if self.verbose:
-                print(f"Could not read test file: {e}")
-            test_code = ""
+        # Reuse the context from an earlier identical failure
+        failure_bytes = self._failure_bytes(test_code, error_message)
+        cache_key = self._context_cache_key(failure_bytes)
+        provider = self._embedding_provider()
+        if cache_key and self._ctx_cache:
+            cached = self._ctx_cache.get(cache_key, provider, self.indexer.embedding_model)
+            if cached is not None:
+                if self.verbose:
+                    print("Embedding context loaded from cache")
+                return json.loads(cached)
 
         # Perform semantic search
-        results = self.retriever.search_by_test_failure(
-            test_code=test_code,
-            error_message=error_message,
-            traceback=error_message,  # Traceback is part of error message
-            top_k=10
-        )
+        search_key = self._search_key(failure_bytes)
+        results = self._search_cache.get(search_key)
+        if results is None:
+            results = self.retriever.search_by_test_failure(
+                test_code=test_code,
+                error_message=error_message,
+                traceback=error_message,  # Traceback is part of error message
+                top_k=10,
+                top_k_prefilter=100  # Binary prefilter, then exact rescoring
+            )
+            # Empty results may stem from a transient embedding failure
+            if results:
+                self._search_cache.put(search_key, results)
 
         if self.verbose and results:
             print(f"Embedding search found {len(results)} matches:")
@@ -278,8 +583,105 @@ class EmbeddingContextExtractor:
 
             formatted_context[file_path] = '\n'.join(code_parts)
 
+        # Empty contexts may stem from a transient embedding failure: don't cache them
+        if formatted_context and cache_key and self._ctx_cache:
+            self._ctx_cache.put(
+                cache_key,
+                provider,
+                self.indexer.embedding_model,
+                json.dumps(formatted_context)
+            )
+
         return formatted_context
 
+    def _read_test_code(self, test_file_path: str, test_function_name: str) -> str:
+        """
+        Read the failing test function's source (the whole file if not found).
+
+        Returns:
+            Test code, or "" if the file cannot be read
+        """
+        try:
+            with open(test_file_path, 'r') as f:
+                test_content = f.read()
+
+            # Extract the specific test function
+            base_test_name = test_function_name.split('[')[0]
+            test_code = _find_function_source(test_content, base_test_name)
+
+            if not test_code:
+                test_code = test_content  # Fallback
+
+        except Exception as e:
+            if self.verbose:
+                print(f"Could not read test file: {e}")
+            test_code = ""
+
+        return test_code
+
+    @staticmethod
+    def _failure_bytes(test_code: str, error_message: str) -> bytes:
+        """Test code and error message encoded once, for the cache keys."""
+        return (test_code + error_message).encode('utf-8', errors='replace')
+
+    @staticmethod
+    def _search_key(failure_bytes: bytes) -> str:
+        """Key of a failure's search results in the in-process cache."""
+        return hashlib.blake2b(failure_bytes, digest_size=16).hexdigest()
+
+    def _context_cache_key(self, failure_bytes: bytes) -> Optional[str]:
+        """
+        Cache key for an embedding context.
+
+        Covers the test code and error message (the search query, see
+        _failure_bytes), the index version (index.json's mtime, so a rebuilt
+        index invalidates old contexts) and max_source_lines.
+
+        Returns:
+            SHA-256 hex digest, or None if the index has not been saved
+        """
+        try:
+            index_version = (self.indexer.cache_dir / "index.json").stat().st_mtime_ns
+        except OSError:
+            return None
+
+        digest = hashlib.sha256(failure_bytes)
+        digest.update(f"\0{index_version}\0{self.max_source_lines}".encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _embedding_provider() -> str:
+        """Embedding provider in use, selected the same way as the clients."""
+        if os.getenv("OLLAMA_HOST") or os.getenv("OLLAMA_EMBED_MODEL"):
+            return "ollama"
+        return "openai"
+
+    def get_cache_stats(self) -> Dict[str, int]:
+        """
+        Statistics of the in-process search result cache.
+
+        Returns:
+            Dict with size, hits, misses and evictions
+        """
+        return self._search_cache.stats()
+
+    def prune_embedding_cache(self, ttl_seconds: int = 7 * 24 * 3600) -> int:
+        """
+        Evict cached embedding contexts older than ttl_seconds.
+
+        Returns:
+            Number of entries removed
+        """
+        if not self._ctx_cache:
+            return 0
+        return self._ctx_cache.prune(ttl_seconds)
+
+    def close(self) -> None:
+        """Close the embedding context cache; later lookups skip it."""
+        if self._ctx_cache:
+            self._ctx_cache.close()
+            self._ctx_cache = None
+
     def _combine_contexts(
         self,
         ast_context: Dict[str, str],
@@ -309,18 +711,7 @@ class EmbeddingContextExtractor:
         # Helper to parse function names from code string
         def extract_function_names(code_string: str) -> set:
             """Extract function/class names from formatted code string."""
-            names = set()
-            for line in code_string.split('\n'):
-                if line.startswith('# function:') or line.startswith('# class:') or line.startswith('# http_endpoint:'):
-                    # Parse "# function: my_func (line 123)"
-                    parts = line.split(':')
-                    if len(parts) >= 2:
-                        name_part = parts[1].strip()
-                        # Remove "(line X)" suffix
-                        if '(' in name_part:
-                            name_part = name_part.split('(')[0].strip()
-                        names.add(name_part)
-            return names
+            return {match.group(1) for match in _MARKER_RE.finditer(code_string)}
 
         # Step 1: Add all AST results (more precise)
         for file_path, code in ast_context.items():
@@ -329,7 +720,8 @@ class EmbeddingContextExtractor:
 
         # Step 2: Merge embedding results
         for file_path, embed_code in embedding_context.items():
-            embed_funcs = extract_function_names(embed_code)
+            markers = [(match.group(1), match.start()) for match in _MARKER_RE.finditer(embed_code)]
+            embed_funcs = {name for name, _ in markers}
 
             if file_path not in combined:
                 # New file from embeddings - add it
@@ -341,40 +733,17 @@ class EmbeddingContextExtractor:
                 new_funcs = embed_funcs - existing_funcs
 
                 if new_funcs:
-                    # Extract only new functions from embedding code
-                    new_code_parts = []
-                    lines = embed_code.split('\n')
-                    in_function = False
-                    current_func_name = None
-                    current_func_lines = []
-
-                    for line in lines:
-                        if line.startswith('# function:') or line.startswith('# class:') or line.startswith('# http_endpoint:'):
-                            # Save previous function if it was new
-                            if in_function and current_func_name in new_funcs:
-                                new_code_parts.extend(current_func_lines)
-                                new_code_parts.append("")
-
-                            # Start new function
-                            parts = line.split(':')
-                            if len(parts) >= 2:
-                                name_part = parts[1].strip()
-                                if '(' in name_part:
-                                    name_part = name_part.split('(')[0].strip()
-                                current_func_name = name_part
-                                current_func_lines = [line]
-                                in_function = True
-                        elif in_function:
-                            current_func_lines.append(line)
-
-                    # Don't forget last function
-                    if in_function and current_func_name in new_funcs:
-                        new_code_parts.extend(current_func_lines)
-                        new_code_parts.append("")
+                    # Each element runs from its marker to the next marker
+                    ends = [start for _, start in markers[1:]] + [len(embed_code)]
+                    new_code = ''.join(
+                        embed_code[start:end]
+                        for (name, start), end in zip(markers, ends)
+                        if name in new_funcs
+                    )
 
                     # Append new functions to existing file
-                    if new_code_parts:
-                        combined[file_path] = combined[file_path].rstrip() + "\n\n" + '\n'.join(new_code_parts)
+                    if new_code:
+                        combined[file_path] = combined[file_path].rstrip() + "\n\n" + new_code
                         seen_functions[file_path].update(new_funcs)
 
         return combined
@@ -405,15 +774,71 @@ class EmbeddingContextExtractor:
         if not context:
             return "# No relevant source code found"
 
-        output = []
-        for file_path, code in context.items():
-            output.append(f"# {file_path}")
-            output.append(f"```python")
-            output.append(code)
-            output.append(f"```")
-            output.append("")
+        # One formatted block per file
+        return "\n".join(
+            f"# {file_path}\n```python\n{code}\n```\n"
+            for file_path, code in context.items()
+        )
+
+    def get_context_chunks(
+        self,
+        test_file_path: str,
+        test_function_name: str,
+        error_message: str = ""
+    ) -> List[Tuple[str, float]]:
+        """
+        Get the context split into elements, each with a relevance score.
+
+        Elements from AST extraction (referenced by the test) score 1.0;
+        embedding matches score their similarity from the semantic search,
+        or 0.0 once the search results are no longer in memory (context
+        loaded from the persistent cache).
+
+        Args:
+            test_file_path: Path to test file
+            test_function_name: Test function name
+            error_message: Error message
 
-        return "\n".join(output)
+        Returns:
+            (formatted element, score) pairs in context order
+        """
+        ast_context, _ = self._extract_both(test_file_path, test_function_name, error_message)
+        context = self.extract_context(test_file_path, test_function_name, error_message)
+
+        scores = {}
+        if self.use_embeddings:
+            test_code = self._read_test_code(test_file_path, test_function_name)
+            results = self._search_cache.get(
+                self._search_key(self._failure_bytes(test_code, error_message))
+            ) or []
+            scores = {
+                (result.code_element.file_path, result.code_element.name): result.similarity_score
+                for result in results
+            }
+
+        chunks = []
+        for file_path, code in context.items():
+            ast_names = set(_ELEMENT_MARKER_RE.findall(ast_context.get(file_path, "")))
+            markers = list(_ELEMENT_MARKER_RE.finditer(code))
+            # Each element runs from its marker to the next marker; text
+            # before the first marker (or a file without markers) is kept whole
+            bounds = [(0, markers[0].start() if markers else len(code), None)]
+            ends = [match.start() for match in markers[1:]] + [len(code)]
+            bounds += [(match.start(), end, match.group(1)) for match, end in zip(markers, ends)]
+
+            for start, end, name in bounds:
+                element = code[start:end].strip()
+                if not element:
+                    continue
+                if name is None:
+                    score = 1.0 if file_path in ast_context else 0.0
+                elif name in ast_names:
+                    score = 1.0
+                else:
+                    score = scores.get((file_path, name), 0.0)
+                chunks.append((f"# {file_path}\n```python\n{element}\n```\n", score))
+
+        return chunks
 
     def verify_extraction_quality(
         self,
@@ -434,21 +859,13 @@ class EmbeddingContextExtractor:
         Returns:
             Dict with quality metrics
         """
-        # Extract with both methods
-        ast_context = self.ast_extractor.extract_context(
+        # Extract with both methods (reused if extract_context just ran)
+        ast_context, embedding_context = self._extract_both(
             test_file_path,
             test_function_name,
             error_message
         )
 
-        embedding_context = {}
-        if self.use_embeddings and self.retriever:
-            embedding_context = self._extract_with_embeddings(
-                test_file_path,
-                test_function_name,
-                error_message
-            )
-
         # Calculate metrics
         ast_files = set(ast_context.keys())
         embedding_files = set(embedding_context.keys())
@@ -5,11 +5,39 @@ Parses pytest JSON output and extracts structured failure information.
 """
 
 import json
+import os
 import subprocess
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import List, Optional, Dict, Any
 import re
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Failure section separator in pytest text output: "____ test_name ____"
+_SEP_RE = re.compile(r'^_{3,}.*_{3,}$')
+_NAME_FROM_SEP_RE = re.compile(r'_{3,}\s*(.+?)\s*_{3,}')
+# Test file location in a traceback: "tests/some/path.py:123:"
+_FILE_IN_TB_RE = re.compile(r'(tests/[^\s:]+\.py):\d+:')
+# Fallback line number: "line 123"
+_LINE_RE = re.compile(r"line (\d+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=256)
+def _get_file_line_re(test_file: str) -> re.Pattern:
+    """Pattern for "<test_file>:123:" locations, compiled once per file."""
+    return re.compile(rf"{re.escape(test_file)}:(\d+):")
+
+
+def _json_loads(data: bytes) -> Any:
+    """Parse JSON bytes, with orjson when available (reports can be large)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 @dataclass
 class TestFailure:
@@ -38,8 +66,17 @@ class TestFailure:
 class FailureParser:
     """Parses pytest output and extracts test failures."""
 
-    def __init__(self, test_directory: str = "tests"):
+    def __init__(self, test_directory: str = "tests", timeout: Optional[int] = None):
+        """
+        Args:
+            test_directory: Directory pytest is run on
+            timeout: Limit in seconds for one pytest run
+                (default: AUTOFIXER_PYTEST_TIMEOUT, else 120)
+        """
         self.test_directory = test_directory
+        self.timeout = timeout if timeout is not None else int(os.getenv("AUTOFIXER_PYTEST_TIMEOUT", "120"))
+        # Whether the pytest-json-report plugin is installed (None: unknown)
+        self._json_report_available: Optional[bool] = None
 
     def run_pytest_json(self, extra_args: List[str] = None) -> Dict[str, Any]:
         """
@@ -50,21 +87,14 @@ class FailureParser:
 
         Returns:
             JSON output from pytest or parsed text output
+
+        Raises:
+            subprocess.TimeoutExpired: If pytest ran longer than self.timeout
         """
         args = extra_args or []
         # CRITICAL: Clean stale data before running pytest
-        import os
         import shutil
 
-        # Remove old pytest report
-        report_file = "pytest_report.json"
-        if os.path.exists(report_file):
-            try:
-                os.remove(report_file)
-                print(f" Removed old {report_file}")
-            except OSError as e:
-                print(f"Warning: Could not remove old {report_file}: {e}")
-
         # Remove pytest cache to prevent stale results
         cache_dir = ".pytest_cache"
         if os.path.exists(cache_dir):
@@ -73,37 +103,11 @@ class FailureParser:
                 print(f"Cleared pytest cache")
             except OSError as e:
                 print(f"Warning: Could not clear pytest cache: {e}")
-                
-        # Try with JSON report first
-        cmd = [
-            "pytest",
-            self.test_directory,
-            "--tb=short",
-            "--json-report",
-            "--json-report-file=pytest_report.json",
-            "-v"
-        ] + args
-
-        # Run pytest, capture output but don't fail on non-zero exit
-        # Add timeout to prevent hanging on stuck tests
-        try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True
-            )
-        except subprocess.TimeoutExpired:
-            print("Pytest timed out after 120 seconds - tests may be hanging")
-            print("Try running pytest manually to debug: pytest", self.test_directory, "-v")
-            return {"tests": [], "summary": {"total": 0, "passed": 0, "failed": 0}}
 
-        # Read the JSON report
-        try:
-            with open("pytest_report.json", "r") as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            # JSON report not available, try verbose text output
-            pass
+        if self._json_report_available is not False:
+            json_output = self._run_pytest_with_json_report(args)
+            if json_output is not None:
+                return json_output
 
         # Fallback: run without JSON report and parse text output
         cmd = [
@@ -113,18 +117,89 @@ class FailureParser:
             "-v"
         ] + args
 
+        result = self._run_pytest(cmd)
+        return self._parse_text_output(result.stdout)
+
+    def _run_pytest(self, cmd: List[str]) -> subprocess.CompletedProcess:
+        """
+        Run a pytest command, capturing its output.
+
+        A run that hits the timeout raises rather than returning an empty
+        result: no tests must not be mistaken for no failures.
+
+        Args:
+            cmd: pytest command line
+
+        Returns:
+            Completed process (a non-zero exit code is not an error)
+
+        Raises:
+            subprocess.TimeoutExpired: If pytest ran longer than self.timeout
+        """
         try:
-            result = subprocess.run(
+            return subprocess.run(
                 cmd,
                 capture_output=True,
                 text=True,
-                timeout=120  # 2 minute overall timeout
+                timeout=self.timeout
             )
         except subprocess.TimeoutExpired:
-            print(" Pytest timed out after 120 seconds - tests may be hanging")
+            print(f"Pytest timed out after {self.timeout} seconds - tests may be hanging")
             print("Try running pytest manually to debug: pytest", self.test_directory, "-v")
-            return {"tests": [], "summary": {"total": 0, "passed": 0, "failed": 0}}
+            print("Or raise the limit with AUTOFIXER_PYTEST_TIMEOUT")
+            raise
+
+    def _run_pytest_with_json_report(self, args: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Run pytest with the JSON report plugin.
 
+        Args:
+            args: Additional pytest arguments
+
+        Returns:
+            JSON report (or parsed text output if the report is unreadable),
+            or None if the plugin is not installed
+
+        Raises:
+            subprocess.TimeoutExpired: If pytest ran longer than self.timeout
+        """
+        import tempfile
+
+        # The JSON report goes to a fresh per-run directory: it is never
+        # stale and concurrent runs cannot read each other's reports
+        with tempfile.TemporaryDirectory(prefix="pytest_report_") as report_dir:
+            report_file = os.path.join(report_dir, "pytest_report.json")
+
+            cmd = [
+                "pytest",
+                self.test_directory,
+                "--tb=short",
+                "--json-report",
+                f"--json-report-file={report_file}",
+                "-v"
+            ] + args
+
+            # Run pytest, capture output but don't fail on non-zero exit
+            # (the timeout prevents hanging on stuck tests)
+            result = self._run_pytest(cmd)
+
+            # Read the JSON report
+            try:
+                with open(report_file, "rb") as f:
+                    report = _json_loads(f.read())
+                self._json_report_available = True
+                return report
+            except (FileNotFoundError, ValueError):
+                # JSON report not available, try verbose text output
+                pass
+
+        # Without the pytest-json-report plugin, pytest exits with a usage
+        # error (4) before running any test: remember that, so later runs
+        # skip straight to text output. Otherwise this run's verbose output
+        # can be parsed directly
+        if result.returncode == 4 and self._json_report_available is None:
+            self._json_report_available = False
+            return None
         return self._parse_text_output(result.stdout)
 
     def _parse_text_output(self, output: str) -> Dict[str, Any]:
@@ -147,64 +222,53 @@ class FailureParser:
         # <blank line(s)>
         # FAILED tests/test_foo.py::test_name - ErrorType: message
 
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-
-            # Look for test separator lines (start of failure section)
-            if re.match(r'^_{3,}.*_{3,}$', line):
-                # Extract test name from separator
-                test_name_match = re.search(r'_{3,}\s*(.+?)\s*_{3,}', line)
-
-                # Collect all lines until we hit FAILED or next separator
-                traceback_lines = []
-                j = i + 1
-                nodeid = None
-                error_preview = ""
-
-                while j < len(lines):
-                    current_line = lines[j]
-
-                    # Check if this is the FAILED line for this test
-                    if current_line.startswith('FAILED '):
-                        # Extract nodeid and error
-                        parts = current_line.split(' - ', 1)
-                        nodeid = parts[0].replace('FAILED ', '').strip()
-                        error_preview = parts[1] if len(parts) > 1 else ""
-                        break
-
-                    # Check if we hit the next test's separator or end section
-                    if re.match(r'^_{3,}.*_{3,}$', current_line) or current_line.startswith('==='):
-                        # This means we're at the next section without finding FAILED
-                        # (might be a different kind of output)
-                        break
-
-                    # Collect traceback content
-                    traceback_lines.append(current_line)
-                    j += 1
-
-                # Create test entry if we have traceback content
-                if traceback_lines:
-                    traceback_text = '\n'.join(traceback_lines).strip()
-
-                    # If we don't have nodeid from FAILED line, extract from traceback
-                    if not nodeid:
-                        test_name = test_name_match.group(1).strip() if test_name_match else "unknown_test"
-                        nodeid = self._extract_nodeid_from_traceback(traceback_text, test_name)
-
-                    tests.append({
-                        "nodeid": nodeid,
-                        "outcome": "failed",
-                        "call": {
-                            "longrepr": traceback_text
-                        }
-                    })
-
-                # Move to next section
-                i = j if j < len(lines) else i + 1
-                continue
-
-            i += 1
+        # Test separator lines (start of failure sections), found in one pass
+        separators = [i for i, line in enumerate(lines) if _SEP_RE.match(line)]
+        separators.append(len(lines))
+
+        for i, next_separator in zip(separators, separators[1:]):
+            # Extract test name from separator
+            test_name_match = _NAME_FROM_SEP_RE.search(lines[i])
+
+            # Collect all lines until we hit FAILED or the next separator
+            traceback_lines = []
+            nodeid = None
+            error_preview = ""
+
+            for current_line in lines[i + 1:next_separator]:
+                # Check if this is the FAILED line for this test
+                if current_line.startswith('FAILED '):
+                    # Extract nodeid and error
+                    parts = current_line.split(' - ', 1)
+                    nodeid = parts[0].replace('FAILED ', '').strip()
+                    error_preview = parts[1] if len(parts) > 1 else ""
+                    break
+
+                # Check if we hit an end section
+                if current_line.startswith('==='):
+                    # This means we're at the next section without finding FAILED
+                    # (might be a different kind of output)
+                    break
+
+                # Collect traceback content
+                traceback_lines.append(current_line)
+
+            # Create test entry if we have traceback content
+            if traceback_lines:
+                traceback_text = '\n'.join(traceback_lines).strip()
+
+                # If we don't have nodeid from FAILED line, extract from traceback
+                if not nodeid:
+                    test_name = test_name_match.group(1).strip() if test_name_match else "unknown_test"
+                    nodeid = self._extract_nodeid_from_traceback(traceback_text, test_name)
+
+                tests.append({
+                    "nodeid": nodeid,
+                    "outcome": "failed",
+                    "call": {
+                        "longrepr": traceback_text
+                    }
+                })
 
         return {
             "tests": tests,
@@ -228,7 +292,7 @@ class FailureParser:
         """
         # Look for file path pattern in traceback
         # Pattern: tests/some/path.py:line_number:
-        file_match = re.search(r'(tests/[^\s:]+\.py):\d+:', traceback_text)
+        file_match = _FILE_IN_TB_RE.search(traceback_text)
 
         if file_match:
             file_path = file_match.group(1)
@@ -319,29 +383,26 @@ class FailureParser:
         Returns:
             Tuple of (exception_type, error_message)
         """
-        # Try to find exception type and message
-        # Format is usually: "ExceptionType: message"
+        # One reverse pass. Preferred format: "ExceptionType: message";
+        # alternative format: "E   AssertionError: message" (last one wins)
         lines = str(longrepr).split('\n')
+        e_candidate = None
 
         for line in reversed(lines):
             line = line.strip()
-            if ':' in line and not line.startswith(('>', 'E', ' ')):
-                parts = line.split(':', 1)
-                if len(parts) == 2:
-                    exception_type = parts[0].strip()
-                    error_message = parts[1].strip()
-                    return exception_type, error_message
-
-        # Try alternative format: "E   AssertionError: message"
-        for line in reversed(lines):
-            if line.strip().startswith('E   '):
-                content = line.strip()[4:]  # Remove "E   "
-                if ':' in content:
-                    parts = content.split(':', 1)
-                    if len(parts) == 2:
-                        exception_type = parts[0].strip()
-                        error_message = parts[1].strip()
-                        return exception_type, error_message
+            colon = line.find(':')
+            if colon < 0:
+                continue
+            if not line.startswith(('>', 'E')):
+                return line[:colon].strip(), line[colon + 1:].strip()
+            if e_candidate is None and line.startswith('E   '):
+                content = line[4:]
+                colon = content.find(':')
+                if colon >= 0:
+                    e_candidate = (content[:colon].strip(), content[colon + 1:].strip())
+
+        if e_candidate is not None:
+            return e_candidate
 
         # Fallback: return full last line
         last_line = lines[-1].strip() if lines else ""
@@ -358,16 +419,16 @@ class FailureParser:
         Returns:
             Line number or None
         """
+        longrepr = str(longrepr)
+
         # Look for patterns like "test_file.py:123:"
-        pattern = rf"{re.escape(test_file)}:(\d+):"
-        match = re.search(pattern, str(longrepr))
+        match = _get_file_line_re(test_file).search(longrepr)
 
         if match:
             return int(match.group(1))
 
         # Alternative pattern: "line 123"
-        pattern = r"line (\d+)"
-        match = re.search(pattern, str(longrepr), re.IGNORECASE)
+        match = _LINE_RE.search(longrepr)
 
         if match:
             return int(match.group(1))
@@ -383,6 +444,9 @@ class FailureParser:
 
         Returns:
             List of TestFailure objects
+
+        Raises:
+            subprocess.TimeoutExpired: If pytest ran longer than self.timeout
         """
         json_output = self.run_pytest_json(extra_args)
         return self.parse_failures(json_output)
\ No newline at end of file
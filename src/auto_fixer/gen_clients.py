@@ -0,0 +1,59 @@
+"""
+Access to the gen package's LLM and embedding client modules.
+
+The client modules are loaded by file path to bypass gen/__init__.py, whose
+imports reach outside the package. Each is loaded once per process, and the
+clients created from them are shared by the classifier, the fixer and the
+indexer, so their HTTP connection pools (and TLS sessions) are reused.
+"""
+
+import importlib.util
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+GEN_DIR = Path(__file__).resolve().parent.parent / 'gen'
+
+
+def _load(path: Path, name: str):
+    """Load a module from a file path, reusing it if already loaded."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.spec_from_file_location(name, str(path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
+
+
+def gen_module(name: str):
+    """
+    Load a gen client module (e.g. "openai_client"), once per process.
+
+    Args:
+        name: Module name within the gen package
+
+    Returns:
+        The loaded module
+    """
+    return _load(GEN_DIR / f'{name}.py', f'{name}_autofixer')
+
+
+# Clients per (provider, endpoint)
+_client_cache: Dict[Tuple[str, str], Any] = {}
+_client_cache_lock = threading.Lock()
+
+
+def shared_client(key: Tuple[str, str], create: Callable[[], Any]) -> Any:
+    """Client for key, created on first use and kept for the process lifetime."""
+    with _client_cache_lock:
+        client = _client_cache.get(key)
+        if client is None:
+            client = _client_cache[key] = create()
+        return client
@@ -4,19 +4,237 @@ LLM-Based Classifier
 Uses LLM to classify test failures and suggest fixes.
 """
 
+import hashlib
 import json
-from typing import Literal, Optional
-from dataclasses import dataclass
+import random
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Literal, Optional, Set, Tuple
+from dataclasses import asdict, dataclass
 from .failure_parser import TestFailure
-import sys
+from .gen_clients import gen_module, shared_client
 import os
 
-# Add parent directory to path to import gen modules
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 
 ClassificationType = Literal["test_mistake", "code_bug"]
 
+# Element markers in the source context ("# function: name (line 12)")
+_SOURCE_MARKER_RE = re.compile(r'# (?:function|class|http_endpoint):')
+
+# Characters that matter when scanning text for a JSON object
+_JSON_STRUCTURE_RE = re.compile(r'[{}"\\]')
+
+# For parsing an object that starts at a given position of a response
+_JSON_DECODER = json.JSONDecoder()
+
+# Body of a ```json markdown block
+_JSON_FENCE_RE = re.compile(r'```json[ \t]*\n(.*?)```', re.DOTALL)
+
+# One component of a rate-limit reset duration such as "6s", "1m30s" or "250ms"
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+# Request parameters that not every deployment accepts, with the text that
+# names them in the provider's error
+OPTIONAL_PARAMS = {
+    "response_format": "response_format",
+    "extra_body": "prompt_cache_key",
+}
+
+# Routes classification requests to the same prompt cache (Azure OpenAI);
+# bump the version whenever SYSTEM_PROMPT changes
+PROMPT_CACHE_KEY = "autofixer-classifier-v1"
+
+# JSON schema of one classification
+CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "classification": {"type": "string", "enum": ["test_mistake", "code_bug"]},
+        "reason": {"type": "string"},
+        "fixed_code": {"type": ["string", "null"]},
+        "confidence": {"type": "number"},
+    },
+    # Strict mode requires every property to be listed
+    "required": ["classification", "reason", "fixed_code", "confidence"],
+    "additionalProperties": False,
+}
+
+# Structured-output schema of a classification response: the provider
+# constrains decoding to it, so the reply is always parseable JSON
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "LLMClassification",
+        "strict": True,
+        "schema": CLASSIFICATION_SCHEMA,
+    },
+}
+
+# Response of a batch: one classification per failure, tagged with the
+# failure's number in the prompt
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "LLMClassificationBatch",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        **CLASSIFICATION_SCHEMA,
+                        "properties": {"index": {"type": "integer"}, **CLASSIFICATION_SCHEMA["properties"]},
+                        "required": ["index", *CLASSIFICATION_SCHEMA["required"]],
+                    },
+                },
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Share of the context window a batch prompt may fill; the rest is left
+# for the reasoning and the answers
+BATCH_CONTEXT_SHARE = 0.6
+
+
+def _json_loads(data: str) -> Any:
+    """Parse JSON, with orjson when available (responses carry multi-KB code)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@lru_cache(maxsize=None)
+def _token_counter(model_name: str) -> Callable[[str], int]:
+    """Token count function for a model: tiktoken when available, else ~4 chars per token."""
+    if tiktoken is not None:
+        try:
+            try:
+                encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                # Azure deployment names and Ollama models are unknown to tiktoken
+                encoding = tiktoken.get_encoding("o200k_base")
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception:
+            # Encoding files are downloaded on first use; offline there are none
+            pass
+    return lambda text: len(text) // 4
+
+
+# Reasoning block that models like deepseek-r1 emit before the answer
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _skip_think(content: str) -> str:
+    """Content after a leading <think> block (unchanged if there is none)."""
+    stripped = content.lstrip()
+    if stripped.startswith(THINK_OPEN):
+        think_end = stripped.find(THINK_CLOSE)
+        if think_end != -1:
+            return stripped[think_end + len(THINK_CLOSE):]
+    return content
+
+
+class _JsonObjectScanner:
+    """
+    Incremental search for the first balanced {...} that parses as JSON.
+
+    Single pass over the structural characters ({ } " \\) tracking brace
+    depth; braces inside strings (and escaped quotes) are skipped once an
+    object has started, so prose quotes outside objects don't matter.
+    Text can be fed in pieces, e.g. as a response streams in.
+
+    With accept, objects it rejects (e.g. a "{}" quoted in prose) are
+    skipped; the first of them is kept in rejected.
+    """
+
+    def __init__(self, accept: Optional[Callable[[Any], bool]] = None):
+        self._accept = accept
+        self.rejected: Optional[str] = None
+        self._pieces: List[str] = []  # text of the object being scanned
+        self._base = 0  # position of _pieces[0] in the whole text
+        self._end = 0  # length of the text fed so far
+        self._depth = 0
+        self._start = 0
+        self._in_string = False
+        self._escape_end = -1  # position of the character escaped by the last backslash
+
+    def feed(self, text: str) -> Optional[str]:
+        """
+        Scan the next piece of text.
+
+        Returns:
+            The first (accepted) JSON object once it is complete, else None
+        """
+        offset = self._end
+        self._end += len(text)
+        self._pieces.append(text)
+        depth = self._depth
+        in_string = self._in_string
+
+        for match in _JSON_STRUCTURE_RE.finditer(text):
+            char = match.group()
+            i = offset + match.start()
+            if depth == 0:
+                if char == '{':
+                    depth = 1
+                    self._start = i
+                continue
+
+            if in_string:
+                if i == self._escape_end:
+                    continue
+                if char == '\\':
+                    self._escape_end = i + 1
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth == 0:
+                    buffered = "".join(self._pieces)
+                    self._pieces = [buffered]
+                    candidate = buffered[self._start - self._base:i + 1 - self._base]
+                    try:
+                        value = _json_loads(candidate)
+                    except ValueError:
+                        # Not JSON (e.g. a brace in prose); keep scanning
+                        continue
+                    if self._accept is None or self._accept(value):
+                        return candidate
+                    if self.rejected is None:
+                        self.rejected = candidate
+
+        self._depth = depth
+        self._in_string = in_string
+        if depth == 0:
+            # No object open: nothing fed so far can be part of one
+            self._pieces = []
+            self._base = self._end
+        return None
+
 
 @dataclass
 class LLMClassification:
@@ -58,36 +276,77 @@ Example valid response:
 
 Be conservative: if you're unsure, classify as "code_bug" to avoid incorrectly modifying tests."""
 
-    def __init__(self, verbose: bool = False):
-        """Initialize LLM classifier."""
+    # Static end of every user prompt
+    PROMPT_TASK = """## Task
+Analyze this failure and determine:
+1. Is this a **test_mistake** (error in test code) or **code_bug** (error in source code)?
+2. Why?
+3. If it's a test_mistake, provide the fixed test code.
+
+IMPORTANT: Respond with ONLY a valid JSON object. Do not include any explanatory text, reasoning, or markdown formatting. Your entire response must be parseable JSON."""
+
+    # Static end of a batch prompt (see classify_batch)
+    BATCH_PROMPT_TASK = """## Task
+For EACH failure above, determine:
+1. Is this a **test_mistake** (error in test code) or **code_bug** (error in source code)?
+2. Why?
+3. If it's a test_mistake, provide the fixed test code.
+
+IMPORTANT: Respond with ONLY a valid JSON object of the form {"results": [...]}, with one entry per failure. Each entry has the structure described in the instructions plus "index", the failure's number. Do not include any explanatory text, reasoning, or markdown formatting."""
+
+    OLLAMA_REMINDER = "\n\nReminder: Output ONLY the JSON object, nothing else. Start your response with { and end with }"
+
+    def __init__(self, verbose: bool = False, cache_dir: Optional[Path] = None):
+        """
+        Initialize LLM classifier.
+
+        Args:
+            verbose: Print progress and debug output
+            cache_dir: Directory of the persistent result cache
+                (default: .autofixer_cache in the working directory)
+        """
         self.verbose = verbose
         self.client = None
         self.using_ollama = False
 
+        # Ollama: keep the model (and the KV cache of the static system
+        # prompt) loaded between calls, with room for the full context
+        self._ollama_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "24h")
+        self._ollama_options = {"num_ctx": int(os.getenv("OLLAMA_NUM_CTX", "16384"))}
+
+        # Persistent cache of classifications (the same failures recur across
+        # fix iterations and CI re-runs); the database is opened on first use
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else Path(".autofixer_cache")
+        self.use_cache = os.getenv("AUTOFIXER_LLM_CACHE", "1").lower() not in ("0", "false", "no")
+        self._cache_conn: Optional[sqlite3.Connection] = None
+        self._cache_lock = threading.Lock()
+        # OPTIONAL_PARAMS the deployment rejected: left out of later requests
+        self._unsupported_params: Set[str] = set()
+        self._unsupported_lock = threading.Lock()
+
+        # Suggested fix -> key of the cached classification it came with (reject_fix)
+        self._fix_keys: Dict[str, str] = {}
+
+        # Token budget for source code when it is given as scored chunks
+        self.max_source_tokens = int(os.getenv("AUTOFIXER_MAX_SOURCE_TOKENS", "4000"))
+
+        # Concurrent requests in classify_many
+        self.max_concurrency = max(1, int(os.getenv("AUTOFIXER_LLM_CONCURRENCY", "8")))
+
         # Check if Ollama should be used (local LLM)
         # Only check OLLAMA_MODEL for LLM provider (OLLAMA_HOST is for embeddings)
         ollama_model = os.getenv("OLLAMA_MODEL", "").strip()
         if ollama_model:
             try:
-                # Load Ollama client dynamically
-                import importlib.util
-                from pathlib import Path
-
-                current_file = Path(__file__).resolve()
-                ollama_client_path = current_file.parent.parent / 'gen' / 'ollama_client.py'
-
-                spec = importlib.util.spec_from_file_location(
-                    "ollama_client_llm_classifier",
-                    str(ollama_client_path)
+                # Load Ollama client dynamically (once per process)
+                ollama_module = gen_module('ollama_client')
+                self.client = shared_client(
+                    ("ollama", os.getenv("OLLAMA_HOST", "http://localhost:11434")),
+                    ollama_module.get_ollama_llm_client
                 )
-                ollama_module = importlib.util.module_from_spec(spec)
-                sys.modules['ollama_client_llm_classifier'] = ollama_module
-                spec.loader.exec_module(ollama_module)
-
-                self.client = ollama_module.get_ollama_llm_client()
                 self.using_ollama = True
                 if verbose:
-                    print(f"Using Ollama LLM: {os.getenv('OLLAMA_MODEL', 'deepseek-r1:latest')}")
+                    print(f"Using Ollama LLM: {ollama_model}")
             except Exception as e:
                 if verbose:
                     print(f"Could not initialize Ollama LLM client: {e}")
@@ -97,32 +356,45 @@ Be conservative: if you're unsure, classify as "code_bug" to avoid incorrectly m
         if self.client is None:
             try:
                 # Load OpenAI client dynamically (avoid gen/__init__.py relative imports)
-                import importlib.util
-                from pathlib import Path
-
-                current_file = Path(__file__).resolve()
-                openai_client_path = current_file.parent.parent / 'gen' / 'openai_client.py'
-
-                spec = importlib.util.spec_from_file_location(
-                    "openai_client_llm_classifier",
-                    str(openai_client_path)
-                )
-                openai_module = importlib.util.module_from_spec(spec)
-                sys.modules['openai_client_llm_classifier'] = openai_module
-                spec.loader.exec_module(openai_module)
-
-                self.client = openai_module.get_openai_client()
+                openai_module = gen_module('openai_client')
+                endpoint = os.getenv("AZURE_OPENAI_ENDPOINT") or os.getenv("AZURE_OPENAI_API_ENDPOINT", "")
+                self.client = shared_client(("azure", endpoint), openai_module.get_openai_client)
                 if verbose:
                     print(f"Using Azure OpenAI")
             except Exception as e:
                 print(f"Warning: Could not initialize OpenAI client: {e}")
                 self.client = None
 
+        # Model and sampling settings, read once rather than on every call
+        if self.using_ollama:
+            self._model_name = os.getenv("OLLAMA_MODEL", "deepseek-r1:latest")
+        else:
+            # Azure OpenAI
+            self._model_name = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+        # Only set when configured: some Azure deployments don't support custom temperature
+        temperature = os.getenv("AUTOFIXER_LLM_TEMPERATURE")
+        self._temperature = float(temperature) if temperature else None
+
+        # Several failures per LLM call in classify_many (opt-in)
+        self.batch_enabled = os.getenv("AUTOFIXER_LLM_BATCH", "").lower() in ("1", "true", "yes")
+        if self.using_ollama:
+            self._context_window = self._ollama_options["num_ctx"]
+        else:
+            self._context_window = int(os.getenv("AUTOFIXER_LLM_CONTEXT_WINDOW", "128000"))
+
+        # Stream responses and stop the generation once the JSON answer is
+        # complete (default for Ollama; Azure buffers server-side anyway)
+        stream_default = "1" if self.using_ollama else "0"
+        self.stream_early_exit = os.getenv(
+            "AUTOFIXER_LLM_STREAM_EARLY_EXIT", stream_default
+        ).lower() in ("1", "true", "yes")
+
     def classify(
         self,
         failure: TestFailure,
         test_code: str,
         source_code: str,
+        source_chunks: Optional[List[Tuple[str, float]]] = None,
     ) -> LLMClassification:
         """
         Classify a test failure using LLM.
@@ -131,6 +403,9 @@ Be conservative: if you're unsure, classify as "code_bug" to avoid incorrectly m
             failure: TestFailure object
             test_code: The failing test function code
             source_code: Relevant source code being tested (from AST extraction)
+            source_chunks: The same source code as (code, relevance score)
+                chunks; if given, only the most relevant chunks that fit
+                max_source_tokens are sent instead of source_code
 
         Returns:
             LLMClassification object
@@ -143,59 +418,57 @@ Be conservative: if you're unsure, classify as "code_bug" to avoid incorrectly m
                 confidence=0.0
             )
 
+        model_name = self._model_name
+
+        # Prompt size drives LLM latency: keep the most relevant source only
+        if source_chunks is not None:
+            source_code = self._pack_source_chunks(source_chunks, model_name or "")
+
+        # Repeat failures are answered from the cache without an LLM call
+        cache_key = None
+        if self.use_cache and model_name:
+            cache_key = self._cache_key(failure, test_code, source_code, model_name)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                if self.verbose:
+                    print(f"Using cached LLM classification ({cached.classification})")
+                return cached
+
         # Build the prompt
         user_prompt = self._build_prompt(failure, test_code, source_code)
 
-        # DEBUG: Show prompt size with element breakdown
-        prompt_lines = user_prompt.count('\n')
-        prompt_chars = len(user_prompt)
-        estimated_tokens = prompt_chars // 4  # Rough estimate: 4 chars per token
+        # DEBUG: Show prompt size with element breakdown (only counted when
+        # shown: the prompt and source can be tens of KB)
+        if self.verbose:
+            count_tokens = _token_counter(model_name or "")
+            prompt_lines = user_prompt.count('\n')
+            prompt_chars = len(user_prompt)
+            estimated_tokens = count_tokens(user_prompt)
 
-        # Count elements in source code
-        element_count = source_code.count('# function:') + source_code.count('# class:') + source_code.count('# http_endpoint:')
+            # Count elements in source code
+            element_count = len(_SOURCE_MARKER_RE.findall(source_code))
 
-        if self.verbose:
             print(f"Input size:")
             print(f"Prompt: {prompt_lines} lines, {prompt_chars} chars (~{estimated_tokens} tokens)")
             print(f"Elements sent to LLM: {element_count}")
-            print(f"Source code: {len(source_code)} chars (~{len(source_code)//4} tokens)")
+            print(f"Source code: {len(source_code)} chars (~{count_tokens(source_code)} tokens)")
 
         try:
             # Call LLM with retry logic
-            # Get model name based on provider
-            if self.using_ollama:
-                model_name = os.getenv("OLLAMA_MODEL", "deepseek-r1:latest")
-            else:
-                # Azure OpenAI
-                model_name = os.getenv("AZURE_OPENAI_DEPLOYMENT")
-                if not model_name:
-                    raise ValueError("AZURE_OPENAI_DEPLOYMENT environment variable not set")
-
-            # Build request parameters
-            request_params = {
-                "model": model_name,
-                "messages": [
-                    {"role": "system", "content": self.SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                # NO max_completion_tokens limit - let reasoning models use what they need
-                # (deepseek-r1 generates 8k-15k tokens of reasoning before the answer)
-            }
-
-            # Only set temperature if environment variable is set
-            # Some Azure deployments don't support custom temperature
-            temp = os.getenv("AUTOFIXER_LLM_TEMPERATURE")
-            if temp is not None:
-                request_params["temperature"] = float(temp)
+            if not model_name:
+                raise ValueError("AZURE_OPENAI_DEPLOYMENT environment variable not set")
+
+            request_params = self._request_params(user_prompt, RESPONSE_FORMAT)
 
             # Timing for Ollama models (to show how slow reasoning models are)
-            import time
             start_time = time.time()
             if self.verbose and self.using_ollama:
                 print(f"Calling {model_name}... (this may take 30s-15min for reasoning models)")
 
             # Retry logic with exponential backoff
-            response = self._call_llm_with_retry(request_params, max_retries=3)
+            content = self._call_llm_with_retry(
+                request_params, max_retries=3, accept=self._is_classification
+            )
 
             elapsed_time = time.time() - start_time
             if self.verbose and self.using_ollama:
@@ -204,9 +477,6 @@ Be conservative: if you're unsure, classify as "code_bug" to avoid incorrectly m
                 if mins > 0:
                     print(f"Completed in {mins}m {secs}s")
 
-            # Parse response
-            content = response.choices[0].message.content.strip()
-
             # DEBUG: Show raw LLM response for Ollama models (to debug reasoning models)
             if self.verbose and self.using_ollama:
                 output_tokens = len(content) // 4  # Estimate
@@ -219,37 +489,40 @@ Be conservative: if you're unsure, classify as "code_bug" to avoid incorrectly m
                 if len(content) > 300:
                     print(f" ... ({len(content) - 300} more chars)")
 
-            # Extract JSON from response (handle various formats)
-            json_str = self._extract_json(content)
+            classification, problem = self._parse_classification(content)
+
+            if problem is not None:
+                # A wasted call is the expensive part: show the model its
+                # reply and what is wrong with it, once, instead of giving up
+                print(f"Invalid LLM response ({problem}), asking for a corrected one...")
+                request_params["messages"] = request_params["messages"] + [
+                    {"role": "assistant", "content": content},
+                    {"role": "user", "content": (
+                        f"That response is invalid: {problem}. "
+                        "Respond with ONLY the corrected JSON object."
+                    )},
+                ]
+                content = self._call_llm_with_retry(
+                    request_params, max_retries=3, accept=self._is_classification
+                )
+                classification, problem = self._parse_classification(content)
 
-            # DEBUG: Show extracted JSON
-            if self.verbose and self.using_ollama and json_str != content:
-                print(f"Extracted JSON ({len(json_str)} chars):")
-                print(f"{json_str[:200]}")
+            if problem is not None:
+                print(f"Error parsing LLM JSON response: {problem}")
+                print(f"Raw response preview (first 400 chars):")
+                print(f"{content[:400]}")
+                # Conservative fallback
+                return LLMClassification(
+                    classification="code_bug",
+                    reason=f"JSON parse error: {problem}",
+                    confidence=0.0
+                )
 
-            result = json.loads(json_str)
+            if cache_key is not None:
+                self._cache_put(cache_key, classification)
 
-            return LLMClassification(
-                classification=result.get("classification", "code_bug"),
-                reason=result.get("reason", "No reason provided"),
-                fixed_code=result.get("fixed_code"),
-                confidence=result.get("confidence", 0.5)
-            )
+            return classification
 
-        except json.JSONDecodeError as e:
-            print(f"Error parsing LLM JSON response: {e}")
-            if 'content' in locals():
-                print(f"Raw response preview (first 400 chars):")
-                print(f"{content[:400]}")
-                if 'json_str' in locals() and json_str != content:
-                    print(f"Extracted JSON attempt:")
-                    print(f"{json_str[:400]}")
-            # Conservative fallback
-            return LLMClassification(
-                classification="code_bug",
-                reason=f"JSON parse error: {str(e)}",
-                confidence=0.0
-            )
         except Exception as e:
             print(f"Error in LLM classification: {e}")
             # Conservative fallback
@@ -259,117 +532,710 @@ Be conservative: if you're unsure, classify as "code_bug" to avoid incorrectly m
                 confidence=0.0
             )
 
-    def _call_llm_with_retry(self, request_params: dict, max_retries: int = 3):
+    def _request_params(self, user_prompt: str, response_format: dict) -> dict:
+        """
+        Build the chat completion parameters for a user prompt.
+
+        Args:
+            user_prompt: Prompt describing the failure(s)
+            response_format: Structured-output schema of the answer
+
+        Returns:
+            Keyword arguments for client.chat.completions.create
+        """
+        request_params = {
+            "model": self._model_name,
+            "messages": [
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            # Constrain the output to the classification JSON
+            # (the Ollama adapter maps this to Ollama's format)
+            "response_format": response_format,
+            # NO max_completion_tokens limit - let reasoning models use what they need
+            # (deepseek-r1 generates 8k-15k tokens of reasoning before the answer)
+        }
+
+        # Only set temperature if environment variable is set
+        if self._temperature is not None:
+            request_params["temperature"] = self._temperature
+
+        # Reuse the prefill of the system prompt across calls: it is
+        # always the first message and never interpolated
+        if self.using_ollama:
+            request_params["keep_alive"] = self._ollama_keep_alive
+            request_params["options"] = self._ollama_options
+        else:
+            request_params["extra_body"] = {"prompt_cache_key": PROMPT_CACHE_KEY}
+
+        if self._unsupported_params:
+            with self._unsupported_lock:
+                for param in self._unsupported_params:
+                    request_params.pop(param, None)
+
+        return request_params
+
+    def classify_many(
+        self,
+        items: List[Tuple]
+    ) -> List[LLMClassification]:
+        """
+        Classify several failures concurrently.
+
+        Each request spends seconds to minutes waiting on the LLM, so up to
+        max_concurrency (AUTOFIXER_LLM_CONCURRENCY) requests are kept in
+        flight instead of issuing them one after another. With
+        AUTOFIXER_LLM_BATCH set, failures are sent several per request
+        instead (classify_batch).
+
+        Args:
+            items: (failure, test_code, source_code[, source_chunks]) per
+                failure, as for classify
+
+        Returns:
+            LLMClassification per item, in order
+        """
+        if self.batch_enabled:
+            return self.classify_batch(items)
+
+        if len(items) <= 1 or self.max_concurrency == 1 or not self.client:
+            return [self.classify(*item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(items))) as executor:
+            return list(executor.map(lambda item: self.classify(*item), items))
+
+    def classify_batch(self, items: List[Tuple]) -> List[LLMClassification]:
+        """
+        Classify several failures with as few LLM calls as possible.
+
+        Failures are grouped into prompts of up to BATCH_CONTEXT_SHARE of
+        the context window, so the system prompt and request overhead are
+        paid once per group rather than once per failure. Cached results
+        are reused, and failures a batch answer leaves out (or gets wrong)
+        are classified on their own.
+
+        Args:
+            items: (failure, test_code, source_code[, source_chunks]) per
+                failure, as for classify
+
+        Returns:
+            LLMClassification per item, in order
+        """
+        if len(items) <= 1 or not self.client or not self._model_name:
+            return [self.classify(*item) for item in items]
+
+        results: List[Optional[LLMClassification]] = [None] * len(items)
+        pending = []  # (position, failure, test_code, source_code, cache_key)
+
+        for position, item in enumerate(items):
+            failure, test_code, source_code = item[:3]
+            source_chunks = item[3] if len(item) > 3 else None
+            if source_chunks is not None:
+                source_code = self._pack_source_chunks(source_chunks, self._model_name)
+
+            cache_key = None
+            if self.use_cache:
+                cache_key = self._cache_key(failure, test_code, source_code, self._model_name)
+                results[position] = self._cache_get(cache_key)
+            if results[position] is None:
+                pending.append((position, failure, test_code, source_code, cache_key))
+
+        groups = self._batch_groups(pending)
+        if self.verbose and pending:
+            print(f"Classifying {len(pending)} failure(s) in {len(groups)} LLM call(s)")
+
+        batches = [group for group in groups if len(group) > 1]
+        if batches:
+            workers = min(self.max_concurrency, len(batches))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda group: self._classify_group(group, results), batches))
+
+        # Single-failure groups and anything a batch didn't answer
+        for position, failure, test_code, source_code, _ in pending:
+            if results[position] is None:
+                results[position] = self.classify(failure, test_code, source_code)
+
+        return results
+
+    def _batch_groups(self, pending: List[Tuple]) -> List[List[Tuple]]:
+        """Split pending failures into groups whose prompts fit the batch token budget."""
+        count_tokens = _token_counter(self._model_name)
+        budget = (
+            int(self._context_window * BATCH_CONTEXT_SHARE)
+            - count_tokens(self.SYSTEM_PROMPT)
+            - count_tokens(self.BATCH_PROMPT_TASK)
+        )
+
+        groups: List[List[Tuple]] = []
+        group: List[Tuple] = []
+        used = 0
+        for entry in pending:
+            _, failure, test_code, source_code, _ = entry
+            # Section text plus headings and labels
+            tokens = count_tokens(
+                failure.traceback + failure.error_message + test_code + source_code
+            ) + 100
+            if group and used + tokens > budget:
+                groups.append(group)
+                group, used = [], 0
+            group.append(entry)
+            used += tokens
+        if group:
+            groups.append(group)
+
+        return groups
+
+    def _classify_group(
+        self,
+        group: List[Tuple],
+        results: List[Optional[LLMClassification]]
+    ) -> None:
+        """
+        Classify a group of failures with one LLM call.
+
+        Valid answers are stored in results (and the result cache); failures
+        without one are left as None.
+        """
+        prompt = self._build_batch_prompt([
+            (failure, test_code, source_code) for _, failure, test_code, source_code, _ in group
+        ])
+
+        try:
+            content = self._call_llm_with_retry(
+                self._request_params(prompt, BATCH_RESPONSE_FORMAT), max_retries=3,
+                accept=self._is_batch_response
+            )
+            response = self._loads_response(content, accept=self._is_batch_response)
+            entries = response.get("results") if isinstance(response, dict) else None
+            if not isinstance(entries, list):
+                raise ValueError("no results array in the response")
+        except Exception as e:
+            print(f"Batch classification failed ({e}), classifying individually")
+            return
+
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            index = entry.get("index")
+            if not isinstance(index, int) or not 1 <= index <= len(group):
+                continue
+            classification, problem = self._classification_from_dict(entry)
+            if problem is not None:
+                continue
+            position, *_, cache_key = group[index - 1]
+            results[position] = classification
+            if cache_key is not None:
+                self._cache_put(cache_key, classification)
+
+    def _pack_source_chunks(self, chunks: List[Tuple[str, float]], model_name: str) -> str:
+        """
+        Most relevant source chunks that fit the source token budget.
+
+        Greedy by score: a chunk too large for the remaining budget is
+        skipped, smaller less relevant ones may still fit.
+
+        Args:
+            chunks: (code, relevance score) pairs
+            model_name: Model whose tokenizer counts the tokens
+
+        Returns:
+            Selected chunks, most relevant first
+        """
+        count_tokens = _token_counter(model_name)
+        budget = self.max_source_tokens
+        packed = []
+
+        for code, _ in sorted(chunks, key=lambda chunk: chunk[1], reverse=True):
+            tokens = count_tokens(code)
+            if tokens <= budget:
+                packed.append(code)
+                budget -= tokens
+
+        if self.verbose and len(packed) < len(chunks):
+            print(f"Source trimmed to {len(packed)}/{len(chunks)} chunks "
+                  f"({self.max_source_tokens - budget} tokens)")
+
+        return "\n".join(packed) if packed else "# No relevant source code found"
+
+    def _cache_key(
+        self,
+        failure: TestFailure,
+        test_code: str,
+        source_code: str,
+        model_name: str
+    ) -> str:
+        """
+        Content hash of everything that determines a classification.
+
+        Returns:
+            SHA-256 hex digest
+        """
+        parts = (
+            self.SYSTEM_PROMPT,
+            failure.traceback,
+            failure.exception_type,
+            failure.error_message,
+            test_code,
+            source_code,
+            model_name,
+        )
+        # NUL-separated so that shifting text between fields changes the key
+        return hashlib.sha256("\0".join(parts).encode('utf-8', errors='replace')).hexdigest()
+
+    def _cache_db(self) -> Optional[sqlite3.Connection]:
+        """Open the result cache on first use; None if it is unavailable."""
+        if self._cache_conn is None and self.use_cache:
+            with self._cache_lock:
+                if self._cache_conn is None and self.use_cache:
+                    self._open_cache()
+        return self._cache_conn
+
+    def _open_cache(self) -> None:
+        """Connect to the result cache database (caller holds the lock)."""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.cache_dir / "llm.db"), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, payload TEXT)")
+            conn.commit()
+            self._cache_conn = conn
+        except (OSError, sqlite3.Error) as e:
+            if self.verbose:
+                print(f"LLM result cache unavailable: {e}")
+            # Don't retry on every call
+            self.use_cache = False
+
+    def _cache_get(self, key: str) -> Optional[LLMClassification]:
+        """Look up a cached classification; any error is a miss."""
+        conn = self._cache_db()
+        if conn is None:
+            return None
+
+        try:
+            with self._cache_lock:
+                row = conn.execute("SELECT payload FROM cache WHERE key = ?", (key,)).fetchone()
+            classification = LLMClassification(**_json_loads(row[0])) if row else None
+        except (sqlite3.Error, ValueError, TypeError) as e:
+            if self.verbose:
+                print(f"Could not read LLM result cache: {e}")
+            return None
+
+        if classification is not None and classification.fixed_code:
+            self._fix_keys[classification.fixed_code] = key
+        return classification
+
+    def _cache_put(self, key: str, classification: LLMClassification) -> None:
+        """Store a classification (best-effort)."""
+        conn = self._cache_db()
+        if conn is None:
+            return
+
+        try:
+            with self._cache_lock, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?)",
+                    (key, json.dumps(asdict(classification)))
+                )
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Could not write LLM result cache: {e}")
+            return
+
+        if classification.fixed_code:
+            self._fix_keys[classification.fixed_code] = key
+
+    def reject_fix(self, fixed_code: str) -> None:
+        """
+        Drop a suggested fix that failed validation from the result cache.
+
+        The classification stays cached, without the fix, so later runs go
+        straight to fix generation instead of replaying the bad fix.
+
+        Args:
+            fixed_code: fixed_code of a classification from classify/classify_many
+        """
+        cache_key = self._fix_keys.get(fixed_code)
+        if cache_key is None:
+            return
+        classification = self._cache_get(cache_key)
+        self._fix_keys.pop(fixed_code, None)
+        # Unless the entry was replaced in the meantime
+        if classification is not None and classification.fixed_code == fixed_code:
+            classification.fixed_code = None
+            self._cache_put(cache_key, classification)
+
+    def _call_llm_with_retry(
+        self,
+        request_params: dict,
+        max_retries: int = 3,
+        accept: Optional[Callable[[Any], bool]] = None
+    ):
         """
         Call LLM API with exponential backoff retry logic.
 
         Args:
             request_params: Parameters for the API call
             max_retries: Maximum number of retry attempts
+            accept: Check of the expected JSON shape, for streaming early exit
 
         Returns:
-            API response
+            Response content (stripped)
 
         Raises:
             Exception: If all retries fail
         """
-        import time
-
-        for attempt in range(max_retries):
+        attempt = 0
+        while True:
             try:
-                response = self.client.chat.completions.create(**request_params)
+                if self.stream_early_exit:
+                    content = self._stream_first_json(request_params, accept)
+                else:
+                    response = self.client.chat.completions.create(**request_params)
 
-                # Validate response has content
-                if not response.choices or not response.choices[0].message.content:
-                    raise ValueError("Empty response from LLM")
+                    # Validate response has content
+                    if not response.choices or not response.choices[0].message.content:
+                        raise ValueError("Empty response from LLM")
+                    content = response.choices[0].message.content
 
-                content = response.choices[0].message.content.strip()
+                content = content.strip()
                 if not content:
                     raise ValueError("Empty content in LLM response")
 
-                return response
+                return content
 
             except Exception as e:
+                # Deployment without structured outputs / prompt cache keys:
+                # retry without the parameter (JSON is then handled by _extract_json)
+                unsupported = [
+                    param for param, marker in OPTIONAL_PARAMS.items()
+                    if param in request_params and marker in str(e)
+                ]
+                if unsupported:
+                    # Doesn't count as an attempt; terminates as each parameter is dropped once
+                    print(f"{', '.join(unsupported)} not supported, retrying without: {e}")
+                    with self._unsupported_lock:
+                        self._unsupported_params.update(unsupported)
+                    request_params = {k: v for k, v in request_params.items() if k not in unsupported}
+                    continue
+
                 if attempt < max_retries - 1:
-                    # Calculate backoff time: 2^attempt seconds (2s, 4s, 8s)
-                    backoff_time = 2 ** attempt
+                    backoff_time = self._retry_delay(e, attempt)
                     print(f"LLM API error (attempt {attempt + 1}/{max_retries}): {e}")
-                    print(f"Retrying in {backoff_time}s...")
+                    print(f"Retrying in {backoff_time:.1f}s...")
                     time.sleep(backoff_time)
+                    attempt += 1
                 else:
                     # Final attempt failed
                     print(f"LLM API failed after {max_retries} attempts: {e}")
                     raise
 
-    def _extract_json(self, content: str) -> str:
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> float:
+        """
+        Seconds to wait before retrying a failed call.
+
+        Exponential backoff with full jitter (uniform in [0, 2^attempt]), so
+        concurrent classifications don't retry in lockstep; at least as long
+        as the server asks for when it rate-limits (Retry-After or Azure's
+        x-ratelimit-reset-* headers).
+
+        Args:
+            error: The exception the call raised
+            attempt: Number of the failed attempt (0-based)
+
+        Returns:
+            Delay in seconds
+        """
+        delay = random.uniform(0, 2 ** attempt)
+
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return delay
+
+        requested = None
+        if headers.get("retry-after-ms"):
+            try:
+                requested = float(headers["retry-after-ms"]) / 1000
+            except ValueError:
+                pass
+        if requested is None and headers.get("retry-after"):
+            try:
+                requested = float(headers["retry-after"])
+            except ValueError:
+                # HTTP-date form; not worth parsing for a retry hint
+                pass
+        if requested is None:
+            for header in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+                parts = _DURATION_RE.findall(headers.get(header) or "")
+                if parts:
+                    reset = sum(float(value) * _DURATION_UNITS[unit] for value, unit in parts)
+                    requested = max(requested or 0.0, reset)
+
+        return max(delay, requested) if requested is not None else delay
+
+    def _stream_first_json(
+        self,
+        request_params: dict,
+        accept: Optional[Callable[[Any], bool]] = None
+    ) -> str:
         """
-        Extract JSON from LLM response, handling various formats.
+        Stream the response and stop the generation at the first JSON object.
+
+        Whatever the model would emit after the object is never generated.
+        A leading <think> block is skipped before scanning, so JSON-looking
+        text in the reasoning can't end the response early.
+
+        Args:
+            request_params: Parameters for the API call
+            accept: Check of the expected JSON shape; other objects don't stop the stream
+
+        Returns:
+            The JSON object, or the whole content if it has none
+        """
+        stream = self.client.chat.completions.create(**request_params, stream=True)
+        scanner = _JsonObjectScanner(accept)
+        pieces = []
+        head = ""  # leading content, until it is known whether it opens a <think> block
+        tail = ""  # end of the reasoning so far, to find </think> across pieces
+        thinking = None
+
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                piece = chunk.choices[0].delta.content
+                if not piece:
+                    continue
+                pieces.append(piece)
+
+                if thinking is None:
+                    head += piece
+                    if THINK_OPEN.startswith(head.lstrip()):
+                        continue
+                    thinking = head.lstrip().startswith(THINK_OPEN)
+                    piece = head
+
+                if thinking:
+                    tail += piece
+                    think_end = tail.find(THINK_CLOSE)
+                    if think_end == -1:
+                        tail = tail[-len(THINK_CLOSE):]
+                        continue
+                    thinking = False
+                    piece = tail[think_end + len(THINK_CLOSE):]
+
+                found = scanner.feed(piece)
+                if found is not None:
+                    return found
+        finally:
+            stream.close()
+
+        return "".join(pieces)
+
+    def _parse_classification(
+        self,
+        content: str
+    ) -> Tuple[Optional[LLMClassification], Optional[str]]:
+        """
+        Parse and validate a classification response.
 
         Args:
             content: Raw LLM response
 
         Returns:
-            JSON string
+            (classification, None), or (None, what is wrong with the response)
+        """
+        try:
+            result = self._loads_response(content, accept=self._is_classification)
+        except json.JSONDecodeError as e:
+            return None, f"not valid JSON ({e})"
+
+        if not isinstance(result, dict):
+            return None, "expected a JSON object"
+        return self._classification_from_dict(result)
+
+    @staticmethod
+    def _classification_from_dict(
+        result: dict
+    ) -> Tuple[Optional[LLMClassification], Optional[str]]:
+        """
+        Validate a parsed classification.
+
+        Checks the constraints of CLASSIFICATION_SCHEMA, for providers that
+        ignored the response format.
+
+        Returns:
+            (classification, None), or (None, what is wrong with it)
+        """
+        if result.get("classification") not in ("test_mistake", "code_bug"):
+            return None, 'classification must be "test_mistake" or "code_bug"'
+        confidence = result.get("confidence", 0.5)
+        if not isinstance(confidence, (int, float)) or isinstance(confidence, bool):
+            return None, "confidence must be a number"
+        fixed_code = result.get("fixed_code")
+        if fixed_code is not None and not isinstance(fixed_code, str):
+            return None, "fixed_code must be a string or null"
+
+        return LLMClassification(
+            classification=result["classification"],
+            reason=result.get("reason") or "No reason provided",
+            fixed_code=fixed_code,
+            confidence=float(confidence)
+        ), None
+
+    @classmethod
+    def _is_classification(cls, value: Any) -> bool:
+        """Whether parsed JSON is a valid classification."""
+        return isinstance(value, dict) and cls._classification_from_dict(value)[1] is None
+
+    @staticmethod
+    def _is_batch_response(value: Any) -> bool:
+        """Whether parsed JSON has the results array of a batch response."""
+        return isinstance(value, dict) and isinstance(value.get("results"), list)
+
+    def _loads_response(
+        self,
+        content: str,
+        accept: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """
+        Parse the JSON in an LLM response.
+
+        With structured outputs the response is the JSON itself, so it is
+        parsed directly; extraction only runs when that fails.
+
+        Args:
+            content: Raw LLM response
+            accept: Check of the expected JSON shape, to pick the answer
+                among other JSON in the text
+
+        Raises:
+            json.JSONDecodeError: If no JSON can be found
         """
-        # Try markdown code blocks first
-        if "```json" in content:
-            return content.split("```json")[1].split("```")[0].strip()
+        try:
+            return _json_loads(content)
+        except json.JSONDecodeError:
+            pass
 
-        if "```" in content:
-            parts = content.split("```")
-            for part in parts[1::2]:  # Every other part (inside code blocks)
-                part = part.strip()
-                if part.startswith('{') and part.endswith('}'):
-                    return part
+        # Extract JSON from response (handle various formats)
+        json_str = self._extract_json(content, accept)
 
-        # Try to find JSON object directly - improved regex for nested objects
-        import re
+        # DEBUG: Show extracted JSON
+        if self.verbose and self.using_ollama and json_str != content:
+            print(f"Extracted JSON ({len(json_str)} chars):")
+            print(f"{json_str[:200]}")
 
-        # Pattern 1: Look for complete JSON objects with proper nesting
-        # This handles nested braces better
-        json_pattern = r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}'
-        matches = re.findall(json_pattern, content, re.DOTALL)
+        return _json_loads(json_str)
 
-        if matches:
-            # Try to parse each match and return the first valid one
-            for match in sorted(matches, key=len, reverse=True):
+    def _extract_json(
+        self,
+        content: str,
+        accept: Optional[Callable[[Any], bool]] = None
+    ) -> str:
+        """
+        Extract JSON from LLM response.
+
+        Responses are constrained to JSON by the response format, so this
+        only has to cope with providers that ignored it: reasoning, markdown
+        fences or text around the object (see _loads_response). JSON quoted
+        in the reasoning or prose (e.g. "the fixture returns {}") must not
+        be taken for the answer, so a leading <think> block is skipped, a
+        ```json block is preferred, and objects accept rejects are passed over.
+
+        Args:
+            content: Raw LLM response
+            accept: Check of the expected JSON shape
+
+        Returns:
+            JSON string
+        """
+        content = _skip_think(content)
+
+        for match in _JSON_FENCE_RE.finditer(content):
+            fenced = match.group(1).strip()
+            try:
+                value = _json_loads(fenced)
+            except ValueError:
+                continue
+            if accept is None or accept(value):
+                return fenced
+
+        # Object after reasoning text or in an unlabeled block
+        scanner = _JsonObjectScanner(accept)
+        scanned = scanner.feed(content)
+        if scanned is not None:
+            return scanned
+        rejected = scanner.rejected
+
+        if rejected is None:
+            # An unbalanced { in prose (e.g. "the dict literal { key: ...")
+            # keeps the scanner inside it to the end: parse from each later {
+            start = content.find('{', 1)
+            while start != -1:
                 try:
-                    json.loads(match)  # Validate it's real JSON
-                    return match
-                except:
+                    value, end = _JSON_DECODER.raw_decode(content, start)
+                except ValueError:
+                    start = content.find('{', start + 1)
                     continue
+                if accept is None or accept(value):
+                    return content[start:end]
+                if rejected is None:
+                    rejected = content[start:end]
+                start = content.find('{', end)
 
-        # Pattern 2: Extract everything between first { and last }
+        if rejected is not None:
+            # JSON of the wrong shape: the caller reports what is wrong with it
+            return rejected
+
+        # Last resort: everything between the first { and the last }
         first_brace = content.find('{')
         last_brace = content.rfind('}')
+        if first_brace != -1 and last_brace > first_brace:
+            return content[first_brace:last_brace + 1]
 
-        if first_brace != -1 and last_brace != -1 and last_brace > first_brace:
-            potential_json = content[first_brace:last_brace+1]
-            try:
-                json.loads(potential_json)  # Validate
-                return potential_json
-            except:
-                pass
+        return content
 
-        # Pattern 3: Look for JSON-like structure after thinking text
-        # Reasoning models often output: "thinking text... {json here}"
-        lines = content.split('\n')
-        for i, line in enumerate(lines):
-            if line.strip().startswith('{'):
-                # Try to parse from this line onwards
-                potential_json = '\n'.join(lines[i:])
-                first_brace = potential_json.find('{')
-                last_brace = potential_json.rfind('}')
-                if first_brace != -1 and last_brace != -1:
-                    candidate = potential_json[first_brace:last_brace+1]
-                    try:
-                        json.loads(candidate)
-                        return candidate
-                    except:
-                        continue
+    def _build_batch_prompt(self, items: List[Tuple[TestFailure, str, str]]) -> str:
+        """
+        Build the user prompt for classifying several failures at once.
 
-        # Fallback: return as-is and hope it's valid JSON
-        return content
+        Args:
+            items: (failure, test_code, source_code) per failure
+
+        Returns:
+            Formatted prompt string, failures numbered from 1
+        """
+        parts = [f"# Test Failure Analysis ({len(items)} failures)\n"]
+        for number, (failure, test_code, source_code) in enumerate(items, 1):
+            parts.append(f"""
+## Failure {number}
+**File:** {failure.test_file}
+**Test Name:** {failure.test_name}
+**Line:** {failure.line_number or 'Unknown'}
+**Exception Type:** {failure.exception_type}
+**Error Message:** {failure.error_message}
+
+### Traceback
+```
+{failure.traceback}
+```
+
+### Test Code
+```python
+{test_code}
+```
+
+### Source Code Being Tested
+```python
+{source_code}
+```
+""")
+        parts.append(f"\n{self.BATCH_PROMPT_TASK}")
+        if self.using_ollama:
+            parts.append(self.OLLAMA_REMINDER)
+
+        return "".join(parts)
 
     def _build_prompt(
         self,
@@ -388,11 +1254,15 @@ Be conservative: if you're unsure, classify as "code_bug" to avoid incorrectly m
         Returns:
             Formatted prompt string
         """
-        # NO truncation - send all source code (embeddings already filtered to relevant code)
-        # Modern LLMs (deepseek-r1: 64k, gpt-4o-mini: 128k) can handle large contexts
-        # The AST/embedding extractors already limit to relevant functions only
+        # No truncation here: classify() has already trimmed source code given
+        # as scored chunks to the token budget; plain source is sent as-is
         source_code_display = source_code
-        prompt = f"""# Test Failure Analysis
+        # Extra reminder for Ollama/reasoning models
+        reminder = self.OLLAMA_REMINDER if self.using_ollama else ""
+
+        # One f-string is a single join of all the parts; appending the
+        # reminder afterwards would copy the whole (often large) prompt again
+        return f"""# Test Failure Analysis
 
 ## Failing Test
 **File:** {failure.test_file}
@@ -418,16 +1288,4 @@ Be conservative: if you're unsure, classify as "code_bug" to avoid incorrectly m
 {source_code_display}
 ```
 
-## Task
-Analyze this failure and determine:
-1. Is this a **test_mistake** (error in test code) or **code_bug** (error in source code)?
-2. Why?
-3. If it's a test_mistake, provide the fixed test code.
-
-IMPORTANT: Respond with ONLY a valid JSON object. Do not include any explanatory text, reasoning, or markdown formatting. Your entire response must be parseable JSON."""
-
-        # Add extra reminder for Ollama/reasoning models
-        if self.using_ollama:
-            prompt += "\n\nReminder: Output ONLY the JSON object, nothing else. Start your response with { and end with }"
-
-        return prompt
\ No newline at end of file
+{self.PROMPT_TASK}{reminder}"""
\ No newline at end of file
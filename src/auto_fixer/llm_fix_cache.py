@@ -0,0 +1,103 @@
+"""
+LLM Fix Cache - Persistent Cache for Generated Test Fixes
+
+The fix loop sends the same prompt again whenever a failure recurs: on the
+next auto-fix run, on a CI re-run, or when several runs share a checkout.
+This module stores the code generated for a prompt in SQLite, keyed by a
+hash of the full request (messages and model), so a repeated prompt is
+answered without calling the LLM. Fixes that fail validation are discarded
+so they are not served again.
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+class LLMFixCache:
+    """
+    SQLite-backed cache of generated fixes.
+
+    Entries are keyed by a SHA-256 of the request, so only byte-identical
+    prompts hit. The cache is best-effort: any SQLite error degrades to a
+    cache miss.
+    """
+
+    def __init__(self, db_path: Path, verbose: bool = False):
+        self.db_path = Path(db_path)
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        try:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            # Shared with the classifier's result cache
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fixes ("
+                "hash TEXT PRIMARY KEY, fixed_code TEXT, created_at INT)"
+            )
+            self._conn.commit()
+        except (OSError, sqlite3.Error) as e:
+            if self.verbose:
+                print(f"Fix cache unavailable: {e}")
+            self._conn = None
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached fix.
+
+        Returns:
+            The stored fixed code, or None on a miss
+        """
+        if self._conn is None:
+            return None
+
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT fixed_code FROM fixes WHERE hash = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Could not read fix cache: {e}")
+            return None
+
+        return row[0] if row else None
+
+    def put(self, key: str, fixed_code: str) -> None:
+        """Store (or replace) a fix."""
+        if self._conn is None:
+            return
+
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO fixes VALUES (?, ?, ?)",
+                    (key, fixed_code, int(time.time()))
+                )
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Could not write fix cache: {e}")
+
+    def delete(self, key: str) -> None:
+        """Remove a fix (e.g. one that failed validation)."""
+        if self._conn is None:
+            return
+
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM fixes WHERE hash = ?", (key,))
+        except sqlite3.Error as e:
+            if self.verbose:
+                print(f"Could not update fix cache: {e}")
+
+    def close(self) -> None:
+        """Close the underlying connection."""
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+            self._conn = None
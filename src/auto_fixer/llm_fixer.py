@@ -4,14 +4,50 @@ LLM Fixer
 Generates fixed versions of failing test functions.
 """
 
+import datetime
+import hashlib
+import json
 import os
-import sys
-from typing import Optional
-
-# Add parent directory to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 from .failure_parser import TestFailure
+from .gen_clients import gen_module, shared_client
+from .llm_classifier import THINK_CLOSE, THINK_OPEN, _token_counter
+from .llm_fix_cache import LLMFixCache
+
+CODE_FENCE = "```"
+
+# One file of the source context ("# path" then a python code block)
+_SOURCE_FILE_RE = re.compile(r'^# (\S[^\n]*)\n```python\n(.*?)\n```$', re.MULTILINE | re.DOTALL)
+
+# Element markers in the source context ("# function: name (line 12)")
+_SOURCE_ELEMENT_RE = re.compile(r'^# \w+: [^\s(]+ \(line \d+\)$', re.MULTILINE)
+
+_IDENTIFIER_RE = re.compile(r'[A-Za-z_]\w+')
+
+
+def _split_source(source_code: str) -> List[str]:
+    """
+    Split a formatted source context into its elements.
+
+    Returns:
+        Each element in its own file block, in context order
+    """
+    chunks = []
+    for block in _SOURCE_FILE_RE.finditer(source_code):
+        file_path, code = block.groups()
+        # Each element runs from its marker to the next marker; text before
+        # the first marker (or a file without markers) is kept whole
+        starts = [0] + [match.start() for match in _SOURCE_ELEMENT_RE.finditer(code)]
+        for start, end in zip(starts, starts[1:] + [len(code)]):
+            element = code[start:end].strip()
+            if element:
+                chunks.append(f"# {file_path}\n```python\n{element}\n```\n")
+    return chunks
 
 
 class LLMFixer:
@@ -41,65 +77,211 @@ Rules:
 
 Return the complete fixed test function code."""
 
-    def __init__(self, verbose: bool = False):
-        """Initialize LLM fixer."""
+    # Static fixing guide, sent as a second system message so that it is
+    # part of the request prefix shared by every fix request
+    FIX_GUIDE = """# Common Patterns to Fix
+
+1. **Missing API key handling:**
+   - Mock the `verify_api_key` dependency
+   - Or set `REQUIRE_API_KEY=false` in environment
+   - Example: `monkeypatch.setenv("REQUIRE_API_KEY", "false")`
+
+2. **Missing fixture mocking:**
+   - Use `monkeypatch.setattr()` to mock required attributes
+   - Use `@patch()` decorator for external dependencies
+   - Mock database connections, external APIs, etc.
+
+3. **Incorrect imports:**
+   - Ensure all required imports are present
+   - Use correct module paths
+
+4. **Wrong test setup:**
+   - Initialize required fixtures properly
+   - Set up test data correctly
+   - Clean up after test if needed"""
+
+    # Sections of the per-attempt prompt (see _build_prompt)
+    PROMPT_FAILURE = """# Fix This Failing Test
+
+## Original Test Code
+```python
+{test_code}
+```
+
+## Error Information
+**Exception:** {exception_type}
+**Message:** {error_message}
+
+## Traceback
+```
+{traceback}
+```
+"""
+
+    PROMPT_PREVIOUS_FIX_WITH_OUTPUT = """
+## Previous Fix Attempt (Failed)
+```python
+{previous_fix_attempt}
+```
+
+## Why the Previous Fix Failed
+When we ran pytest on the above fix, it still failed with this output:
+
+```
+{previous_failure_output}
+```
+
+**IMPORTANT:** Analyze WHY this fix failed:
+- Is the API key dependency still not being handled?
+- Are there other dependencies or fixtures that need to be mocked?
+- Is the mock setup incorrect?
+- Are there missing imports?
+- Does the test need different assertions?
+
+Generate a NEW fix that addresses these specific failure reasons. Don't repeat the same approach!
+"""
+
+    PROMPT_PREVIOUS_FIX = """
+## Previous Fix Attempt (Failed)
+```python
+{previous_fix_attempt}
+```
+
+The previous fix attempt failed. Try a different approach.
+"""
+
+    PROMPT_TASK = """
+## Task
+Generate a fixed version of the test function that will pass, using the
+source code above and the common patterns to fix.
+
+Return ONLY the complete fixed test function code (include decorators, docstring, everything).
+"""
+
+    def __init__(self, verbose: bool = False, cache_dir: Optional[Path] = None):
+        """
+        Initialize LLM fixer.
+
+        Args:
+            verbose: Print progress and debug output
+            cache_dir: Directory of the persistent fix cache
+                (default: .autofixer_cache in the working directory)
+        """
         self.verbose = verbose
-        self.client = None
-        self.using_ollama = False
 
-        # Check if Ollama should be used (local LLM)
+        # Check if a local LLM should be used: a llama.cpp server
+        # (LLAMACPP_SERVER_URL) takes precedence over Ollama
         # Only check OLLAMA_MODEL for LLM provider (OLLAMA_HOST is for embeddings)
-        ollama_model = os.getenv("OLLAMA_MODEL", "").strip()
-        if ollama_model:
-            try:
-                # Load Ollama client dynamically
-                import importlib.util
-                from pathlib import Path
-
-                current_file = Path(__file__).resolve()
-                ollama_client_path = current_file.parent.parent / 'gen' / 'ollama_client.py'
+        # The client itself is created on first use (see client)
+        self.using_llamacpp = bool(os.getenv("LLAMACPP_SERVER_URL", "").strip())
+        self.using_ollama = not self.using_llamacpp and bool(os.getenv("OLLAMA_MODEL", "").strip())
+
+        # Persistent cache of generated fixes: a prompt that was already
+        # answered (same failure on a later run) skips the LLM call
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else Path(".autofixer_cache")
+        self.use_cache = os.getenv("AUTOFIXER_LLM_CACHE", "1").lower() not in ("0", "false", "no")
+        self._fix_cache: Optional[LLMFixCache] = None
+        # Cache key of each fix handed out, so a rejected fix can be evicted
+        self._fix_keys: Dict[str, str] = {}
+
+        # Ollama: keep the model (and the KV cache of the shared prompt
+        # prefix) loaded between calls, with room for the full context
+        self._ollama_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "24h")
+        self._ollama_options = {"num_ctx": int(os.getenv("OLLAMA_NUM_CTX", "16384"))}
+
+        # Prompt budget: the context window minus room for the answer
+        if self.using_ollama:
+            self._context_window = self._ollama_options["num_ctx"]
+        else:
+            # llama-server splits its context (-c) between its slots (--parallel)
+            window_default = "16384" if self.using_llamacpp else "128000"
+            self._context_window = int(os.getenv("AUTOFIXER_LLM_CONTEXT_WINDOW", window_default))
+        self.completion_reserve = int(os.getenv("AUTOFIXER_FIX_COMPLETION_TOKENS", "4096"))
+
+        # Concurrent requests in fix_many
+        self.max_concurrency = max(1, int(os.getenv("AUTOFIXER_LLM_CONCURRENCY", "8")))
+
+        # Stream responses and stop the generation once the code block is
+        # complete (default for local LLMs; Azure buffers server-side anyway)
+        stream_default = "1" if self.using_ollama or self.using_llamacpp else "0"
+        self.stream_early_exit = os.getenv(
+            "AUTOFIXER_LLM_STREAM_EARLY_EXIT", stream_default
+        ).lower() in ("1", "true", "yes")
+
+        # Save the parts of every fix prompt for inspection (opt-in)
+        self.debug_dir = Path("debug_prompts")
+        self.save_debug_prompts = os.getenv("AUTOFIXER_DEBUG_PROMPTS", "").lower() in ("1", "true", "yes")
+        if self.save_debug_prompts:
+            self.debug_dir.mkdir(parents=True, exist_ok=True)
+
+    @cached_property
+    def client(self):
+        """
+        LLM client, created on first use.
 
-                spec = importlib.util.spec_from_file_location(
-                    "ollama_client_llm_fixer",
-                    str(ollama_client_path)
+        Loading the client modules imports openai (and its dependencies),
+        which callers that never request a fix shouldn't pay for.
+        """
+        if self.using_llamacpp:
+            try:
+                # llama.cpp server: OpenAI-compatible API, same client module
+                openai_module = gen_module('openai_client')
+                client = shared_client(
+                    ("llamacpp", os.getenv("LLAMACPP_SERVER_URL", "").strip()),
+                    openai_module.get_llamacpp_client
                 )
-                ollama_module = importlib.util.module_from_spec(spec)
-                sys.modules['ollama_client_llm_fixer'] = ollama_module
-                spec.loader.exec_module(ollama_module)
+                if self.verbose:
+                    print(f"Using llama.cpp server for fixing: {os.getenv('LLAMACPP_SERVER_URL')}")
+                return client
+            except Exception as e:
+                self.using_llamacpp = False
+                self.using_ollama = bool(os.getenv("OLLAMA_MODEL", "").strip())
+                if self.verbose:
+                    print(f"Could not initialize llama.cpp client: {e}")
 
-                self.client = ollama_module.get_ollama_llm_client()
-                self.using_ollama = True
-                if verbose:
+        if self.using_ollama:
+            try:
+                # Load Ollama client dynamically (once per process)
+                ollama_module = gen_module('ollama_client')
+                client = shared_client(
+                    ("ollama", os.getenv("OLLAMA_HOST", "http://localhost:11434")),
+                    ollama_module.get_ollama_llm_client
+                )
+                if self.verbose:
                     print(f"Using Ollama LLM for fixing: {os.getenv('OLLAMA_MODEL', 'deepseek-r1:latest')}")
+                return client
             except Exception as e:
-                if verbose:
+                self.using_ollama = False
+                if self.verbose:
                     print(f"Could not initialize Ollama LLM client: {e}")
                     print(f"Falling back to Azure OpenAI")
 
         # Fall back to Azure OpenAI if Ollama not configured or failed
-        if self.client is None:
-            try:
-                # Load OpenAI client dynamically (avoid gen/__init__.py relative imports)
-                import importlib.util
-                from pathlib import Path
-
-                current_file = Path(__file__).resolve()
-                openai_client_path = current_file.parent.parent / 'gen' / 'openai_client.py'
-
-                spec = importlib.util.spec_from_file_location(
-                    "openai_client_llm_fixer",
-                    str(openai_client_path)
-                )
-                openai_module = importlib.util.module_from_spec(spec)
-                sys.modules['openai_client_llm_fixer'] = openai_module
-                spec.loader.exec_module(openai_module)
+        try:
+            # Load OpenAI client dynamically (avoid gen/__init__.py relative imports)
+            openai_module = gen_module('openai_client')
+            endpoint = os.getenv("AZURE_OPENAI_ENDPOINT") or os.getenv("AZURE_OPENAI_API_ENDPOINT", "")
+            client = shared_client(("azure", endpoint), openai_module.get_openai_client)
+            if self.verbose:
+                print(f"Using Azure OpenAI for fixing")
+            return client
+        except Exception as e:
+            print(f"Warning: Could not initialize OpenAI client: {e}")
+            return None
 
-                self.client = openai_module.get_openai_client()
-                if verbose:
-                    print(f"Using Azure OpenAI for fixing")
-            except Exception as e:
-                print(f"Warning: Could not initialize OpenAI client: {e}")
-                self.client = None
+    def _model_name(self) -> str:
+        """Model (or deployment) name for the active provider."""
+        if self.using_llamacpp:
+            # llama-server serves the model it was started with; the name
+            # only matters to servers that host several
+            return os.getenv("LLAMACPP_MODEL", "default")
+        if self.using_ollama:
+            return os.getenv("OLLAMA_MODEL", "deepseek-r1:latest")
+        # Azure OpenAI
+        model_name = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+        if not model_name:
+            raise ValueError("AZURE_OPENAI_DEPLOYMENT environment variable not set")
+        return model_name
 
     def fix_test(
         self,
@@ -135,39 +317,183 @@ Return the complete fixed test function code."""
             previous_failure_output
         )
 
-        # DEBUG: Show prompt size
-        prompt_lines = user_prompt.count('\n')
-        prompt_chars = len(user_prompt)
-        estimated_tokens = prompt_chars // 4  # Rough estimate: 4 chars per token
-        print(f"Prompt size: {prompt_lines} lines, {prompt_chars} chars (~{estimated_tokens} tokens)")
-
         try:
             # Call LLM
-            # Get model name based on provider
-            if self.using_ollama:
-                model_name = os.getenv("OLLAMA_MODEL", "deepseek-r1:latest")
-            else:
-                # Azure OpenAI
-                model_name = os.getenv("AZURE_OPENAI_DEPLOYMENT")
-                if not model_name:
-                    raise ValueError("AZURE_OPENAI_DEPLOYMENT environment variable not set")
-
-            # Build request parameters
-            request_params = {
-                "model": model_name,
-                "messages": [
-                    {"role": "system", "content": self.SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                # NO max_completion_tokens limit - let reasoning models use what they need
-            }
-
-            # Only set temperature if environment variable is set
-            # Some Azure deployments don't support custom temperature
-            temp = os.getenv("AUTOFIXER_LLM_TEMPERATURE")
-            if temp is not None:
-                request_params["temperature"] = float(temp)
+            model_name = self._model_name()
+
+            messages = self._fit_messages(failure, test_code, source_code, user_prompt, model_name)
+            request_params = self._request_params(model_name, messages)
+            return self._generate_fix(request_params)
+
+        except Exception as e:
+            print(f"Error generating fix: {e}")
+            return None
+
+    def _build_messages(self, source_code: str, user_prompt: str) -> List[Dict[str, str]]:
+        """
+        Arrange a fix request so that its prefix can be served from the
+        provider's prompt cache.
+
+        The static instructions come first, then the source code (the same
+        for every attempt at one test), and the per-attempt details last.
+
+        Args:
+            source_code: Relevant source code being tested
+            user_prompt: Failure details and task (see _build_prompt)
+
+        Returns:
+            Chat messages
+        """
+        # NO truncation - send all source code (embeddings already filtered to relevant code)
+        # Modern LLMs can handle large contexts (deepseek-r1: 64k, gpt-4o-mini: 128k)
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "system", "content": self.FIX_GUIDE},
+            {"role": "user", "content": f"## Source Code Being Tested\n```python\n{source_code}\n```"},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _fit_messages(
+        self,
+        failure: TestFailure,
+        test_code: str,
+        source_code: str,
+        user_prompt: str,
+        model_name: str
+    ) -> List[Dict[str, str]]:
+        """
+        Build the request messages, trimming the source code if the prompt
+        would not leave completion_reserve tokens of the context window.
+
+        An over-long prompt would otherwise fail (or be truncated by
+        Ollama) only after a full round-trip.
+
+        Args:
+            failure: TestFailure object
+            test_code: Failing test code (or test file) in the prompt
+            source_code: Relevant source code being tested
+            user_prompt: Failure details and task (see _build_prompt)
+            model_name: Model whose tokenizer counts the tokens
+
+        Returns:
+            Chat messages
+        """
+        count_tokens = _token_counter(model_name)
+        messages = self._build_messages(source_code, user_prompt)
+        tokens = [count_tokens(message["content"]) for message in messages]
+        budget = self._context_window - self.completion_reserve
+
+        if sum(tokens) > budget:
+            # Source code is the only part that can be cut: give it what the
+            # rest of the prompt leaves
+            source_budget = budget - (sum(tokens) - tokens[2])
+            source_code = self._trim_source(failure, test_code, source_code, source_budget, count_tokens)
+            messages = self._build_messages(source_code, user_prompt)
+            tokens[2] = count_tokens(messages[2]["content"])
+
+        # DEBUG: Show prompt size
+        prompt_lines = sum(message["content"].count('\n') for message in messages)
+        prompt_chars = sum(len(message["content"]) for message in messages)
+        print(f"Prompt size: {prompt_lines} lines, {prompt_chars} chars ({sum(tokens)} tokens)")
+
+        return messages
+
+    def _trim_source(
+        self,
+        failure: TestFailure,
+        test_code: str,
+        source_code: str,
+        budget: int,
+        count_tokens
+    ) -> str:
+        """
+        Most relevant source elements that fit in budget tokens.
+
+        Elements are ranked by the identifiers they share with the
+        traceback, error message and test code; greedy, so a large element
+        that doesn't fit may leave room for smaller ones.
+
+        Args:
+            failure: TestFailure object
+            test_code: Failing test code
+            source_code: Formatted source context
+            budget: Tokens available for the source code
+            count_tokens: Token count function (see _token_counter)
 
+        Returns:
+            The kept elements, in context order
+        """
+        chunks = _split_source(source_code)
+        failure_words = set(_IDENTIFIER_RE.findall(
+            f"{failure.traceback}\n{failure.error_message}\n{test_code}"
+        ))
+        overlap = [len(failure_words.intersection(_IDENTIFIER_RE.findall(chunk))) for chunk in chunks]
+
+        kept = []
+        for index in sorted(range(len(chunks)), key=lambda i: overlap[i], reverse=True):
+            tokens = count_tokens(chunks[index])
+            if tokens <= budget:
+                kept.append(index)
+                budget -= tokens
+
+        print(f"Source trimmed to {len(kept)}/{len(chunks)} elements to fit the context window")
+        return "\n".join(chunks[index] for index in sorted(kept)) or "# No relevant source code found"
+
+    def _request_params(self, model_name: str, messages: List[Dict[str, str]]) -> dict:
+        """
+        Build the chat completion parameters for a fix request.
+
+        Args:
+            model_name: Model or deployment name
+            messages: Chat messages (see _build_messages)
+
+        Returns:
+            Keyword arguments for client.chat.completions.create
+        """
+        request_params = {
+            "model": model_name,
+            "messages": messages,
+            # NO max_completion_tokens limit - let reasoning models use what they need
+        }
+
+        # Only set temperature if environment variable is set
+        # Some Azure deployments don't support custom temperature
+        temp = os.getenv("AUTOFIXER_LLM_TEMPERATURE")
+        if temp is not None:
+            request_params["temperature"] = float(temp)
+
+        # Ollama reuses the KV cache of a matching prefix only while the
+        # model stays loaded and the prompt fits in its context
+        if self.using_ollama:
+            request_params["keep_alive"] = self._ollama_keep_alive
+            request_params["options"] = self._ollama_options
+
+        return request_params
+
+    def _generate_fix(self, request_params: dict) -> str:
+        """
+        Call the LLM and extract the fixed code, answering repeated prompts
+        from the fix cache.
+
+        Args:
+            request_params: Chat completion parameters
+
+        Returns:
+            Fixed code
+        """
+        cache = self._cache()
+        cache_key = None
+        if cache is not None:
+            cache_key = self._cache_key(request_params["messages"], request_params["model"])
+            cached = cache.get(cache_key)
+            if cached is not None:
+                print("Using cached fix")
+                self._fix_keys[cached] = cache_key
+                return cached
+
+        if self.stream_early_exit:
+            fixed_code = self._stream_code(request_params)
+        else:
             response = self.client.chat.completions.create(**request_params)
 
             # Extract fixed code
@@ -176,11 +502,126 @@ Return the complete fixed test function code."""
             # Clean up markdown code blocks if present
             fixed_code = self._extract_code(content)
 
-            return fixed_code
+        if cache_key is not None and fixed_code:
+            cache.put(cache_key, fixed_code)
+            self._fix_keys[fixed_code] = cache_key
 
-        except Exception as e:
-            print(f"Error generating fix: {e}")
-            return None
+        return fixed_code
+
+    def _stream_code(self, request_params: dict) -> str:
+        """
+        Stream the response and stop the generation at the end of the code.
+
+        Reading stops once a python (or unlabelled) code block is closed, so
+        any explanation the model would write after it is never generated.
+        A leading <think> block is skipped, so code drafted in the reasoning
+        can't end the response early.
+
+        Args:
+            request_params: Parameters for the API call
+
+        Returns:
+            Code of that block, or the content as _extract_code returns it
+        """
+        stream = self.client.chat.completions.create(**request_params, stream=True)
+        text = ""
+        body_start = 0  # where the answer starts (after the <think> block)
+        thinking = None
+        fences = []  # positions of the code fences in the answer
+
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                piece = chunk.choices[0].delta.content
+                if not piece:
+                    continue
+                # Fences and tags may be split across pieces
+                scan_from = max(body_start, len(text) - len(THINK_CLOSE))
+                text += piece
+
+                if thinking is None:
+                    lead = text.lstrip()
+                    if THINK_OPEN.startswith(lead):
+                        continue
+                    thinking = lead.startswith(THINK_OPEN)
+                    scan_from = 0
+
+                if thinking:
+                    think_end = text.find(THINK_CLOSE, scan_from)
+                    if think_end == -1:
+                        continue
+                    thinking = False
+                    body_start = scan_from = think_end + len(THINK_CLOSE)
+
+                fence = text.find(CODE_FENCE, max(scan_from, fences[-1] + len(CODE_FENCE) if fences else 0))
+                while fence != -1:
+                    fences.append(fence)
+                    fence = text.find(CODE_FENCE, fence + len(CODE_FENCE))
+
+                # Every second fence closes a block; stop at the first block
+                # _extract_code would pick, skipping other languages
+                for opening, closing in zip(fences[::2], fences[1::2]):
+                    start = opening + len(CODE_FENCE)
+                    line_end = text.find("\n", start, closing)
+                    label = text[start:closing if line_end == -1 else line_end]
+                    if label.strip() in ("python", ""):
+                        return text[start + len(label):closing].strip()
+        finally:
+            stream.close()
+
+        # No complete code block: same as the non-streamed path
+        return self._extract_code(text.strip())
+
+    def reject_fix(self, fixed_code: str) -> None:
+        """
+        Evict a fix that failed validation from the cache.
+
+        Args:
+            fixed_code: Code returned by fix_test
+        """
+        cache_key = self._fix_keys.pop(fixed_code, None)
+        if cache_key is not None and self._fix_cache is not None:
+            self._fix_cache.delete(cache_key)
+
+    def _cache(self) -> Optional[LLMFixCache]:
+        """Open the fix cache on first use; None if caching is disabled."""
+        if self._fix_cache is None and self.use_cache:
+            self._fix_cache = LLMFixCache(self.cache_dir / "llm.db", verbose=self.verbose)
+        return self._fix_cache
+
+    @staticmethod
+    def _cache_key(messages: List[Dict[str, str]], model_name: str) -> str:
+        """
+        Content hash of a fix request.
+
+        Returns:
+            SHA-256 hex digest
+        """
+        parts = [message["content"] for message in messages] + [model_name]
+        # NUL-separated so that shifting text between messages changes the key
+        return hashlib.sha256("\0".join(parts).encode('utf-8', errors='replace')).hexdigest()
+
+    def fix_many(self, items: List[Tuple]) -> List[Optional[str]]:
+        """
+        Generate fixes for several failures concurrently.
+
+        Each request spends seconds to minutes waiting on the LLM, so up to
+        max_concurrency (AUTOFIXER_LLM_CONCURRENCY) requests are kept in
+        flight instead of issuing them one after another.
+
+        Args:
+            items: (failure, test_code, source_code[, previous_fix_attempt,
+                previous_failure_output]) per failure, as for fix_test
+
+        Returns:
+            Fixed test code (or None) per item, in order
+        """
+        if len(items) <= 1 or self.max_concurrency == 1 or not self.client:
+            return [self.fix_test(*item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(items))) as executor:
+            return list(executor.map(lambda item: self.fix_test(*item), items))
 
     def _build_prompt(
         self,
@@ -193,133 +634,68 @@ Return the complete fixed test function code."""
         """
         Build the prompt for test fixing with learning from previous failures.
 
+        This is the per-attempt part of the request; the source code is sent
+        in its own message (see _build_messages).
+
         Args:
             failure: TestFailure object
             test_code: Original failing test code
-            source_code: Relevant source code
+            source_code: Relevant source code (only saved with the debug output)
             previous_fix_attempt: Previous failed fix
             previous_failure_output: Pytest output from previous failed fix
 
         Returns:
             Formatted prompt
         """
-        # NO truncation - send all source code (embeddings already filtered to relevant code)
-        # Modern LLMs can handle large contexts (deepseek-r1: 64k, gpt-4o-mini: 128k)
-        source_code_display = source_code
-
-        # ============================================================
-        # ADD THIS DEBUG SAVING CODE HERE (before return)
-        # ============================================================
-        import datetime
-        import os
-        
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        debug_dir = "debug_prompts"
-        os.makedirs(debug_dir, exist_ok=True)
-        
-        # Save each component to separate files
-        with open(f"{debug_dir}/{timestamp}_test_code.py", "w") as f:
-            f.write(test_code)
-        
-        with open(f"{debug_dir}/{timestamp}_source_code.py", "w") as f:
-            f.write(source_code_display)
-        
-        with open(f"{debug_dir}/{timestamp}_traceback.txt", "w") as f:
-            f.write(failure.traceback)
-        
-        # Save summary
-        with open(f"{debug_dir}/{timestamp}_summary.txt", "w") as f:
-            f.write(f"PROMPT SIZE BREAKDOWN\n")
-            f.write(f"=" * 70 + "\n\n")
-            f.write(f"Test: {failure.test_file}::{failure.test_name}\n\n")
-            f.write(f"Test code:      {len(test_code):,} chars, {test_code.count(chr(10))} lines\n")
-            f.write(f"Source code:    {len(source_code_display):,} chars, {source_code_display.count(chr(10))} lines\n")
-            f.write(f"Traceback:      {len(failure.traceback):,} chars, {failure.traceback.count(chr(10))} lines\n")
-        print(f"Debug saved: {debug_dir}/{timestamp}_*.txt")
-        # ============================================================
-        prompt = f"""# Fix This Failing Test
-
-## Original Test Code
-```python
-{test_code}
-```
-
-## Error Information
-**Exception:** {failure.exception_type}
-**Message:** {failure.error_message}
-
-## Traceback
-```
-{failure.traceback}
-```
+        if self.save_debug_prompts:
+            self._save_debug_prompt(failure, test_code, source_code)
 
-## Source Code Being Tested
-```python
-{source_code_display}
-```
-"""
+        sections = [self.PROMPT_FAILURE.format(
+            test_code=test_code,
+            exception_type=failure.exception_type,
+            error_message=failure.error_message,
+            traceback=failure.traceback
+        )]
 
         if previous_fix_attempt and previous_failure_output:
-            prompt += f"""
-## Previous Fix Attempt (Failed)
-```python
-{previous_fix_attempt}
-```
-
-## Why the Previous Fix Failed
-When we ran pytest on the above fix, it still failed with this output:
-
-```
-{previous_failure_output[:2000]}
-```
-
-**IMPORTANT:** Analyze WHY this fix failed:
-- Is the API key dependency still not being handled?
-- Are there other dependencies or fixtures that need to be mocked?
-- Is the mock setup incorrect?
-- Are there missing imports?
-- Does the test need different assertions?
-
-Generate a NEW fix that addresses these specific failure reasons. Don't repeat the same approach!
-"""
+            sections.append(self.PROMPT_PREVIOUS_FIX_WITH_OUTPUT.format(
+                previous_fix_attempt=previous_fix_attempt,
+                previous_failure_output=previous_failure_output[:2000]
+            ))
         elif previous_fix_attempt:
-            prompt += f"""
-## Previous Fix Attempt (Failed)
-```python
-{previous_fix_attempt}
-```
-
-The previous fix attempt failed. Try a different approach.
-"""
+            sections.append(self.PROMPT_PREVIOUS_FIX.format(previous_fix_attempt=previous_fix_attempt))
 
-        prompt += """
-## Task
-Generate a fixed version of the test function that will pass.
+        sections.append(self.PROMPT_TASK)
 
-**Common patterns to fix:**
-1. **Missing API key handling:**
-   - Mock the `verify_api_key` dependency
-   - Or set `REQUIRE_API_KEY=false` in environment
-   - Example: `monkeypatch.setenv("REQUIRE_API_KEY", "false")`
+        # One join copies each (possibly large) section once
+        return "".join(sections)
 
-2. **Missing fixture mocking:**
-   - Use `monkeypatch.setattr()` to mock required attributes
-   - Use `@patch()` decorator for external dependencies
-   - Mock database connections, external APIs, etc.
-
-3. **Incorrect imports:**
-   - Ensure all required imports are present
-   - Use correct module paths
-
-4. **Wrong test setup:**
-   - Initialize required fixtures properly
-   - Set up test data correctly
-   - Clean up after test if needed
-
-Return ONLY the complete fixed test function code (include decorators, docstring, everything).
-"""
+    def _save_debug_prompt(self, failure: TestFailure, test_code: str, source_code: str) -> None:
+        """
+        Save the parts of a fix prompt, with their sizes, as one JSON file.
 
-        return prompt
+        Args:
+            failure: TestFailure object
+            test_code: Original failing test code
+            source_code: Source code sent with the prompt
+        """
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        debug_path = self.debug_dir / f"{timestamp}.json"
+        debug_path.write_text(json.dumps({
+            "test": f"{failure.test_file}::{failure.test_name}",
+            "test_code": test_code,
+            "source_code": source_code,
+            "traceback": failure.traceback,
+            "sizes": {
+                name: {"chars": len(text), "lines": text.count("\n")}
+                for name, text in (
+                    ("test_code", test_code),
+                    ("source_code", source_code),
+                    ("traceback", failure.traceback),
+                )
+            },
+        }, indent=2))
+        print(f"Debug saved: {debug_path}")
 
     def _extract_code(self, content: str) -> str:
         """
@@ -385,11 +761,6 @@ Return ONLY the complete fixed test function code (include decorators, docstring
 {failure.traceback}
 ```
 
-## Source Code
-```python
-{source_code}
-```
-
 ## Task
 Fix the failing test `{failure.test_name}` in this test file.
 You may need to fix imports, fixtures, or the test function itself.
@@ -397,35 +768,11 @@ You may need to fix imports, fixtures, or the test function itself.
 Return the COMPLETE fixed test file."""
 
         try:
-            # Get model name based on provider
-            if self.using_ollama:
-                model_name = os.getenv("OLLAMA_MODEL", "deepseek-r1:latest")
-            else:
-                # Azure OpenAI
-                model_name = os.getenv("AZURE_OPENAI_DEPLOYMENT")
-                if not model_name:
-                    raise ValueError("AZURE_OPENAI_DEPLOYMENT environment variable not set")
-
-            # Build request parameters
-            request_params = {
-                "model": model_name,
-                "messages": [
-                    {"role": "system", "content": self.SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt}
-                ],
-                # NO max_completion_tokens limit - let reasoning models use what they need
-            }
-
-            # Only set temperature if environment variable is set
-            # Some Azure deployments don't support custom temperature
-            temp = os.getenv("AUTOFIXER_LLM_TEMPERATURE")
-            if temp is not None:
-                request_params["temperature"] = float(temp)
-
-            response = self.client.chat.completions.create(**request_params)
+            model_name = self._model_name()
 
-            content = response.choices[0].message.content.strip()
-            return self._extract_code(content)
+            messages = self._fit_messages(failure, full_test_file_content, source_code, prompt, model_name)
+            request_params = self._request_params(model_name, messages)
+            return self._generate_fix(request_params)
 
         except Exception as e:
             print(f"Error generating full file fix: {e}")
@@ -5,9 +5,11 @@ Main orchestrator that coordinates the entire test fixing workflow.
 """
 
 import json
-from typing import List, Dict, Any
+import subprocess
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass, asdict
 import os
+from pathlib import Path
 
 # Use absolute imports to avoid issues when loaded in different contexts
 from .failure_parser import FailureParser, TestFailure
@@ -64,7 +66,7 @@ class AutoTestFixerOrchestrator:
         # Initialize components
         self.failure_parser = FailureParser(test_directory)
         self.rule_classifier = RuleBasedClassifier()
-        self.llm_classifier = LLMClassifier()
+        self.llm_classifier = LLMClassifier(cache_dir=Path(project_root) / ".autofixer_cache")
 
         # Use embedding-enhanced context extractor (hybrid AST + embeddings)
         if use_embeddings:
@@ -81,12 +83,14 @@ class AutoTestFixerOrchestrator:
             if verbose:
                 print("Using AST-only context extraction")
 
-        self.llm_fixer = LLMFixer()
+        self.llm_fixer = LLMFixer(cache_dir=Path(project_root) / ".autofixer_cache")
         self.ast_patcher = ASTPatcher()
 
         # Track results
         self.fix_history: List[FixResult] = []
         self.code_bugs: List[TestFailure] = []
+        # Set when a pytest run hit its timeout (the outcome is unknown)
+        self.pytest_timed_out = False
 
     def run(self, extra_pytest_args: List[str] = None) -> Dict[str, Any]:
         """
@@ -113,7 +117,13 @@ class AutoTestFixerOrchestrator:
 
             # Step 1: Run pytest and parse failures
             print("Step 1: Running pytest and parsing failures...")
-            failures = self.failure_parser.run_and_parse(extra_pytest_args)
+            try:
+                failures = self.failure_parser.run_and_parse(extra_pytest_args)
+            except subprocess.TimeoutExpired:
+                # Nothing is known about the tests: stop, without reporting success
+                self.pytest_timed_out = True
+                print("Pytest run timed out. Stopping.")
+                break
 
             if not failures:
                 print("No test failures found!")
@@ -122,7 +132,38 @@ class AutoTestFixerOrchestrator:
 
             print(f"Found {len(failures)} failing test(s)")
 
-            # Step 2-6: Process each failure
+            # Warm the context caches for all failures in one batch
+            if isinstance(self.context_extractor, EmbeddingContextExtractor):
+                self.context_extractor.extract_context_batch([
+                    (failure.test_file, failure.test_name, failure.error_message)
+                    for failure in failures
+                ])
+
+            # Step 2-3: Classify; failures the rules can't decide go to the
+            # LLM together, so those requests run concurrently
+            prepared = [self._prepare_failure(failure) for failure in failures]
+            undecided = [
+                i for i, (rule_classification, _, _) in enumerate(prepared)
+                if rule_classification != "test_mistake"
+            ]
+            llm_results = dict(zip(undecided, self.llm_classifier.classify_many([
+                (failures[i], prepared[i][1], prepared[i][2], self._source_chunks(failures[i]))
+                for i in undecided
+            ])))
+
+            # Step 5 (first attempt): generate the fixes that are certainly
+            # needed up front, so those requests also run concurrently
+            to_fix = [
+                i for i, (rule_classification, _, _) in enumerate(prepared)
+                if rule_classification == "test_mistake"
+                or (llm_results[i].classification == "test_mistake" and not llm_results[i].fixed_code)
+            ]
+            first_fixes = dict(zip(to_fix, self.llm_fixer.fix_many([
+                (failures[i], prepared[i][1], prepared[i][2])
+                for i in to_fix
+            ])))
+
+            # Step 4-6: Process each failure
             test_mistakes_fixed = []
             code_bugs_found = []
 
@@ -130,7 +171,9 @@ class AutoTestFixerOrchestrator:
                 print(f"\n Processing failure {idx}/{len(failures)}")
                 print(f"Test: {failure.test_name} in {failure.test_file}")
 
-                result = self._process_failure(failure)
+                result = self._process_failure(
+                    failure, prepared[idx - 1], llm_results.get(idx - 1), first_fixes.get(idx - 1)
+                )
                 self.fix_history.append(result)
 
                 if result.classification == "code_bug":
@@ -159,18 +202,21 @@ class AutoTestFixerOrchestrator:
                 print("\nNo test mistakes fixed in this iteration and we've tried multiple times. Stopping.")
                 break
 
+        if isinstance(self.context_extractor, EmbeddingContextExtractor):
+            self.context_extractor.close()
+
         # Final summary
         return self._generate_summary(iteration)
 
-    def _process_failure(self, failure: TestFailure) -> FixResult:
+    def _prepare_failure(self, failure: TestFailure) -> Tuple[str, str, str]:
         """
-        Process a single test failure.
+        Rule-classify a failure and extract its context.
 
         Args:
             failure: TestFailure object
 
         Returns:
-            FixResult object
+            (rule_classification, test_code, source_code)
         """
         # Step 2: Rule-based classification
         rule_classification = self.rule_classifier.classify(failure)
@@ -184,15 +230,59 @@ class AutoTestFixerOrchestrator:
             failure.error_message
         )
 
+        return rule_classification, test_code, source_code
+
+    def _source_chunks(self, failure: TestFailure) -> Optional[List[Tuple[str, float]]]:
+        """
+        Scored source chunks of a failure, for trimming the LLM prompt.
+
+        Returns:
+            (code, relevance score) pairs, or None if the context extractor
+            does not score its context (AST-only extraction)
+        """
+        if not isinstance(self.context_extractor, EmbeddingContextExtractor):
+            return None
+        return self.context_extractor.get_context_chunks(
+            failure.test_file,
+            failure.test_name,
+            failure.error_message
+        )
+
+    def _process_failure(
+        self,
+        failure: TestFailure,
+        prepared: Optional[Tuple[str, str, str]] = None,
+        llm_result: Optional[LLMClassification] = None,
+        first_fix: Optional[str] = None
+    ) -> FixResult:
+        """
+        Process a single test failure.
+
+        Args:
+            failure: TestFailure object
+            prepared: Result of _prepare_failure (computed if not given)
+            llm_result: LLM classification, if already made (classify_many)
+            first_fix: First-attempt fix, if already generated (fix_many)
+
+        Returns:
+            FixResult object
+        """
+        rule_classification, test_code, source_code = prepared or self._prepare_failure(failure)
+
         if rule_classification == "test_mistake":
             print(f"Rule classifier: test_mistake")
-            return self._fix_test_mistake(failure, "rule-based classification", test_code, source_code)
+            return self._fix_test_mistake(
+                failure, "rule-based classification", test_code, source_code, first_fix
+            )
 
         # Step 3: LLM classification
         print(f"Rule classifier: unknown, using LLM...")
 
         # LLM classification (reuse extracted context)
-        llm_result = self.llm_classifier.classify(failure, test_code, source_code)
+        if llm_result is None:
+            llm_result = self.llm_classifier.classify(
+                failure, test_code, source_code, self._source_chunks(failure)
+            )
         print(f"LLM classifier: {llm_result.classification} ({llm_result.reason})")
 
         if llm_result.classification == "test_mistake":
@@ -208,9 +298,11 @@ class AutoTestFixerOrchestrator:
                         fix_successful=True,
                         reason=llm_result.reason
                     )
+                # Don't replay the failed fix from the result cache
+                self.llm_classifier.reject_fix(llm_result.fixed_code)
 
             # If LLM fix didn't work, generate a new fix (reuse context)
-            return self._fix_test_mistake(failure, llm_result.reason, test_code, source_code)
+            return self._fix_test_mistake(failure, llm_result.reason, test_code, source_code, first_fix)
 
         # Code bug - don't fix
         return FixResult(
@@ -227,7 +319,8 @@ class AutoTestFixerOrchestrator:
         failure: TestFailure,
         reason: str,
         test_code: str,
-        source_code: str
+        source_code: str,
+        first_fix: Optional[str] = None
     ) -> FixResult:
         """
         Fix a test mistake with multi-attempt learning.
@@ -240,6 +333,7 @@ class AutoTestFixerOrchestrator:
             reason: Reason for classification
             test_code: Pre-extracted test function code (cached)
             source_code: Pre-extracted source context (cached)
+            first_fix: Fix to use for the first attempt, if already generated
 
         Returns:
             FixResult object
@@ -259,13 +353,16 @@ class AutoTestFixerOrchestrator:
                 print(f"Generating fix (attempt {attempt}/{max_attempts})...")
                 print(f"Learning from previous failure...")
 
-            fixed_code = self.llm_fixer.fix_test(
-                failure,
-                test_code,
-                source_code,
-                previous_fix_attempt=previous_fix,
-                previous_failure_output=previous_failure_output
-            )
+            if attempt == 1 and first_fix:
+                fixed_code = first_fix
+            else:
+                fixed_code = self.llm_fixer.fix_test(
+                    failure,
+                    test_code,
+                    source_code,
+                    previous_fix_attempt=previous_fix,
+                    previous_failure_output=previous_failure_output
+                )
 
             if not fixed_code:
                 if attempt == max_attempts:
@@ -293,7 +390,10 @@ class AutoTestFixerOrchestrator:
                     reason=reason
                 )
 
-            # Fix failed - prepare for next attempt
+            # Fix failed - don't serve it from the cache again
+            self.llm_fixer.reject_fix(fixed_code)
+
+            # Prepare for next attempt
             previous_fix = fixed_code
             previous_failure_output = failure_output
 
@@ -460,6 +560,7 @@ class AutoTestFixerOrchestrator:
 
         summary = {
             "iterations": iterations,
+            "pytest_timed_out": self.pytest_timed_out,
             "total_failures": total_failures,
             "test_mistakes": len(test_mistakes),
             "code_bugs": len(code_bugs),
@@ -475,6 +576,8 @@ class AutoTestFixerOrchestrator:
         print("FINAL SUMMARY")
         print("=" * 80)
         print(f"Iterations: {iterations}/{self.max_iterations}")
+        if self.pytest_timed_out:
+            print(f"Pytest timed out: test results are incomplete")
         print(f"Total unique failures: {total_failures}")
         print(f"Test mistakes: {len(test_mistakes)}")
         print(f"  - Fixed: {len(successful_fixes)}")
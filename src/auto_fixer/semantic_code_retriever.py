@@ -15,7 +15,6 @@ Key advantages over AST-based extraction:
 - ✓ Works with dynamic code patterns
 """
 
-import numpy as np
 import sys
 import os
 from typing import List, Dict, Optional, Tuple
@@ -137,7 +136,8 @@ class SemanticCodeRetriever:
         query: str,
         top_k: int = 10,
         filter_type: Optional[str] = None,
-        min_similarity: float = 0.0
+        min_similarity: float = 0.0,
+        top_k_prefilter: Optional[int] = None
     ) -> List[SearchResult]:
         """
         Search for code elements using a text query.
@@ -147,6 +147,8 @@ class SemanticCodeRetriever:
             top_k: Number of top results to return
             filter_type: Filter by element type ('function', 'class', etc.)
             min_similarity: Minimum similarity threshold (0.0 to 1.0)
+            top_k_prefilter: Candidates kept by the binary (Hamming) prefilter
+                             before exact rescoring (None: exact search only)
 
         Returns:
             List of SearchResult objects, sorted by similarity
@@ -174,36 +176,21 @@ class SemanticCodeRetriever:
                 print(f"Error generating query embedding: {e}")
             return []
 
-        # Calculate similarities
-        similarities = self._compute_similarities(
+        # Score, filter and rank in one vectorized pass
+        indices, similarities = self.indexer.search(
             query_embedding,
-            self.indexer.embeddings
+            top_k,
+            element_type=filter_type,
+            min_similarity=min_similarity,
+            prefilter_k=top_k_prefilter
         )
 
-        # Filter by type if specified
-        if filter_type:
-            indices = [
-                i for i, elem in enumerate(self.indexer.code_elements)
-                if elem.element_type == filter_type
-            ]
-        else:
-            indices = list(range(len(self.indexer.code_elements)))
-
-        # Filter by minimum similarity
-        indices = [i for i in indices if similarities[i] >= min_similarity]
-
-        # Sort by similarity (descending)
-        indices.sort(key=lambda i: similarities[i], reverse=True)
-
-        # Take top K
-        indices = indices[:top_k]
-
         # Build results
         results = []
-        for rank, idx in enumerate(indices, 1):
+        for rank, (idx, similarity) in enumerate(zip(indices, similarities), 1):
             results.append(SearchResult(
                 code_element=self.indexer.code_elements[idx],
-                similarity_score=similarities[idx],
+                similarity_score=float(similarity),
                 rank=rank
             ))
 
@@ -214,7 +201,8 @@ class SemanticCodeRetriever:
         test_code: str,
         error_message: str,
         traceback: str,
-        top_k: int = 10
+        top_k: int = 10,
+        top_k_prefilter: Optional[int] = None
     ) -> List[SearchResult]:
         """
         Search for relevant code based on test failure information.
@@ -224,10 +212,83 @@ class SemanticCodeRetriever:
             error_message: Error message
             traceback: Full traceback
             top_k: Number of results to return
+            top_k_prefilter: Candidates kept by the binary prefilter
+                             (see search_by_query)
 
         Returns:
             List of SearchResult objects
         """
+        query = self._build_failure_query(test_code, error_message, traceback)
+
+        if self.verbose:
+            print(f"Searching for code matching test failure...")
+            print(f"Query length: {len(query)} chars")
+
+        return self.search_by_query(query, top_k=top_k, top_k_prefilter=top_k_prefilter)
+
+    def batch_search_by_test_failure(
+        self,
+        failures: List[Tuple[str, str, str]],
+        top_k: int = 10,
+        top_k_prefilter: Optional[int] = None
+    ) -> List[List[SearchResult]]:
+        """
+        Search for relevant code for several test failures at once.
+
+        All queries are embedded in one API call and scored against the
+        index together (see CodebaseIndexer.search_batch).
+
+        Args:
+            failures: (test_code, error_message, traceback) per failure
+            top_k: Number of results per failure
+            top_k_prefilter: Candidates kept by the binary prefilter
+                             (see search_by_query)
+
+        Returns:
+            One list of SearchResult objects per failure
+        """
+        if not failures:
+            return []
+
+        if not self.indexer.code_elements or self.embedding_client is None:
+            if self.verbose:
+                print("Index is empty or no embedding client available")
+            return [[] for _ in failures]
+
+        queries = [self._build_failure_query(*failure) for failure in failures]
+
+        if self.verbose:
+            print(f"Searching for code matching {len(queries)} test failures...")
+
+        # Generate all query embeddings in one request
+        try:
+            response = self.embedding_client.embeddings.create(
+                model=self.indexer.embedding_model,
+                input=queries
+            )
+            query_embeddings = [data.embedding for data in response.data]
+        except Exception as e:
+            if self.verbose:
+                print(f"Error generating query embeddings: {e}")
+            return [[] for _ in failures]
+
+        results = []
+        for indices, similarities in self.indexer.search_batch(
+            query_embeddings, top_k, prefilter_k=top_k_prefilter
+        ):
+            results.append([
+                SearchResult(
+                    code_element=self.indexer.code_elements[idx],
+                    similarity_score=float(similarity),
+                    rank=rank
+                )
+                for rank, (idx, similarity) in enumerate(zip(indices, similarities), 1)
+            ])
+        return results
+
+    @staticmethod
+    def _build_failure_query(test_code: str, error_message: str, traceback: str) -> str:
+        """Build a search query from test failure information."""
         # Build comprehensive query from failure info
         query_parts = []
 
@@ -248,13 +309,7 @@ class SemanticCodeRetriever:
             query_parts.append("\nTraceback:")
             query_parts.append('\n'.join(relevant_traceback[:10]))
 
-        query = '\n'.join(query_parts)
-
-        if self.verbose:
-            print(f"Searching for code matching test failure...")
-            print(f"Query length: {len(query)} chars")
-
-        return self.search_by_query(query, top_k=top_k)
+        return '\n'.join(query_parts)
 
     def search_by_http_endpoint(
         self,
@@ -438,35 +493,6 @@ class SemanticCodeRetriever:
 
         return verification
 
-    def _compute_similarities(
-        self,
-        query_embedding: List[float],
-        embeddings: List[List[float]]
-    ) -> np.ndarray:
-        """
-        Compute cosine similarities between query and all embeddings.
-
-        Args:
-            query_embedding: Query embedding vector
-            embeddings: List of embedding vectors
-
-        Returns:
-            Array of similarity scores
-        """
-        query_vec = np.array(query_embedding)
-        embeddings_matrix = np.array(embeddings)
-
-        # Normalize
-        query_norm = query_vec / np.linalg.norm(query_vec)
-        embeddings_norm = embeddings_matrix / np.linalg.norm(
-            embeddings_matrix, axis=1, keepdims=True
-        )
-
-        # Cosine similarity
-        similarities = np.dot(embeddings_norm, query_norm)
-
-        return similarities
-
     def get_context_from_results(
         self,
         results: List[SearchResult],
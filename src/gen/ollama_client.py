@@ -6,8 +6,9 @@ Compatible with OpenAI client interface.
 """
 
 import requests
+import json
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 import time
 
 
@@ -36,6 +37,10 @@ class OllamaEmbeddingClient:
         self.host = self.host.rstrip('/')
 
         self.embeddings_url = f"{self.host}/api/embeddings"
+        self.embed_url = f"{self.host}/api/embed"
+
+        # Cleared when the server predates the batch /api/embed endpoint
+        self.batch_endpoint_available = True
 
     def create_embedding(
         self,
@@ -80,6 +85,55 @@ class OllamaEmbeddingClient:
         except (KeyError, ValueError) as e:
             raise RuntimeError(f"Invalid Ollama response format: {e}")
 
+    def create_embeddings(
+        self,
+        input_texts: List[str],
+        model: str = None
+    ) -> List[List[float]]:
+        """
+        Generate embeddings for multiple texts in a single request.
+
+        Uses the batch /api/embed endpoint (one HTTP round-trip for all texts).
+
+        Args:
+            input_texts: Texts to embed
+            model: Model to use (defaults to instance model)
+
+        Returns:
+            List of embedding vectors, in input order
+        """
+        model = model or self.model
+
+        payload = {
+            "model": model,
+            "input": input_texts
+        }
+
+        try:
+            response = requests.post(
+                self.embed_url,
+                json=payload,
+                timeout=60
+            )
+            # A server without the endpoint answers "404 page not found"; a
+            # model that isn't pulled is a 404 too, with an error naming it
+            if response.status_code == 404 and "model" not in response.text.lower():
+                self.batch_endpoint_available = False
+            response.raise_for_status()
+
+            data = response.json()
+            embeddings = data.get("embeddings", [])
+
+            if len(embeddings) != len(input_texts) or not all(embeddings):
+                raise ValueError(f"Expected {len(input_texts)} embeddings, got {len(embeddings)}")
+
+            return embeddings
+
+        except requests.exceptions.RequestException as e:
+            raise RuntimeError(f"Ollama embedding request failed: {e}")
+        except (KeyError, ValueError) as e:
+            raise RuntimeError(f"Invalid Ollama response format: {e}")
+
     def create_embeddings_batch(
         self,
         input_texts: List[str],
@@ -89,6 +143,9 @@ class OllamaEmbeddingClient:
         """
         Generate embeddings for multiple texts.
 
+        Sends all texts in one /api/embed request; falls back to one
+        /api/embeddings request per text (with retries) if that fails.
+
         Args:
             input_texts: List of texts to embed
             model: Model to use (defaults to instance model)
@@ -97,6 +154,12 @@ class OllamaEmbeddingClient:
         Returns:
             List of embedding vectors
         """
+        if input_texts and self.batch_endpoint_available:
+            try:
+                return self.create_embeddings(input_texts, model)
+            except Exception as e:
+                print(f"Batch embedding request failed, embedding texts one at a time: {e}")
+
         embeddings = []
 
         for i, text in enumerate(input_texts):
@@ -213,6 +276,8 @@ class OllamaLLMClient:
         self.model = model or os.getenv("OLLAMA_MODEL", "deepseek-r1:latest")
         self.host = self.host.rstrip('/')
         self.chat_url = f"{self.host}/api/chat"
+        # Keep-alive connection pool for the chat requests
+        self.session = requests.Session()
 
     def chat_completion(
         self,
@@ -220,7 +285,10 @@ class OllamaLLMClient:
         model: str = None,
         max_tokens: Optional[int] = None,
         temperature: Optional[float] = None,
-        stream: bool = False
+        stream: bool = False,
+        format: Optional[Any] = None,
+        keep_alive: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         Generate chat completion.
@@ -231,24 +299,18 @@ class OllamaLLMClient:
             max_tokens: Maximum tokens to generate (ignored for Ollama)
             temperature: Sampling temperature (optional)
             stream: Whether to stream response (False for now)
+            format: "json" or a JSON schema to constrain the output to (optional)
+            keep_alive: How long the model stays loaded after the call (optional)
+            options: Extra model options, e.g. num_ctx (optional)
 
         Returns:
             Response dict compatible with OpenAI format
         """
         model = model or self.model
-
-        payload = {
-            "model": model,
-            "messages": messages,
-            "stream": stream
-        }
-
-        # Add optional parameters
-        if temperature is not None:
-            payload["options"] = {"temperature": temperature}
+        payload = self._build_payload(messages, model, temperature, stream, format, keep_alive, options)
 
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.chat_url,
                 json=payload,
                 timeout=600  # 10 minutes for reasoning models
@@ -286,6 +348,79 @@ class OllamaLLMClient:
         except (KeyError, ValueError) as e:
             raise RuntimeError(f"Invalid Ollama response format: {e}")
 
+    def chat_completion_stream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = None,
+        temperature: Optional[float] = None,
+        format: Optional[Any] = None,
+        keep_alive: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """
+        Generate a chat completion as it is produced.
+
+        Closing the generator closes the connection, which makes Ollama
+        stop generating.
+
+        Args:
+            Same as chat_completion
+
+        Yields:
+            Pieces of the message content
+        """
+        model = model or self.model
+        payload = self._build_payload(messages, model, temperature, True, format, keep_alive, options)
+
+        try:
+            with self.session.post(self.chat_url, json=payload, stream=True, timeout=600) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if "error" in data:
+                        raise RuntimeError(f"Ollama chat request failed: {data['error']}")
+                    content = data.get("message", {}).get("content", "")
+                    if content:
+                        yield content
+                    if data.get("done"):
+                        break
+
+        except requests.exceptions.RequestException as e:
+            raise RuntimeError(f"Ollama chat request failed: {e}")
+        except ValueError as e:
+            raise RuntimeError(f"Invalid Ollama response format: {e}")
+
+    @staticmethod
+    def _build_payload(
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: Optional[float],
+        stream: bool,
+        format: Optional[Any],
+        keep_alive: Optional[str],
+        options: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Build the /api/chat request body."""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": stream
+        }
+
+        # Add optional parameters
+        if options or temperature is not None:
+            payload["options"] = dict(options or {})
+            if temperature is not None:
+                payload["options"]["temperature"] = temperature
+        if format is not None:
+            payload["format"] = format
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+
+        return payload
+
 
 class OllamaLLMAdapter:
     """
@@ -319,16 +454,40 @@ class OllamaLLMAdapter:
             messages: List of message dicts
             max_completion_tokens: Max tokens (ignored for Ollama)
             temperature: Sampling temperature
-            **kwargs: Other params (ignored)
+            **kwargs: Other params; response_format is mapped to Ollama's
+                format, keep_alive, options and stream are passed through,
+                the rest are ignored
 
         Returns:
             Response object compatible with OpenAI format
+            (OllamaChatStream if stream=True)
         """
+        response_format = kwargs.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            output_format = response_format["json_schema"]["schema"]
+        elif response_format.get("type") == "json_object":
+            output_format = "json"
+        else:
+            output_format = None
+
+        if kwargs.get("stream"):
+            return OllamaChatStream(self.client.chat_completion_stream(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                format=output_format,
+                keep_alive=kwargs.get("keep_alive"),
+                options=kwargs.get("options")
+            ))
+
         response_dict = self.client.chat_completion(
             messages=messages,
             model=model,
             max_tokens=max_completion_tokens,
-            temperature=temperature
+            temperature=temperature,
+            format=output_format,
+            keep_alive=kwargs.get("keep_alive"),
+            options=kwargs.get("options")
         )
 
         return OllamaChatResponse(response_dict)
@@ -363,6 +522,36 @@ class OllamaMessage:
         self.content = message_data.get("content", "")
 
 
+class OllamaChatStream:
+    """Streamed response compatible with OpenAI's Stream (iterate chunks, close())."""
+
+    def __init__(self, contents: Iterator[str]):
+        self._contents = contents
+
+    def __iter__(self):
+        for content in self._contents:
+            yield OllamaChatChunk(content)
+
+    def close(self) -> None:
+        """Stop the generation."""
+        self._contents.close()
+
+
+class OllamaChatChunk:
+    """Chunk object compatible with OpenAI's ChatCompletionChunk."""
+
+    def __init__(self, content: str):
+        self.choices = [OllamaChunkChoice(content)]
+
+
+class OllamaChunkChoice:
+    """Chunk choice compatible with OpenAI format."""
+
+    def __init__(self, content: str):
+        self.delta = OllamaMessage({"content": content})
+        self.index = 0
+
+
 def get_ollama_llm_client() -> OllamaLLMAdapter:
     """
     Get Ollama LLM client with OpenAI-compatible interface.
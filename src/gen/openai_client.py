@@ -3,7 +3,7 @@ import os
 import time
 from typing import Dict, List, Optional
 
-from openai import APIError, APITimeoutError, AzureOpenAI, RateLimitError
+from openai import APIError, APITimeoutError, AzureOpenAI, OpenAI, RateLimitError
 
 # Inline env functions to avoid relative import issues when loaded dynamically
 ENABLE_DEBUG = os.getenv("TESTGEN_DEBUG", "0").lower() in ("1", "true", "yes")
@@ -46,6 +46,14 @@ def get_openai_client() -> AzureOpenAI:
     """Get configured Azure OpenAI client (alias for create_client for auto-fixer compatibility)."""
     return create_client()
 
+def get_llamacpp_client() -> OpenAI:
+    """Get an OpenAI client for a llama.cpp server (llama-server serves an OpenAI-compatible API)."""
+    base_url = get_any_env("LLAMACPP_SERVER_URL").rstrip("/")
+    if not base_url.endswith("/v1"):
+        base_url += "/v1"
+    # llama-server only checks the key when started with --api-key
+    return OpenAI(base_url=base_url, api_key=get_optional_env("LLAMACPP_API_KEY", default="no-key"))
+
 def get_deployment_name() -> str:
     """Get the deployment name for Azure OpenAI."""
     return get_any_env("AZURE_OPENAI_DEPLOYMENT", "OPENAI_DEPLOYMENT")
@@ -222,5 +230,5 @@ deployment_name = get_deployment_name
 chat_completion_create = lambda cli, dep, msgs: create_chat_completion(cli, dep, msgs)
 
 # Export exception classes for error handling
-__all__ = ['create_client', 'get_deployment_name', 'create_chat_completion', 
+__all__ = ['create_client', 'get_llamacpp_client', 'get_deployment_name', 'create_chat_completion', 
            'validate_client_configuration', 'RateLimitError', 'APIError', 'APITimeoutError']
\ No newline at end of file